@@ -8,3 +8,40 @@ MAX_REPROMPTS = int(os.getenv("MAX_REPROMPTS", "2"))
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 MOCK_OPENAI = False
 CORS_ALLOW_ORIGINS = os.getenv("CORS_ALLOW_ORIGINS", "*")
+SCHEDULE_CHANGE_LOG_SIZE = int(os.getenv("SCHEDULE_CHANGE_LOG_SIZE", "256"))
+# 設定すると複数ワーカー共有モード（SQLite + Unix ソケットのイベントバス）で動く
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR")
+# /ws/adjustments の購読者ごとのバッファ上限（超えたら切断）と送信タイムアウト
+WS_BUFFER_LIMIT = int(os.getenv("WS_BUFFER_LIMIT", "64"))
+WS_SEND_TIMEOUT_S = float(os.getenv("WS_SEND_TIMEOUT_S", "10"))
+# schedule.updated に載せる差分の行数上限（超えたら base_version だけ送り /api/shifts/changes で取らせる。0 で常に省略）
+WS_DELTA_MAX_ROWS = int(os.getenv("WS_DELTA_MAX_ROWS", "200"))
+# 交代候補の採点（services/candidates.py の SCORERS 名:重み をカンマ区切り。小さいほど優先）
+REPLACEMENT_SCORING = os.getenv("REPLACEMENT_SCORING", "weekly_load:1")
+# pair_not_together の調整案をいくつ返すか（最良案 + 代替案）
+ADJUSTMENT_ALTERNATIVES = int(os.getenv("ADJUSTMENT_ALTERNATIVES", "3"))
+# 調整プレビューの LRU キャッシュ件数（0 で無効）
+PREVIEW_CACHE_SIZE = int(os.getenv("PREVIEW_CACHE_SIZE", "128"))
+# LLM 呼び出し（services/llm_gateway.py）。接続はイベントループごとに 1 つの httpx プールを共有する
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE = int(os.getenv("LLM_MAX_KEEPALIVE", "10"))
+# 同時に飛ばす LLM 呼び出しの上限（超えた分は待たせる）
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
+# /api/shifts/analyze-difficulty で使うモデル
+OPENAI_ANALYSIS_MODEL = os.getenv("OPENAI_ANALYSIS_MODEL", "gpt-3.5-turbo")
+# LLM 応答キャッシュ（services/llm_cache.py）。LLM_CACHE_PATH を空にするとメモリのみ、LLM_CACHE_SIZE=0 で無効
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", os.path.join(os.path.dirname(__file__), "llm_cache.db"))
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "512"))
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", "21600"))
+# 1 リクエストあたりの LLM 呼び出しの予算（services/llm_budget.py）。再生成・再試行を含めた合計
+LLM_DEADLINE_MS = int(os.getenv("LLM_DEADLINE_MS", "20000"))
+LLM_MAX_ATTEMPTS = int(os.getenv("LLM_MAX_ATTEMPTS", "4"))
+LLM_BACKOFF_BASE_MS = int(os.getenv("LLM_BACKOFF_BASE_MS", "200"))
+LLM_BACKOFF_MAX_MS = int(os.getenv("LLM_BACKOFF_MAX_MS", "2000"))
+# 調整ルール生成のプロンプトに載せる従業員（services/employee_context.py）
+# 名前が当たらなかった時に全員を載せる人数の上限と、当たった人に添える紛らわしい人の数
+EMPLOYEE_PROMPT_MAX = int(os.getenv("EMPLOYEE_PROMPT_MAX", "40"))
+EMPLOYEE_PROMPT_EXTRA = int(os.getenv("EMPLOYEE_PROMPT_EXTRA", "5"))
+# 手元で意図を決めきれない時、LLM の意図判定と並行して推測した意図の生成を始める（外れたら取り消す）
+LLM_SPECULATIVE = os.getenv("LLM_SPECULATIVE", "1") == "1"
@@ -1,22 +1,23 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException, Header, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, Response
 from pydantic import BaseModel, EmailStr, Field
-from typing import List, Optional, Dict, Any, Union
+from typing import Any, Dict, Iterable, List, Optional, Union
 import pandas as pd
+import numpy as np
 import io
 from datetime import datetime, date, time, timedelta
 from ortools.sat.python import cp_model
 import json
 import hashlib
-import openai
 import logging
 import httpx
 
 app = FastAPI(title="Hokkoku Bank Shift Tool API", version="1.0.0")
 
-from .config import CORS_ALLOW_ORIGINS, MOCK_OPENAI
+from .config import CORS_ALLOW_ORIGINS, MOCK_OPENAI, OPENAI_ANALYSIS_MODEL, OPENAI_TIMEOUT_APPLY_MS, SHARED_STATE_DIR
 origins = [o.strip() for o in (CORS_ALLOW_ORIGINS or "*").split(",")]
 app.add_middleware(
     CORSMiddleware,
@@ -32,6 +33,10 @@ from .routers import chat as chat_router
 from .routers import adjustments as adjustments_router
 from .routers import adjustments_ws as adjustments_ws_router
 from . import store
+from .services.schedule_table import ScheduleTable, SHIFT_DTYPE, SlotLimitError, slot_code_for
+from .services.shift_validation import check_schedule_rows
+from .services import intent_classifier, llm_gateway, openai_client, response_cache, wire
+from .services.ids import IdAllocator
 
 app.include_router(llm_router.router)
 app.include_router(constraints_router.router)
@@ -39,6 +44,17 @@ app.include_router(chat_router.router)
 app.include_router(adjustments_router.router)
 app.include_router(adjustments_ws_router.router)
 app.mount("/static", StaticFiles(directory="app/static"), name="static")
+# LLM の接続プールを終了時に閉じる
+app.on_event("shutdown")(llm_gateway.aclose)
+# LLM キャッシュの書き込み待ちをファイルに入れてから終わる
+app.on_event("shutdown")(openai_client.flush_cache)
+app.on_event("startup")(intent_classifier.warm)
+
+
+@app.exception_handler(SlotLimitError)
+async def slot_limit_error(request, exc: SlotLimitError):
+    # どの入口（PUT / batch / CSV / チャット）から来ても 400 で断る
+    return JSONResponse(status_code=400, content={"detail": str(exc)})
 
 
 logger = logging.getLogger("backend")
@@ -223,6 +239,23 @@ class SuggestionItem(BaseModel):
     candidates: List[ReplacementCandidate] = []
 
 
+class ShiftBatchOperation(BaseModel):
+    op: str  # 'create' | 'update' | 'delete'
+    id: Optional[int] = None  # update / delete 対象
+    shift: Optional[Shift] = None  # create / update の内容
+
+class ShiftBatchRequest(BaseModel):
+    operations: List[ShiftBatchOperation]
+
+class ShiftBatchResponse(BaseModel):
+    message: str
+    created: List[Shift] = []
+    updated: List[Shift] = []
+    deleted: List[int] = []
+    schedule_version: int
+    warnings: List[str] = []
+    structured_warnings: Optional[List[dict]] = []
+
 class ShiftPreviewResponse(BaseModel):
     week_start: date
     week_end: date
@@ -270,9 +303,23 @@ employees_db: List[Employee] = [
     for emp_data in default_employees_data
 ]
 
+def _employees_document() -> List[Dict[str, Any]]:
+    return [e.model_dump(mode="json") for e in employees_db]
+
+def _employees_master() -> List[Dict[str, Any]]:
+    """store に渡す従業員マスタ（交代候補の採点で role / skill_level も使う）"""
+    return [{"id": e.id, "name": e.name, "role": e.role, "skill_level": e.skill_level} for e in employees_db]
+
+def sync_employees_cache():
+    """employees_db の変更を store の従業員キャッシュ（とバージョン）に反映する"""
+    version = store.share_document("employees", _employees_document()) if store.shared_state_enabled() else None
+    store.set_employees_cache(_employees_master(), version=version)
+
 # store.pyのキャッシュを初期化
-store.set_employees_cache([{"id": e.id, "name": e.name} for e in employees_db])
-shifts_db: List[Shift] = []
+sync_employees_cache()
+# store のコミット済みテーブルを指す（読み取り専用）。更新は store.schedule_transaction() で行い、
+# コミットの度に _adopt_state() で差し替わる
+shifts_db: ScheduleTable = store.current_schedule_table().with_model(Shift)
 
 shift_cache = {}
 
@@ -312,6 +359,10 @@ def is_cache_valid(cache_key: str, max_age_minutes: int = 60) -> bool:
     return age_minutes < max_age_minutes
 constraints_db: List[Constraint] = []
 shift_change_requests_db: List[ShiftChangeRequest] = []
+shift_change_requests_by_id: Dict[int, ShiftChangeRequest] = {}
+shift_change_request_ids = IdAllocator()
+# 申請作成時点の週スナップショット（申請ID -> 列指向テーブル）。snapshot_shifts はレスポンス時にのみ生成する
+shift_change_snapshots: Dict[int, ScheduleTable] = {}
 
 SLOT_TO_TIME = {
     "early": (time(8, 0), time(16, 0)),
@@ -330,14 +381,70 @@ def match_employee_by_name(name: str) -> Optional[int]:
         return partial[0]
     return None
 
-def find_shift_by_employee_date_slot(employee_id: int, date_value: date, slot: str) -> Optional[Shift]:
+def find_shift_index_by_employee_date_slot(employee_id: int, date_value: date, slot: str, table: Optional[ScheduleTable] = None) -> Optional[int]:
     if slot not in SLOT_TO_TIME:
         return None
     start_t, end_t = SLOT_TO_TIME[slot]
-    for s in shifts_db:
-        if s.employee_id == employee_id and s.date == date_value and s.start_time == start_t and s.end_time == end_t:
-            return s
-    return None
+    return (shifts_db if table is None else table).find(employee_id, date_value, start_t, end_t)
+
+def find_shift_by_employee_date_slot(employee_id: int, date_value: date, slot: str) -> Optional[Shift]:
+    table = shifts_db
+    i = find_shift_index_by_employee_date_slot(employee_id, date_value, slot, table)
+    return table[i] if i is not None else None
+
+def with_snapshot(req: ShiftChangeRequest) -> ShiftChangeRequest:
+    """レスポンス用に snapshot_shifts を展開したコピーを返す"""
+    snap = shift_change_snapshots.get(req.id)
+    if snap is None:
+        return req
+    return req.model_copy(update={"snapshot_shifts": snap.to_shifts()})
+
+# 共有モードでは申請 1 件を 1 ドキュメントにする（書き込みは件数によらず 1 件分）。
+# 週スナップショットは作成時に 1 度だけ列指向のまま別ドキュメントで共有する
+_CHANGE_REQUEST_DOC = "shift_change_request:"
+_CHANGE_SNAPSHOT_DOC = store.TABLE_DOC + "shift_change_snapshot:"
+
+def _share_change_request(req: ShiftChangeRequest, snapshot: bool = False) -> None:
+    if not store.shared_state_enabled():
+        return
+    if snapshot and req.id in shift_change_snapshots:
+        store.share_table(f"{_CHANGE_SNAPSHOT_DOC}{req.id}", shift_change_snapshots[req.id])
+    store.share_document(f"{_CHANGE_REQUEST_DOC}{req.id}", req.model_dump(mode="json", exclude={"snapshot_shifts"}))
+
+def _adopt_state(name: str, payload: Any, version: int) -> None:
+    """store 側の更新（スケジュールのコミット、他ワーカーの書き込み）をこのモジュールのグローバルへ反映する"""
+    global shifts_db
+    if name == "schedule":
+        shifts_db = payload.with_model(Shift)
+    elif name == "employees":
+        employees_db[:] = [Employee(**e) for e in payload]
+        shift_cache.clear()
+        store.set_employees_cache(_employees_master(), version=version)
+    elif name.startswith(_CHANGE_SNAPSHOT_DOC):
+        shift_change_snapshots[int(name[len(_CHANGE_SNAPSHOT_DOC):])] = payload
+    elif name.startswith(_CHANGE_REQUEST_DOC):
+        req = ShiftChangeRequest(**payload)
+        old = shift_change_requests_by_id.get(req.id)
+        if old is not None:
+            shift_change_requests_db[next(i for i, r in enumerate(shift_change_requests_db) if r is old)] = req
+        else:
+            shift_change_requests_db.append(req)
+            if len(shift_change_requests_db) > 1 and shift_change_requests_db[-2].id > req.id:
+                shift_change_requests_db.sort(key=lambda r: r.id)
+        shift_change_requests_by_id[req.id] = req
+        shift_change_request_ids.observe(req.id)
+
+store.on_state_change(_adopt_state)
+if SHARED_STATE_DIR:
+    # uvicorn --workers N 用。状態は SQLite、WS イベントは Unix ソケットでワーカー間に配る
+    store.enable_shared_state(SHARED_STATE_DIR, seed={"employees": _employees_document})
+    response_cache.use_token(store.shared_token())
+
+    @app.middleware("http")
+    async def refresh_shared_state(request, call_next):
+        # 他ワーカーの書き込み待ちで SharedState のロックを取れない間も、イベントループは止めない
+        await run_in_threadpool(store.refresh_shared_state)
+        return await call_next(request)
 
 def get_week_range_containing(d: date) -> tuple[date, date]:
     weekday = d.weekday()  # Monday=0
@@ -409,7 +516,8 @@ def apply_request_on_copy(shifts: List[Shift], req: ShiftChangeRequest) -> tuple
 
     return new_list, added, removed, updated
 
-def apply_shift_change_request(req: ShiftChangeRequest) -> None:
+def apply_shift_change_request(req: ShiftChangeRequest, table: ScheduleTable) -> None:
+    """申請内容を table（schedule_transaction の作業コピー）に反映する"""
     logger.info(
         "Apply shift change request id=%s type=%s employee_id=%s employee_name=%s date=%s from=%s to=%s target_employee_id=%s target_employee_name=%s",
         req.id, req.type, req.employee_id, req.employee_name, req.date, req.from_slot, req.to_slot, req.target_employee_id, req.target_employee_name,
@@ -430,9 +538,9 @@ def apply_shift_change_request(req: ShiftChangeRequest) -> None:
         # delete any shift on that date (single slot assumed)
         deleted = False
         for slot_id in ["early", "late", "night"]:
-            shift = find_shift_by_employee_date_slot(req.employee_id, req.date, slot_id)
-            if shift:
-                shifts_db.remove(shift)
+            i = find_shift_index_by_employee_date_slot(req.employee_id, req.date, slot_id, table)
+            if i is not None:
+                table.delete([i])
                 deleted = True
         if not deleted:
             logger.error("absence target shift not found for employee_id=%s date=%s", req.employee_id, req.date)
@@ -442,14 +550,12 @@ def apply_shift_change_request(req: ShiftChangeRequest) -> None:
         if not req.from_slot or not req.to_slot:
             logger.error("change_time missing from_slot/to_slot")
             raise HTTPException(status_code=400, detail="from_slot と to_slot が必要です")
-        src = find_shift_by_employee_date_slot(req.employee_id, req.date, req.from_slot)
-        if not src:
+        src = find_shift_index_by_employee_date_slot(req.employee_id, req.date, req.from_slot, table)
+        if src is None:
             logger.error("change_time source shift not found employee_id=%s date=%s slot=%s", req.employee_id, req.date, req.from_slot)
             raise HTTPException(status_code=404, detail="変更元のシフトが見つかりません")
         new_start, new_end = SLOT_TO_TIME[req.to_slot]
-        src.start_time = new_start
-        src.end_time = new_end
-        src.updated_at = datetime.now()
+        table.update(src, start_time=new_start, end_time=new_end, updated_at=datetime.now())
 
     elif req.type == "add_shift":
         if not req.to_slot:
@@ -457,7 +563,7 @@ def apply_shift_change_request(req: ShiftChangeRequest) -> None:
             raise HTTPException(status_code=400, detail="to_slot が必要です")
         start_t, end_t = SLOT_TO_TIME[req.to_slot]
         new_shift = Shift(
-            id=len(shifts_db) + 1,
+            id=table.allocate_id(),
             employee_id=req.employee_id,
             date=req.date,
             start_time=start_t,
@@ -466,7 +572,7 @@ def apply_shift_change_request(req: ShiftChangeRequest) -> None:
             created_at=datetime.now(),
             updated_at=datetime.now(),
         )
-        shifts_db.append(new_shift)
+        table.append(new_shift)
 
     elif req.type == "swap":
         if not req.from_slot or not req.to_slot:
@@ -482,18 +588,16 @@ def apply_shift_change_request(req: ShiftChangeRequest) -> None:
             else:
                 logger.error("swap missing target_employee_id and target_employee_name")
                 raise HTTPException(status_code=400, detail="swap には target_employee_id もしくは target_employee_name が必要です")
-        a = find_shift_by_employee_date_slot(req.employee_id, req.date, req.from_slot)
-        b = find_shift_by_employee_date_slot(req.target_employee_id, req.date, req.to_slot)
-        if not a or not b:
-            logger.error("swap target shifts not found a_exists=%s b_exists=%s", bool(a), bool(b))
+        a = find_shift_index_by_employee_date_slot(req.employee_id, req.date, req.from_slot, table)
+        b = find_shift_index_by_employee_date_slot(req.target_employee_id, req.date, req.to_slot, table)
+        if a is None or b is None:
+            logger.error("swap target shifts not found a_exists=%s b_exists=%s", a is not None, b is not None)
             raise HTTPException(status_code=404, detail="入れ替え対象のシフトが見つかりません")
         # swap start/end times between slots
-        a_start, a_end = a.start_time, a.end_time
-        b_start, b_end = b.start_time, b.end_time
-        a.start_time, a.end_time = b_start, b_end
-        b.start_time, b.end_time = a_start, a_end
-        a.updated_at = datetime.now()
-        b.updated_at = datetime.now()
+        a_start, a_end = SLOT_TO_TIME[req.from_slot]
+        b_start, b_end = SLOT_TO_TIME[req.to_slot]
+        table.update(a, start_time=b_start, end_time=b_end, updated_at=datetime.now())
+        table.update(b, start_time=a_start, end_time=a_end, updated_at=datetime.now())
 
     else:
         raise HTTPException(status_code=400, detail=f"未対応の type: {req.type}")
@@ -512,13 +616,21 @@ async def get_config():
     return {"mode": "mock" if MOCK_OPENAI else "real"}
 
 @app.get("/api/employees", response_model=EmployeeResponse)
-async def get_employees():
-    """Get all employees"""
-    return EmployeeResponse(
-        employees=employees_db,
-        total=len(employees_db)
+async def get_employees(if_none_match: Optional[str] = Header(None, alias="If-None-Match")) -> Response:
+    """Get all employees (ETag: employee master version)"""
+    return response_cache.versioned_json(
+        "employees",
+        store.employees_version(),
+        if_none_match,
+        lambda: {"employees": [e.model_dump() for e in employees_db], "total": len(employees_db)},
     )
 
+def _replace_employees(employees: List[Employee]) -> None:
+    # 共有モードでは SQLite への書き込みを伴うので、async のルートからはスレッドプールで呼ぶ
+    employees_db[:] = employees
+    shift_cache.clear()
+    sync_employees_cache()
+
 @app.post("/api/employees/import", response_model=ImportResponse)
 async def import_employees_csv(file: UploadFile = File(...)):
     """Import employees from CSV file"""
@@ -555,7 +667,7 @@ async def import_employees_csv(file: UploadFile = File(...)):
                 detail=f"必要な列が不足しています: {', '.join(missing_columns)}。必要な列: {', '.join(required_columns)}"
             )
         
-        employees_db.clear()
+        # 全行を検証し終えてから差し替える（途中の行で失敗しても既存のマスタは変えない）
         imported_employees = []
         current_time = datetime.now()
         
@@ -600,7 +712,6 @@ async def import_employees_csv(file: UploadFile = File(...)):
                     created_at=current_time,
                     updated_at=current_time
                 )
-                employees_db.append(employee)
                 imported_employees.append(employee)
                 
             except HTTPException:
@@ -614,7 +725,7 @@ async def import_employees_csv(file: UploadFile = File(...)):
         if not imported_employees:
             raise HTTPException(status_code=400, detail="CSVファイルに有効なデータが含まれていません")
         
-        shift_cache.clear()
+        await run_in_threadpool(_replace_employees, imported_employees)
         
         return ImportResponse(
             message=f"{len(imported_employees)}件の従業員データをインポートしました",
@@ -632,136 +743,17 @@ async def import_employees_csv(file: UploadFile = File(...)):
         raise HTTPException(status_code=500, detail=f"ファイル処理中にエラーが発生しました: {str(e)}")
 
 @app.delete("/api/employees")
-async def clear_employees():
+def clear_employees():
     """Clear all employees (for testing purposes)"""
-    employees_db.clear()
-    shift_cache.clear()
+    _replace_employees([])
     return {"message": "All employees cleared"}
 
-def is_consecutive_timeslot(prev_time: str, current_time: str) -> bool:
-    """連続する時間枠かどうかを判定"""
-    if prev_time == "08:00" and current_time == "16:00":
-        return True
-    elif prev_time == "16:00" and current_time == "00:00":
-        return True
-    elif prev_time == "00:00" and current_time == "08:00":
-        return True
-    return False
-
-def validate_shift_constraints(shifts: List[Shift], employees: List[Employee]) -> List[ShiftValidationWarning]:
-    """Validate shift constraints and return warnings"""
-    warnings = []
-    employee_name_map = {emp.id: emp.name for emp in employees}
-    
-    employee_shifts = {}
-    daily_shifts = {}
-    
-    for shift in shifts:
-        if shift.employee_id not in employee_shifts:
-            employee_shifts[shift.employee_id] = []
-        employee_shifts[shift.employee_id].append(shift)
-        
-        if shift.date not in daily_shifts:
-            daily_shifts[shift.date] = []
-        daily_shifts[shift.date].append(shift)
-    
-    consecutive_timeslot_employees = []
-    consecutive_timeslot_data = {}
-    
-    for employee_id, emp_shifts in employee_shifts.items():
-        emp_shifts.sort(key=lambda x: (x.date, x.start_time))
-        consecutive_slots = 1
-        warning_added_for_period = False
-        consecutive_periods = [(emp_shifts[0].date, emp_shifts[0].start_time.strftime("%H:%M"))] if emp_shifts else []
-        
-        for i in range(1, len(emp_shifts)):
-            current_shift = emp_shifts[i]
-            prev_shift = emp_shifts[i-1]
-            
-            prev_time_str = prev_shift.start_time.strftime("%H:%M")
-            current_time_str = current_shift.start_time.strftime("%H:%M")
-            
-            if (current_shift.date == prev_shift.date and 
-                is_consecutive_timeslot(prev_time_str, current_time_str)) or \
-               (current_shift.date == prev_shift.date + timedelta(days=1) and 
-                prev_time_str == "16:00" and current_time_str == "00:00") or \
-               (current_shift.date == prev_shift.date + timedelta(days=1) and 
-                prev_time_str == "00:00" and current_time_str == "08:00"):
-                consecutive_slots += 1
-                consecutive_periods.append((current_shift.date, current_time_str))
-                if consecutive_slots > 2 and not warning_added_for_period:
-                    employee_name = employee_name_map.get(employee_id, f"従業員ID{employee_id}")
-                    consecutive_timeslot_employees.append(f"{employee_name}(ID：{employee_id}番)")
-                    consecutive_timeslot_data[employee_id] = consecutive_periods.copy()
-                    warning_added_for_period = True
-            else:
-                consecutive_slots = 1
-                consecutive_periods = [(current_shift.date, current_time_str)]
-                warning_added_for_period = False
-    
-    if consecutive_timeslot_employees:
-        employee_list = "、".join(consecutive_timeslot_employees)
-        all_affected_employees = list(consecutive_timeslot_data.keys())
-        all_affected_dates = []
-        for periods in consecutive_timeslot_data.values():
-            all_affected_dates.extend([f"{d.strftime('%Y-%m-%d')}_{t}" for d, t in periods])
-        
-        warnings.append(ShiftValidationWarning(
-            type="consecutive_timeslots",
-            message=f"{employee_list}が連続する時間枠でシフトに入っています",
-            affected_employees=all_affected_employees,
-            affected_dates=list(set(all_affected_dates))
-        ))
-    
-    insufficient_staff_dates = []
-    skill_requirement_dates = []
-    
-    for shift_date, day_shifts in daily_shifts.items():
-        shift_counts = {}
-        for shift in day_shifts:
-            shift_type = f"{shift.start_time}-{shift.end_time}"
-            shift_counts[shift_type] = shift_counts.get(shift_type, 0) + 1
-        
-        for shift_type, count in shift_counts.items():
-            if count < 2:
-                date_str = shift_date.strftime("%Y-%m-%d")
-                if date_str not in insufficient_staff_dates:
-                    insufficient_staff_dates.append(date_str)
-    
-    employee_skill_map = {emp.id: emp.skill_level for emp in employees}
-    
-    for shift_date, day_shifts in daily_shifts.items():
-        max_skill = max([employee_skill_map.get(shift.employee_id, 1) for shift in day_shifts], default=1)
-        if max_skill < 3:
-            date_str = shift_date.strftime("%Y-%m-%d")
-            if date_str not in skill_requirement_dates:
-                skill_requirement_dates.append(date_str)
-    
-    if insufficient_staff_dates:
-        if len(insufficient_staff_dates) == 1:
-            date_display = insufficient_staff_dates[0]
-        else:
-            date_display = "、".join(insufficient_staff_dates)
-        
-        warnings.append(ShiftValidationWarning(
-            type="insufficient_staff",
-            message=f"{date_display}において人員が不足しています",
-            affected_dates=insufficient_staff_dates
-        ))
-    
-    if skill_requirement_dates:
-        if len(skill_requirement_dates) == 1:
-            date_display = skill_requirement_dates[0]
-        else:
-            date_display = "、".join(skill_requirement_dates)
-        
-        warnings.append(ShiftValidationWarning(
-            type="skill_requirement",
-            message=f"{date_display}においてスキルレベル3以上の従業員が不足しています",
-            affected_dates=skill_requirement_dates
-        ))
-    
-    return warnings
+def validate_shift_constraints(shifts: Iterable[Shift], employees: List[Employee]) -> List[ShiftValidationWarning]:
+    """Validate shift constraints and return warnings（判定は services/shift_validation の配列実装）"""
+    table = shifts if isinstance(shifts, ScheduleTable) else ScheduleTable.from_shifts(Shift, shifts)
+    skill_of = {emp.id: emp.skill_level for emp in employees}
+    name_of = {emp.id: emp.name for emp in employees}
+    return [ShiftValidationWarning(**w) for w in check_schedule_rows(table.rows, skill_of, name_of)]
 
 def generate_shifts_with_ortools(request: ShiftGenerationRequest, employees: List[Employee]) -> ShiftGenerationResponse:
     """Generate optimal shifts using OR-Tools CP-SAT"""
@@ -919,10 +911,84 @@ def generate_shifts_with_ortools(request: ShiftGenerationRequest, employees: Lis
     }
     return ShiftGenerationResponse(**response_data)
 
+SHIFT_FIELDS = list(Shift.model_fields)
+
+def _encode_cursor(key: tuple) -> str:
+    return ".".join(str(v) for v in key)
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        d, sl, emp, sid = (int(v) for v in cursor.split("."))
+    except Exception:
+        raise HTTPException(status_code=400, detail="cursor が不正です")
+    return d, sl, emp, sid
+
 @app.get("/api/shifts")
-async def get_shifts():
-    """Get all shifts"""
-    return {"shifts": shifts_db, "total": len(shifts_db)}
+async def get_shifts(
+    if_none_match: Optional[str] = Header(None, alias="If-None-Match"),
+    date_from: Optional[date] = Query(None, alias="from"),
+    date_to: Optional[date] = Query(None, alias="to"),
+    employee_id: Optional[int] = Query(None),
+    slot: Optional[str] = Query(None),
+    limit: Optional[int] = Query(None, ge=1, le=5000),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+    accept: Optional[str] = Header(None),
+) -> Response:
+    """Get shifts (ETag: schedule version)
+
+    Without query parameters every shift is returned in storage order. With any of
+    from/to (YYYY-MM-DD, inclusive), employee_id, slot (early|late|night), limit/cursor
+    or fields (comma separated) the result is served from the date-ordered index,
+    sorted by date and slot, and `next_cursor` points at the next page.
+
+    `Accept: application/vnd.hokkoku.compact+json` (or `application/msgpack`) returns
+    `shifts` as integer-coded columns; see app/services/wire.py.
+    """
+    params = (date_from, date_to, employee_id, slot, limit, cursor, fields)
+    version, table = store.schedule_snapshot()
+    table = table.with_model(Shift)
+    media = wire.negotiate(accept)
+    negotiated = dict(media_type=media, encode=lambda obj: wire.encode(media, obj), vary="Accept")
+    if all(p is None for p in params):
+        if wire.is_compact(media):
+            build = lambda: {"shifts": wire.pack_rows(table.rows, timestamps=True), "total": len(table)}
+        else:
+            build = lambda: {"shifts": table.to_dicts(), "total": len(table)}
+        return response_cache.versioned_json("shifts" + wire.SUFFIX[media], version, if_none_match, build, **negotiated)
+
+    slot_code = None
+    if slot is not None:
+        if slot not in SLOT_TO_TIME:
+            raise HTTPException(status_code=400, detail="slot は early|late|night で指定してください")
+        slot_code = slot_code_for(slot)
+    after = _decode_cursor(cursor) if cursor else None
+    selected = None
+    if fields:
+        selected = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in selected if f not in SHIFT_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"未対応の fields: {', '.join(unknown)}")
+
+    def build():
+        idx = table.query(date_from, date_to, employee_id, slot_code)
+        total = len(idx)
+        if after is not None:
+            idx = idx[table.start_after(idx, after):]
+        next_cursor = None
+        if limit is not None and len(idx) > limit:
+            idx = idx[:limit]
+            next_cursor = _encode_cursor(table.sort_key(int(idx[-1])))
+        if wire.is_compact(media):
+            items = wire.pack_rows(table.rows[idx], selected, timestamps=not selected)
+        else:
+            items = table.to_dicts(idx)
+            if selected:
+                items = [{k: it[k] for k in selected} for it in items]
+        return {"shifts": items, "total": total, "next_cursor": next_cursor}
+
+    key = hashlib.md5(repr(params).encode()).hexdigest()[:12]
+    return response_cache.versioned_json(f"shifts.{key}{wire.SUFFIX[media]}", version, if_none_match, build, **negotiated)
 
 @app.get("/api/shifts/by")
 async def get_shift_by(
@@ -940,8 +1006,48 @@ async def get_shift_by(
         raise HTTPException(status_code=404, detail="Shift not found")
     return shift
 
+@app.get("/api/shifts/changes")
+async def get_shift_changes(since: int = Query(..., ge=0)):
+    """Changes (added/removed/updated) to the schedule since the given schedule_version.
+
+    Falls back to a full snapshot (full=true) when `since` is no longer in the change log.
+    """
+    version, changes = store.schedule_changes_since(since)
+    if changes is None:
+        version, current = store.schedule_snapshot()
+        return {"since": since, "schedule_version": version, "full": True, "shifts": current.with_model(Shift).to_dicts()}
+
+    def rows(recs):
+        return ScheduleTable.from_rows(Shift, np.array(recs, dtype=SHIFT_DTYPE)).to_dicts()
+
+    return {
+        "since": since,
+        "schedule_version": version,
+        "full": False,
+        "added": rows(changes["added"]),
+        "removed": rows(changes["removed"]),
+        "updated": [
+            {"before": b, "after": a}
+            for b, a in zip(rows([b for b, _ in changes["updated"]]), rows([a for _, a in changes["updated"]]))
+        ],
+    }
+
+@app.get("/api/shifts/warnings")
+async def get_shift_warnings():
+    """Current constraint warnings for the whole schedule.
+
+    コミットごとに差分で更新している結果を返すだけなので、スケジュールの規模によらない。
+    """
+    version, items = store.schedule_warnings()
+    warnings_list = [ShiftValidationWarning(**w) for w in items]
+    return {
+        "schedule_version": version,
+        "warnings": [w.message for w in warnings_list],
+        "structured_warnings": [w.model_dump() for w in warnings_list],
+    }
+
 @app.post("/api/shifts/generate", response_model=ShiftGenerationResponse)
-async def generate_shifts(request: ShiftGenerationRequest):
+def generate_shifts(request: ShiftGenerationRequest):
     """Generate optimal shifts using OR-Tools CP-SAT with caching"""
     logger.info(
         "Generate shifts requested: start=%s end=%s employees=%s",
@@ -981,11 +1087,11 @@ async def generate_shifts(request: ShiftGenerationRequest):
             "timestamp": datetime.now()
         }
         
-        for shift in result.shifts:
-            shift.id = len(shifts_db) + 1
-            shifts_db.append(shift)
-        from . import store
-        store.set_current_schedule(shifts_db)
+        with store.schedule_transaction(days={s.date for s in result.shifts}) as table:
+            for shift in result.shifts:
+                shift.id = table.allocate_id()
+                table.append(shift)
+        store.publish_schedule_updated()
         return result
         
     except Exception as e:
@@ -993,39 +1099,103 @@ async def generate_shifts(request: ShiftGenerationRequest):
         raise HTTPException(status_code=500, detail=f"Shift generation failed: {str(e)}")
 
 @app.put("/api/shifts/{shift_id}")
-async def update_shift(shift_id: int, shift_data: Shift):
+def update_shift(shift_id: int, shift_data: Shift):
     """Update a specific shift"""
-    shift_index = None
-    for i, shift in enumerate(shifts_db):
-        if shift.id == shift_id:
-            shift_index = i
-            break
-    if shift_index is None:
-        raise HTTPException(status_code=404, detail="Shift not found")
-    shift_data.id = shift_id
-    shift_data.updated_at = datetime.now()
-    shifts_db[shift_index] = shift_data
-    from . import store
-    store.set_current_schedule(shifts_db)
+    with store.schedule_transaction(days=[shift_data.date], ids=[shift_id]) as table:
+        shift_index = table.find_id(shift_id)
+        if shift_index is None:
+            raise HTTPException(status_code=404, detail="Shift not found")
+        shift_data.id = shift_id
+        shift_data.updated_at = datetime.now()
+        table.replace(shift_index, shift_data)
+    store.publish_schedule_updated()
     return {"message": "Shift updated successfully", "shift": shift_data}
 
 @app.delete("/api/shifts/{shift_id}")
-async def delete_shift(shift_id: int):
+def delete_shift(shift_id: int):
     """Delete a specific shift"""
-    for i, shift in enumerate(shifts_db):
-        if shift.id == shift_id:
-            del shifts_db[i]
-            from . import store
-            store.set_current_schedule(shifts_db)
-            return {"message": "Shift deleted"}
-    raise HTTPException(status_code=404, detail="Shift not found")
+    with store.schedule_transaction(ids=[shift_id]) as table:
+        i = table.find_id(shift_id)
+        if i is None:
+            raise HTTPException(status_code=404, detail="Shift not found")
+        table.delete([i])
+    store.publish_schedule_updated()
+    return {"message": "Shift deleted"}
+
+@app.post("/api/shifts/batch", response_model=ShiftBatchResponse)
+def batch_shifts(request: ShiftBatchRequest):
+    """Apply create/update/delete operations atomically with a single version bump
+
+    All operations are checked before anything is changed; one failing operation
+    rejects the whole batch. The schedule is re-synced, validated and announced
+    (`schedule.updated`) once per batch.
+    """
+    ids = [op.id for op in request.operations if op.id is not None]
+    days = [op.shift.date for op in request.operations if op.shift is not None]
+    with store.schedule_transaction(days=days, ids=ids) as table:
+        live_ids = set(table.rows["id"].tolist())
+        for n, op in enumerate(request.operations):
+            if op.op not in ("create", "update", "delete"):
+                raise HTTPException(status_code=400, detail=f"operations[{n}]: 未対応の op: {op.op}")
+            if op.op in ("create", "update") and op.shift is None:
+                raise HTTPException(status_code=400, detail=f"operations[{n}]: shift が必要です")
+            if op.op in ("update", "delete"):
+                if op.id is None or op.id not in live_ids:
+                    raise HTTPException(status_code=404, detail=f"operations[{n}]: Shift {op.id} not found")
+                if op.op == "delete":
+                    live_ids.discard(op.id)
+
+        now = datetime.now()
+        created: List[Shift] = []
+        updated: List[Shift] = []
+        deleted: List[int] = []
+        touched_days: set[date] = set()
+        for op in request.operations:
+            if op.op == "delete":
+                i = table.find_id(op.id)
+                touched_days.add(table[i].date)
+                deleted.append(op.id)
+                continue
+            shift = op.shift
+            shift.updated_at = now
+            touched_days.add(shift.date)
+            if op.op == "create":
+                shift.id = table.allocate_id()
+                shift.created_at = now
+                table.append(shift)
+                created.append(shift)
+            else:
+                i = table.find_id(op.id)
+                touched_days.add(table[i].date)
+                shift.id = op.id
+                table.replace(i, shift)
+                updated.append(shift)
+        if deleted:
+            table.delete([table.find_id(sid) for sid in deleted])
+    store.publish_schedule_updated()
+
+    # 影響した週だけを一度だけ検証する
+    warnings_list: List[ShiftValidationWarning] = []
+    if touched_days:
+        ws, _ = get_week_range_containing(min(touched_days))
+        _, we = get_week_range_containing(max(touched_days))
+        warnings_list = validate_shift_constraints(shifts_db.between(ws, we), employees_db)
+    logger.info("Shift batch applied: created=%s updated=%s deleted=%s", len(created), len(updated), len(deleted))
+    return ShiftBatchResponse(
+        message=f"{len(request.operations)}件の操作を適用しました",
+        created=created,
+        updated=updated,
+        deleted=deleted,
+        schedule_version=store.schedule_version(),
+        warnings=[w.message for w in warnings_list],
+        structured_warnings=[w.model_dump() for w in warnings_list],
+    )
 
 @app.delete("/api/shifts")
-async def clear_shifts():
+def clear_shifts():
     """Clear all shifts (for testing purposes)"""
-    shifts_db.clear()
-    from . import store
-    store.set_current_schedule(shifts_db)
+    store.set_current_schedule([])
+    store.publish_schedule_updated()
     return {"message": "All shifts cleared"}
 
 @app.post("/api/shifts/analyze-difficulty", response_model=LLMAnalysisResponse)
@@ -1038,33 +1208,32 @@ async def analyze_shift_difficulty(request: LLMAnalysisRequest, api_key: str = H
             error="Missing API key"
         )
     
+    system_prompt = "シフト作成してその結果難しかった点やエラー内容を入力するので、何が難しかった方を記載してください"
+
+    if request.optimization_status == "INFEASIBLE":
+        user_content = f"シフト生成が失敗しました。ステータス: {request.optimization_status}。エラー内容: {request.error_content}。警告: {', '.join(request.warnings)}"
+    else:
+        user_content = f"シフト生成が成功しました。ステータス: {request.optimization_status}。警告: {', '.join(request.warnings) if request.warnings else 'なし'}"
+
     try:
-        client = openai.OpenAI(api_key=api_key)
-        
-        system_prompt = "シフト作成してその結果難しかった点やエラー内容を入力するので、何が難しかった方を記載してください"
-        
-        if request.optimization_status == "INFEASIBLE":
-            user_content = f"シフト生成が失敗しました。ステータス: {request.optimization_status}。エラー内容: {request.error_content}。警告: {', '.join(request.warnings)}"
-        else:
-            user_content = f"シフト生成が成功しました。ステータス: {request.optimization_status}。警告: {', '.join(request.warnings) if request.warnings else 'なし'}"
-        
-        response = client.chat.completions.create(
-            model="gpt-3.5-turbo",
-            messages=[
+        # 共有の接続プールで非同期に呼ぶ（イベントループを塞がない）
+        analysis = await llm_gateway.chat(
+            [
                 {"role": "system", "content": system_prompt},
                 {"role": "user", "content": user_content}
             ],
+            model=OPENAI_ANALYSIS_MODEL,
             max_tokens=300,
-            temperature=0.7
+            temperature=0.7,
+            timeout=OPENAI_TIMEOUT_APPLY_MS / 1000.0,
+            api_key=api_key,
+            op="analysis",
         )
-        
-        analysis = response.choices[0].message.content.strip()
-        
         return LLMAnalysisResponse(
-            analysis=analysis,
+            analysis=analysis.strip(),
             success=True
         )
-        
+
     except Exception as e:
         return LLMAnalysisResponse(
             analysis="LLM分析でエラーが発生しました。APIキーを確認してください。",
@@ -1075,34 +1244,42 @@ async def analyze_shift_difficulty(request: LLMAnalysisRequest, api_key: str = H
 @app.post("/api/shift-change", response_model=ShiftChangeRequest)
 async def create_shift_change_request(payload: ShiftChangeRequest):
     """Create a new shift change request (usually from LINE)"""
-    req = payload
-    req.id = len(shift_change_requests_db) + 1
-    req.status = req.status or "pending"
-    req.created_at = datetime.now()
-    req.updated_at = datetime.now()
-
-    # Resolve employee by name if id missing (best-effort)
-    if req.employee_id is None and req.employee_name:
-        resolved_id = match_employee_by_name(req.employee_name)
-        if resolved_id is not None:
-            req.employee_id = resolved_id
-
-    # Capture snapshot (pre-approval) for the week containing the target date
-    try:
-        ws, we = get_week_range_containing(req.date)
-        req.snapshot_week_start = ws
-        req.snapshot_week_end = we
-        week_shifts = [s for s in shifts_db if ws <= s.date <= we]
-        # Deep copy to avoid later mutation side-effects
-        req.snapshot_shifts = [Shift(**s.dict()) for s in week_shifts]
-    except Exception:
-        # best-effort; leave snapshot empty on failure
-        req.snapshot_week_start = req.snapshot_week_start or None
-        req.snapshot_week_end = req.snapshot_week_end or None
-        req.snapshot_shifts = req.snapshot_shifts or None
-
-    shift_change_requests_db.append(req)
+    req = await run_in_threadpool(_create_shift_change_request, payload)
     logger.info("Created shift-change request id=%s type=%s status=%s", req.id, req.type, req.status)
+    return with_snapshot(req)
+
+def _create_shift_change_request(payload: ShiftChangeRequest) -> ShiftChangeRequest:
+    # shared_write() は共有モードで BEGIN IMMEDIATE を待つので、イベントループの外で実行する
+    with store.shared_write():
+        req = payload
+        req.id = shift_change_request_ids.allocate()
+        req.status = req.status or "pending"
+        req.created_at = datetime.now()
+        req.updated_at = datetime.now()
+
+        # Resolve employee by name if id missing (best-effort)
+        if req.employee_id is None and req.employee_name:
+            resolved_id = match_employee_by_name(req.employee_name)
+            if resolved_id is not None:
+                req.employee_id = resolved_id
+
+        # Capture snapshot (pre-approval) for the week containing the target date
+        try:
+            ws, we = get_week_range_containing(req.date)
+            req.snapshot_week_start = ws
+            req.snapshot_week_end = we
+            # Compact copy to avoid later mutation side-effects; materialized only in responses
+            shift_change_snapshots[req.id] = shifts_db.between(ws, we)
+            req.snapshot_shifts = None
+        except Exception:
+            # best-effort; leave snapshot empty on failure
+            req.snapshot_week_start = req.snapshot_week_start or None
+            req.snapshot_week_end = req.snapshot_week_end or None
+            req.snapshot_shifts = req.snapshot_shifts or None
+
+        shift_change_requests_db.append(req)
+        shift_change_requests_by_id[req.id] = req
+        _share_change_request(req, snapshot=True)
     return req
 
 @app.get("/api/shift-change", response_model=ShiftChangeRequestResponse)
@@ -1111,38 +1288,38 @@ async def list_shift_change_requests(status: Optional[str] = Query(None)):
     if status:
         items = [r for r in items if r.status == status]
     logger.info("List shift-change requests status=%s count=%s", status, len(items))
-    return {"requests": items, "total": len(items)}
+    return {"requests": [with_snapshot(r) for r in items], "total": len(items)}
 
 @app.get("/api/shift-change/{request_id}/preview", response_model=ShiftPreviewResponse)
 async def preview_shift_after_request(request_id: int):
-    req = next((r for r in shift_change_requests_db if r.id == request_id), None)
+    req = shift_change_requests_by_id.get(request_id)
     if not req:
         raise HTTPException(status_code=404, detail="申請が見つかりません")
 
     # Use snapshot if available (pre-approval state). Fallback to current.
-    if req.snapshot_shifts and req.snapshot_week_start and req.snapshot_week_end:
-        base_week_shifts = [Shift(**s.dict()) for s in req.snapshot_shifts]
+    snap = shift_change_snapshots.get(req.id)
+    if snap and req.snapshot_week_start and req.snapshot_week_end:
+        base_week_shifts = snap.to_shifts()
         ws = req.snapshot_week_start
         we = req.snapshot_week_end
     else:
         ws, we = get_week_range_containing(req.date)
-        base_week_shifts = [s for s in shifts_db if ws <= s.date <= we]
+        base_week_shifts = shifts_db.between(ws, we).to_shifts()
 
     new_list, added, removed, updated = apply_request_on_copy(base_week_shifts, req)
 
-    # Build suggestions using store.suggest_replacements_for
+    # 抜けた枠の交代候補（週ごとの占有インデックスでまとめて採点）
     suggestions: List[SuggestionItem] = []
     targets: List[Shift] = []
-    targets.extend(removed)
-    for u in updated:
-        targets.append(u.before)
     seen = set()
-    for s in targets:
+    for s in [*removed, *(u.before for u in updated)]:
         key = (s.date, s.start_time, s.end_time)
         if key in seen:
             continue
         seen.add(key)
-        cands = store.suggest_replacements_for(s, max_candidates=3, exclude_ids=[s.employee_id])
+        targets.append(s)
+    ranked = store.suggest_replacements_many(targets, max_candidates=3, exclude_ids=[[s.employee_id] for s in targets])
+    for s, cands in zip(targets, ranked):
         suggestions.append(SuggestionItem(
             date=s.date,
             start_time=s.start_time,
@@ -1161,50 +1338,64 @@ async def preview_shift_after_request(request_id: int):
         suggestions=suggestions,
     )
 
+def _approve_shift_change_request(request_id: int) -> ShiftChangeRequest:
+    with store.shared_write():
+        req = shift_change_requests_by_id.get(request_id)
+        if req is None:
+            raise HTTPException(status_code=404, detail="申請が見つかりません")
+        if req.status != "pending":
+            logger.error("Approve failed: already processed id=%s status=%s", req.id, req.status)
+            raise HTTPException(status_code=400, detail="この申請は処理済みです")
+        with store.schedule_transaction(days=[req.date]) as table:
+            apply_shift_change_request(req, table)
+        req.status = "approved"
+        req.updated_at = datetime.now()
+        _share_change_request(req)
+    store.publish_schedule_updated()
+    return req
+
 @app.post("/api/shift-change/{request_id}/approve", response_model=ShiftChangeRequest)
 async def approve_shift_change_request(request_id: int):
-    for req in shift_change_requests_db:
-        if req.id == request_id:
-            if req.status != "pending":
-                logger.error("Approve failed: already processed id=%s status=%s", req.id, req.status)
-                raise HTTPException(status_code=400, detail="この申請は処理済みです")
-            apply_shift_change_request(req)
-            req.status = "approved"
-            req.updated_at = datetime.now()
-            logger.info("Approved shift-change request id=%s", req.id)
-            # Notify LINE bot (best-effort)
-            try:
-                note = _build_approval_message(req)
-                async with httpx.AsyncClient(timeout=5) as client:
-                    await client.post("http://linebot:8082/notify/approval", json={
-                        "line_user_id": req.line_user_id,
-                        "message": note,
-                    })
-            except Exception as e:
-                logger.error("Failed to notify linebot for approval id=%s: %s", req.id, e)
-            return req
-    raise HTTPException(status_code=404, detail="申請が見つかりません")
+    req = await run_in_threadpool(_approve_shift_change_request, request_id)
+    logger.info("Approved shift-change request id=%s", req.id)
+    # Notify LINE bot (best-effort)
+    try:
+        note = _build_approval_message(req)
+        async with httpx.AsyncClient(timeout=5) as client:
+            await client.post("http://linebot:8082/notify/approval", json={
+                "line_user_id": req.line_user_id,
+                "message": note,
+            })
+    except Exception as e:
+        logger.error("Failed to notify linebot for approval id=%s: %s", req.id, e)
+    return with_snapshot(req)
+
+def _reject_shift_change_request(request_id: int, reason: Optional[str]) -> ShiftChangeRequest:
+    with store.shared_write():
+        req = shift_change_requests_by_id.get(request_id)
+        if req is None:
+            raise HTTPException(status_code=404, detail="申請が見つかりません")
+        if req.status != "pending":
+            logger.error("Reject failed: already processed id=%s status=%s", req.id, req.status)
+            raise HTTPException(status_code=400, detail="この申請は処理済みです")
+        req.status = "rejected"
+        req.reason = reason or req.reason
+        req.updated_at = datetime.now()
+        _share_change_request(req)
+    return req
 
 @app.post("/api/shift-change/{request_id}/reject", response_model=ShiftChangeRequest)
 async def reject_shift_change_request(request_id: int, reason: Optional[str] = None):
-    for req in shift_change_requests_db:
-        if req.id == request_id:
-            if req.status != "pending":
-                logger.error("Reject failed: already processed id=%s status=%s", req.id, req.status)
-                raise HTTPException(status_code=400, detail="この申請は処理済みです")
-            req.status = "rejected"
-            req.reason = reason or req.reason
-            req.updated_at = datetime.now()
-            logger.info("Rejected shift-change request id=%s", req.id)
-            # Notify LINE bot (best-effort)
-            try:
-                note = _build_rejection_message(req)
-                async with httpx.AsyncClient(timeout=5) as client:
-                    await client.post("http://linebot:8082/notify/approval", json={
-                        "line_user_id": req.line_user_id,
-                        "message": note,
-                    })
-            except Exception as e:
-                logger.error("Failed to notify linebot for rejection id=%s: %s", req.id, e)
-            return req
-    raise HTTPException(status_code=404, detail="申請が見つかりません")
+    req = await run_in_threadpool(_reject_shift_change_request, request_id, reason)
+    logger.info("Rejected shift-change request id=%s", req.id)
+    # Notify LINE bot (best-effort)
+    try:
+        note = _build_rejection_message(req)
+        async with httpx.AsyncClient(timeout=5) as client:
+            await client.post("http://linebot:8082/notify/approval", json={
+                "line_user_id": req.line_user_id,
+                "message": note,
+            })
+    except Exception as e:
+        logger.error("Failed to notify linebot for rejection id=%s: %s", req.id, e)
+    return with_snapshot(req)
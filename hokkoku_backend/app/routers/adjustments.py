@@ -1,8 +1,9 @@
-from fastapi import APIRouter, HTTPException, Header
+from fastapi import APIRouter, HTTPException, Header, Response
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from .. import store
 from ..services import adjustments as svc
+from ..services import wire
 from ..schemas import ChangeDelta, ChangeSet, SchedulePreviewResponse
 
 router = APIRouter(prefix="/api/adjustments", tags=["adjustments"])
@@ -30,11 +31,20 @@ class ShiftAdjustResponse(BaseModel):
     error_message: Optional[str] = None
 
 @router.post("/preview", response_model=SchedulePreviewResponse)
-def preview(req: PreviewRequest):
+def preview(req: PreviewRequest, accept: str | None = Header(default=None)):
+    """Accept で compact JSON / MessagePack を選ぶと週のシフトを列形式で返す（services/wire.py）"""
     rule = req.rule
     cs, preview = svc.generate_preview(rule, req.week_start)
+    media = wire.negotiate(accept)
+    if wire.is_compact(media):
+        return Response(content=wire.encode(media, wire.pack_preview(preview)), media_type=media, headers={"Vary": "Accept"})
     return preview
 
+@router.get("/preview/stats")
+def preview_stats():
+    """プレビューキャッシュの件数とヒット率"""
+    return svc.preview_cache_stats()
+
 @router.post("/apply", response_model=Dict[str, Any])
 def apply(req: ApplyRequest, x_role: str | None = Header(default=None, alias="X-Role")):
     if x_role != "admin":
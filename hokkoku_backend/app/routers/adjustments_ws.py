@@ -1,23 +1,51 @@
+import asyncio
+
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from .. import store
+from ..config import WS_SEND_TIMEOUT_S
+from ..services import wire
+from ..services.broadcast import SlowConsumer
 
 router = APIRouter()
 
 @router.websocket("/ws/adjustments")
 async def ws_adjustments(websocket: WebSocket):
+    """?encoding=compact で整数コード化した JSON（テキスト）、?encoding=msgpack で MessagePack（バイナリ）を送る"""
+    media = wire.negotiate(websocket.query_params.get("encoding"))
     await websocket.accept()
     q = store.subscribe_queue()
+
+    async def send(msg):
+        if media == wire.MSGPACK:
+            await websocket.send_bytes(wire.encode_message(media, msg))
+        elif media == wire.COMPACT_JSON:
+            await websocket.send_text(wire.encode_message(media, msg).decode("utf-8"))
+        else:
+            await websocket.send_json(msg)
+
     try:
-        await websocket.send_json({"type": "info", "message": "adjustments ws connected"})
+        await send({"type": "info", "message": "adjustments ws connected", "encoding": media})
         while True:
             msg = await q.get()
-            await websocket.send_json(msg)
+            await asyncio.wait_for(send(msg), timeout=WS_SEND_TIMEOUT_S)
     except WebSocketDisconnect:
         store.unsubscribe_queue(q)
         return
+    except (SlowConsumer, asyncio.TimeoutError):
+        # 受信が追いつかないクライアントは切断し、再接続時に取り直してもらう
+        store.unsubscribe_queue(q)
+        try:
+            await websocket.close(code=1013, reason="slow consumer")
+        except Exception:
+            pass
     except Exception:
         store.unsubscribe_queue(q)
         try:
             await websocket.close(code=1011)
         except Exception:
             pass
+
+@router.get("/api/adjustments/ws/stats")
+def ws_stats():
+    """/ws/adjustments の配信状況（購読者数、バッファ滞留、まとめた件数、切断数）"""
+    return store.broadcast_stats()
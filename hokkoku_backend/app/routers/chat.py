@@ -1,12 +1,16 @@
 from fastapi import APIRouter
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import Optional, List, Dict, Any
+import logging
 from .. import store
 from ..services import intent
-from ..services import openai_client
+from ..services import openai_client, employee_context
+from ..services.llm_budget import Budget
 from ..schemas import Shift
 
 router = APIRouter(prefix="/api/chat", tags=["chat"])
+logger = logging.getLogger("backend")
 
 class ChatParseRequest(BaseModel):
     text: str
@@ -39,53 +43,15 @@ class ChatParseResponse(BaseModel):
     choices: Dict[str, List[str]] = {}
 
 def _extract_names(text: str) -> List[str]:
-    names: List[str] = []
-    for e in store.employees_master():
-        n = e["name"]
-        if n:
-            print(f"DEBUG: Processing employee '{n}'")
-            # 完全一致
-            if n in text:
-                print(f"DEBUG: Found '{n}' via exact match")
-                names.append(n)
-            # 敬語付きでの一致（田中太郎 → 田中さん）
-            else:
-                # 日本語の姓名を正しく分割（最初の2文字を姓とする）
-                if len(n) >= 2:
-                    surname = n[:2]  # 最初の2文字を姓とする
-                    honorific = surname + "さん"
-                    print(f"DEBUG: Checking '{honorific}' in text: '{honorific}' in '{text}' = {honorific in text}")
-                    if honorific in text:
-                        print(f"DEBUG: Found '{n}' via '{honorific}'")
-                        names.append(n)
-                    # 姓のみでの一致（田中太郎 → 田中）
-                    elif surname in text and len(surname) > 1:
-                        print(f"DEBUG: Found '{n}' via '{surname}'")
-                        names.append(n)
-    return list(dict.fromkeys(names))
+    # 同姓同名は名前としては 1 つ
+    return list(dict.fromkeys(e["name"] for e in employee_context.match_names(text, store.employees_master())))
 
 @router.post("/parse", response_model=ChatParseResponse)
 def parse(req: ChatParseRequest):
     text = req.text.strip()
-    print(f"DEBUG: Parsing text: {repr(text)}")
-    print(f"DEBUG: Text length: {len(text)}")
-    print(f"DEBUG: Text bytes: {text.encode('utf-8')}")
-    
-    # 従業員マスタを確認
-    employees = store.employees_master()
-    print(f"DEBUG: Available employees: {employees}")
-    
-    # 名前抽出の詳細デバッグ
+    logger.debug("Parsing text: %r (%d chars)", text, len(text))
     names = _extract_names(text)
-    print(f"DEBUG: Extracted names: {names}")
-    
-    # 各従業員名でのマッチングテスト
-    for e in employees:
-        n = e["name"]
-        if n:
-            print(f"DEBUG: Testing '{n}' in text: '{n}' in '{text}' = {n in text}")
-            if n.split()[0] + "さん" in text:
-                print(f"DEBUG: Found '{n}' via '{n.split()[0]}さん'")
+    logger.debug("Extracted names: %s (of %d employees)", names, len(store.employees_master()))
     
     a = names[0] if len(names) > 0 else None
     b = names[1] if len(names) > 1 else None
@@ -95,7 +61,7 @@ def parse(req: ChatParseRequest):
     if a and b:
         a_id = store.match_employee_id_by_name(a)
         b_id = store.match_employee_id_by_name(b)
-        print(f"DEBUG: Matched IDs - a: {a_id}, b: {b_id}")
+        logger.debug("Matched IDs - a: %s, b: %s", a_id, b_id)
         if a_id is None or b_id is None:
             needs = True
             if a_id is None:
@@ -106,32 +72,40 @@ def parse(req: ChatParseRequest):
     return ChatParseResponse(ok=rule is not None, rule=rule, needs_disambiguation=needs, choices=choices)
 
 @router.post("/shift-adjust", response_model=ChatShiftAdjustResponse)
-def shift_adjust(req: ChatShiftAdjustRequest):
+async def shift_adjust(req: ChatShiftAdjustRequest):
     """シフト調整チャット処理"""
     content = req.content.strip()
     mode = req.mode
     
-    # コンテキストを準備 - shifts_dbから直接取得して同期問題を回避
-    from .. import main
-    current_shifts = main.shifts_db if hasattr(main, 'shifts_db') else []
-    print(f"DEBUG: Loading shifts for context - found {len(current_shifts)} shifts")
+    # コンテキストを準備 - main.shifts_db と store は同じコミット済みテーブルを指している
+    current_shifts = store.current_schedule_table()
+    logger.debug("Loading shifts for context - found %d shifts", len(current_shifts))
     
     if hasattr(req, 'current_shifts') and req.current_shifts:
         current_shifts = req.current_shifts
-        print(f"DEBUG: Using shifts from frontend - found {len(current_shifts)} shifts")
-    
-    if current_shifts:
-        store.set_current_schedule(current_shifts)
-        print(f"DEBUG: Synchronized store with {len(current_shifts)} shifts")
+        logger.debug("Using shifts from frontend - found %d shifts", len(current_shifts))
+        await run_in_threadpool(store.set_current_schedule, current_shifts)
+        logger.debug("Synchronized store with %d shifts", len(current_shifts))
     
     context = {
         "employees": store.employees_master(),
         "current_schedule": current_shifts
     }
     
-    # 意図判定
+    # 意図判定から生成まで、このリクエストの LLM 呼び出しは同じ予算から引く
+    budget = Budget()
+
+    def generate(intent_name: str, b: Budget = budget):
+        if intent_name == "adjust":
+            return openai_client.generate_adjustment_rule(content, context, b)
+        return openai_client.generate_qa(content, context, b)
+
+    first = None
     if mode == "auto":
-        intent_result, confidence = intent.route(mode, content, context)
+        # 意図が LLM 待ちになる場合は、推測した側の生成を並行して始めておく
+        intent_result, confidence, first = await intent.route_speculative(
+            mode, content, context, generate, budget, branch=lambda i: "adjust" if i == "adjust" else "qa"
+        )
     else:
         intent_result = mode
         confidence = 1.0
@@ -140,7 +114,7 @@ def shift_adjust(req: ChatShiftAdjustRequest):
     
     if intent_result == "qa":
         # 質問回答
-        assistant_text = openai_client.generate_qa(content, context)
+        assistant_text = first if first is not None else await generate("qa")
         return ChatShiftAdjustResponse(
             message_id=message_id,
             intent="qa",
@@ -151,19 +125,20 @@ def shift_adjust(req: ChatShiftAdjustRequest):
         )
     elif intent_result == "adjust":
         # 調整処理
-        print(f"DEBUG: Processing adjust request: {content}")
-        result = openai_client.generate_adjustment_rule(content, context)
-        print(f"DEBUG: OpenAI rule generation result: {result}")
+        logger.debug("Processing adjust request: %s", content)
+        result = first if first is not None else await generate("adjust")
+        logger.debug("OpenAI rule generation result: %s", result)
         assistant_text = result.get("assistant_text", "調整案を生成しました。")
         adjustment_rule = result.get("rule")
-        print(f"DEBUG: Extracted adjustment rule: {adjustment_rule}")
+        logger.debug("Extracted adjustment rule: %s", adjustment_rule)
         
         # プレビュー生成（調整ルールがある場合）
         preview = None
         if adjustment_rule:
             try:
                 from ..services import adjustments as adj_svc
-                change_set, preview_data = adj_svc.generate_preview(adjustment_rule, None)
+                # CP-SAT などを含むのでイベントループの外で動かす
+                change_set, preview_data = await run_in_threadpool(adj_svc.generate_preview, adjustment_rule, None)
                 preview = {
                     "week_start": preview_data.week_start.isoformat(),
                     "week_end": preview_data.week_end.isoformat(),
@@ -174,7 +149,7 @@ def shift_adjust(req: ChatShiftAdjustRequest):
                     "change_set_id": change_set.id
                 }
             except Exception as e:
-                print(f"Preview generation error: {e}")
+                logger.exception("Preview generation error: %s", e)
                 assistant_text = f"{assistant_text} (プレビュー生成に失敗しました: {str(e)})"
         
         return ChatShiftAdjustResponse(
@@ -187,7 +162,7 @@ def shift_adjust(req: ChatShiftAdjustRequest):
         )
     else:
         # デフォルトは質問回答
-        assistant_text = openai_client.generate_qa(content, context)
+        assistant_text = first if first is not None else await generate("qa")
         return ChatShiftAdjustResponse(
             message_id=message_id,
             intent="qa",
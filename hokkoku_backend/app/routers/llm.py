@@ -1,9 +1,13 @@
-from fastapi import APIRouter, HTTPException, Path, WebSocket, WebSocketDisconnect
-from typing import Dict, Any
-from ..schemas import SessionCreateRequest, SessionCreateResponse, ChatMessageRequest, ChatMessageResponseQA, ChatMessageResponseApply
+import copy
+from fastapi import APIRouter, HTTPException, Path, Query, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse
+from typing import Dict, Any, List
+from pydantic import ValidationError
+from ..schemas import ValidationErrorItem, SessionCreateRequest, SessionCreateResponse, ChatMessageRequest, ChatMessageResponseQA, ChatMessageResponseApply
 from .. import store
 from ..services import intent as intent_service
-from ..services import openai_client
+from ..services import openai_client, employee_context, llm_gateway, llm_metrics
+from ..services.llm_budget import Budget
 from ..services.validation import validate_constraints
 from ..services.diff import materialize, summarize_diff
 
@@ -14,8 +18,7 @@ def create_session(req: SessionCreateRequest):
     sid = store.create_session(req.title, req.seed_constraints_id)
     return SessionCreateResponse(session_id=sid)
 
-@router.post("/sessions/{session_id}/messages")
-def post_message(session_id: str = Path(...), req: ChatMessageRequest = None):
+def _session_context(session_id: str) -> Dict[str, Any]:
     if session_id not in store.sessions:
         store.sessions[session_id] = {
             "id": session_id,
@@ -24,46 +27,52 @@ def post_message(session_id: str = Path(...), req: ChatMessageRequest = None):
             "created_at": store.now_iso(),
             "retention_until": store.now_iso(),
         }
-    ctx: Dict[str, Any] = {
+    return {
         "session": store.sessions[session_id],
         "constraints": store.current_constraints
     }
-    resolved_intent, confidence = intent_service.route(req.mode or "auto", req.content, ctx)
-    if resolved_intent == "qa":
-        text = openai_client.generate_qa(req.content, ctx)
-        mid = store.save_message({
-            "session_id": session_id,
-            "role": "assistant",
-            "mode": req.mode,
-            "intent": "qa",
-            "confidence": confidence,
-            "assistant_text": text
-        })
-        return ChatMessageResponseQA(message_id=mid, intent="qa", confidence=confidence, assistant_text=text)
-    attempt = 0
-    last_errors = []
-    assistant_text = ""
-    draft_constraints = None
-    diff = None
-    json_patch = None
-    full_json = None
-    while attempt <= 2:
-        attempt += 1
-        out = openai_client.generate_apply(req.content, ctx)
-        assistant_text = out.get("assistant_text", "")
-        spec = out.get("json", {})
-        if spec.get("type") == "patch":
-            json_patch = spec.get("patch", [])
-        if spec.get("type") == "full":
-            full_json = spec.get("full", {})
-        candidate = materialize(spec, store.current_constraints)
-        ok, errors, normalized = validate_constraints(candidate)
-        if ok:
-            draft_constraints = normalized
-            diff = summarize_diff(store.current_constraints, draft_constraints)
-            break
-        else:
-            last_errors = errors
+
+def _branch(intent: str) -> str:
+    # qa 以外（apply / adjust）は変更案の生成に進む
+    return "qa" if intent == "qa" else "apply"
+
+def _evaluate(spec: Dict[str, Any]) -> Dict[str, Any]:
+    """変更案を現在の制約に当てて検証し、通れば差分と下書きを付ける"""
+    out: Dict[str, Any] = {
+        "json_patch": spec.get("patch", []) if spec.get("type") == "patch" else None,
+        "full_json": spec.get("full", {}) if spec.get("type") == "full" else None,
+        "errors": [],
+        "diff_summary": None,
+        "draft_constraints": None,
+    }
+    try:
+        candidate = materialize(spec, copy.deepcopy(store.current_constraints))
+    except Exception as e:  # patch が配列でない・操作の形が違う等。検証エラーとして再生成に回す
+        out["json_patch"] = out["full_json"] = None
+        out["errors"] = [ValidationErrorItem(path="/", message=f"変更案を制約に適用できません（{type(e).__name__}: {e}）")]
+        return out
+    ok, errors, normalized = validate_constraints(candidate)
+    if ok:
+        out["draft_constraints"] = normalized
+        out["diff_summary"] = summarize_diff(store.current_constraints, normalized)
+    else:
+        out["errors"] = errors
+    return out
+
+def _qa_response(session_id: str, req: ChatMessageRequest, confidence: float, text: str) -> ChatMessageResponseQA:
+    mid = store.save_message({
+        "session_id": session_id,
+        "role": "assistant",
+        "mode": req.mode,
+        "intent": "qa",
+        "confidence": confidence,
+        "assistant_text": text
+    })
+    return ChatMessageResponseQA(message_id=mid, intent="qa", confidence=confidence, assistant_text=text)
+
+def _apply_response(session_id: str, req: ChatMessageRequest, confidence: float, assistant_text: str,
+                    result: Dict[str, Any], last_errors: List[ValidationErrorItem]) -> ChatMessageResponseApply:
+    diff = result.get("diff_summary")
     validation = {"ok": diff is not None, "errors": [e.dict() for e in last_errors]}
     mid = store.save_message({
         "session_id": session_id,
@@ -72,29 +81,166 @@ def post_message(session_id: str = Path(...), req: ChatMessageRequest = None):
         "intent": "apply",
         "confidence": confidence,
         "assistant_text": assistant_text,
-        "json_patch": json_patch,
-        "full_json": full_json,
+        "json_patch": result.get("json_patch"),
+        "full_json": result.get("full_json"),
         "validation_ok": validation["ok"],
         "validation_errors": validation["errors"]
     })
-    resp = ChatMessageResponseApply(
+    return ChatMessageResponseApply(
         message_id=mid,
         intent="apply",
         confidence=confidence,
         assistant_text=assistant_text,
-        json_patch=json_patch,
-        full_json=full_json,
+        json_patch=result.get("json_patch"),
+        full_json=result.get("full_json"),
         validation=validation,  # type: ignore
         diff_summary=diff,
-        draft_constraints=draft_constraints
+        draft_constraints=result.get("draft_constraints")
+    )
+
+@router.post("/sessions/{session_id}/messages")
+async def post_message(session_id: str = Path(...), req: ChatMessageRequest = None):
+    ctx = _session_context(session_id)
+    # 意図判定から再生成まで、このリクエストの LLM 呼び出しは同じ予算から引く
+    budget = Budget()
+
+    def generate(intent: str, b: Budget = budget):
+        if intent == "qa":
+            return openai_client.generate_qa(req.content, ctx, b)
+        return openai_client.generate_apply(req.content, ctx, b)
+
+    # 意図が LLM 待ちになる場合は、推測した側の生成を並行して始めておく
+    resolved_intent, confidence, first = await intent_service.route_speculative(
+        req.mode or "auto", req.content, ctx, generate, budget, branch=_branch
     )
-    return resp
+    if resolved_intent == "qa":
+        text = first if first is not None else await generate("qa")
+        return _qa_response(session_id, req, confidence, text)
+    attempt = 0
+    last_errors: List[ValidationErrorItem] = []
+    assistant_text = ""
+    result: Dict[str, Any] = {}
+    while attempt <= 2:
+        attempt += 1
+        out = first if first is not None and attempt == 1 else await generate("apply")
+        assistant_text = out.get("assistant_text", "")
+        if out.get("failed"):
+            # 案が得られなかった（予算切れなど）。現在の制約をそのまま案として返さない
+            last_errors = [ValidationErrorItem(path="/", message=assistant_text)]
+            break
+        result = _evaluate(out.get("json", {}))
+        if result["draft_constraints"] is not None:
+            break
+        last_errors = result["errors"]
+        budget.fail("検証", f"{len(last_errors)} 件のエラー")
+        llm_metrics.count("validation_failed", "apply")
+        if budget.exhausted:
+            assistant_text = f"{assistant_text}\n\n{budget.explain('検証を通る変更案の生成')}"
+            break
+    return _apply_response(session_id, req, confidence, assistant_text, result, last_errors)
+
+@router.get("/metrics")
+def metrics(format: str = Query("json", pattern="^(json|prometheus)$")):
+    """LLM 呼び出しの計測（操作・モデル・結果ごとの件数、レイテンシ、トークン、再試行など）"""
+    if format == "prometheus":
+        return PlainTextResponse(llm_metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+    return {
+        **llm_metrics.snapshot(),
+        "gateway": llm_gateway.stats(),
+        "cache": openai_client.cache_stats(),
+        "intent_routing": dict(intent_service.stats),
+        "prompt_context": dict(employee_context.stats),
+    }
+
+@router.get("/cache/stats")
+def cache_stats():
+    """LLM 応答キャッシュの件数とヒット率"""
+    return openai_client.cache_stats()
+
+@router.get("/context/stats")
+def context_stats():
+    """調整ルール生成で従業員リストを絞った結果（送る前後のトークン数の累計）"""
+    return dict(employee_context.stats)
 
 @router.websocket("/ws/llm/{session_id}")
 async def ws_llm(websocket: WebSocket, session_id: str):
+    """POST /sessions/{id}/messages のストリーム版
+
+    受信: {"content", "mode"}（1 接続で何度でも）
+    送信: {"type": "intent"} → {"type": "delta", "text"}...
+          → （apply で変更案の JSON が閉じて検証を通った時点で）{"type": "draft", json_patch, full_json, validation, diff_summary, draft_constraints}
+          → {"type": "done", ...POST と同じ応答}。途中の失敗は {"type": "error", "message"}
+    """
     await websocket.accept()
     try:
-        await websocket.send_json({"type": "info", "message": "LLM WS stub connected", "session_id": session_id})
-        await websocket.close(code=1000)
+        await websocket.send_json({"type": "info", "message": "LLM WS connected", "session_id": session_id})
+        while True:
+            data = await websocket.receive_json()
+            try:
+                req = ChatMessageRequest(**data)
+            except ValidationError as e:
+                await websocket.send_json({"type": "error", "message": f"メッセージの形式が不正です: {e.errors()[0]['msg']}"})
+                continue
+            await _stream_message(websocket, session_id, req)
     except WebSocketDisconnect:
         return
+
+async def _stream_message(websocket: WebSocket, session_id: str, req: ChatMessageRequest) -> None:
+    ctx = _session_context(session_id)
+    budget = Budget()
+    resolved_intent, confidence = await intent_service.route(req.mode or "auto", req.content, ctx, budget)
+    await websocket.send_json({"type": "intent", "intent": "qa" if resolved_intent == "qa" else "apply", "confidence": confidence})
+    if resolved_intent == "qa":
+        parts: List[str] = []
+        async for ev in openai_client.stream_qa(req.content, ctx, budget):
+            if ev["type"] == "delta":
+                parts.append(ev["text"])
+            else:
+                parts = [ev["message"]]
+            await websocket.send_json(ev)
+        resp = _qa_response(session_id, req, confidence, "".join(parts).strip())
+        await websocket.send_json({"type": "done", **resp.model_dump(mode="json")})
+        return
+    last_errors: List[ValidationErrorItem] = []
+    assistant_text = ""
+    result: Dict[str, Any] = {}
+    for attempt in range(3):
+        if attempt:
+            await websocket.send_json({"type": "retry", "attempt": attempt + 1})
+        result = {}
+        failed = False
+        async for ev in openai_client.stream_apply(req.content, ctx, budget):
+            if ev["type"] == "spec":
+                # 変更案が閉じた時点で検証し、説明文の続きを待たずに下書きを送る
+                result = _evaluate(ev["json"])
+                if result["draft_constraints"] is not None:
+                    await websocket.send_json({
+                        "type": "draft",
+                        "json_patch": result["json_patch"],
+                        "full_json": result["full_json"],
+                        "validation": {"ok": True, "errors": []},
+                        "diff_summary": result["diff_summary"].model_dump(),
+                        "draft_constraints": result["draft_constraints"],
+                    })
+                continue
+            if ev["type"] == "end":
+                assistant_text = ev["assistant_text"]
+                continue
+            if ev["type"] == "error":
+                assistant_text = ev["message"]
+                failed = True
+            await websocket.send_json(ev)
+        if failed:
+            last_errors = [ValidationErrorItem(path="/", message=assistant_text)]
+            result = {}
+            break
+        if result.get("draft_constraints") is not None:
+            break
+        last_errors = result.get("errors") or [ValidationErrorItem(path="/", message="応答に変更案の JSON がありませんでした")]
+        budget.fail("検証", f"{len(last_errors)} 件のエラー")
+        llm_metrics.count("validation_failed", "apply_stream")
+        if budget.exhausted:
+            assistant_text = f"{assistant_text}\n\n{budget.explain('検証を通る変更案の生成')}"
+            break
+    resp = _apply_response(session_id, req, confidence, assistant_text, result, last_errors)
+    await websocket.send_json({"type": "done", **resp.model_dump(mode="json")})
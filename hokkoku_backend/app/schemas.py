@@ -124,3 +124,5 @@ class SchedulePreviewResponse(BaseModel):
     removed: List[Shift]
     updated: List[ShiftUpdatePair]
     change_set: ChangeSet
+    # change_set 以外の候補（score の小さい順）
+    alternatives: List[ChangeSet] = []
@@ -1,7 +1,16 @@
 from typing import Dict, Any, List, Tuple
 from datetime import date, timedelta, datetime, time
+import logging
 from ..schemas import ChangeDelta, ChangeSet, Shift, ShiftUpdatePair, SchedulePreviewResponse
 from .. import store
+from ..config import ADJUSTMENT_ALTERNATIVES, PREVIEW_CACHE_SIZE
+from .pair_optimizer import optimize_pair_not_together
+from .preview_cache import PreviewCache, preview_key
+from .rebalance import rebalance_week
+
+logger = logging.getLogger("backend")
+
+_previews: PreviewCache[Tuple[ChangeSet, SchedulePreviewResponse]] = PreviewCache(PREVIEW_CACHE_SIZE)
 
 def _week_range_from(d: date) -> tuple[date, date]:
     start = d - timedelta(days=d.weekday())
@@ -53,23 +62,23 @@ def _find_available_employees(target_day: str, shifts: List[Shift], exclude_ids:
     
     return available
 
-def _analyze_shift_distribution(shifts: List[Shift]) -> Dict[int, int]:
-    """シフト分布を分析"""
-    distribution = {}
-    for shift in shifts:
-        emp_id = shift.employee_id
-        distribution[emp_id] = distribution.get(emp_id, 0) + 1
-    return distribution
-
-def _find_overworked_employees(distribution: Dict[int, int], threshold: int = 5) -> List[int]:
-    """過重労働者を検出"""
-    return [emp_id for emp_id, count in distribution.items() if count > threshold]
-
-def _find_underworked_employees(distribution: Dict[int, int], threshold: int = 2) -> List[int]:
-    """軽労働者を検出"""
-    return [emp_id for emp_id, count in distribution.items() if count < threshold]
+def _change_set(rule: Dict[str, Any], deltas: List[ChangeDelta], score: int, week_start: date, week_end: date) -> ChangeSet:
+    return ChangeSet(
+        id=store.new_id(),
+        created_at=store.now_iso(),
+        rule=rule,
+        deltas=deltas,
+        score=score,
+        week_start=week_start.isoformat(),
+        week_end=week_end.isoformat(),
+        schedule_version=store.schedule_version()
+    )
 
 def generate_preview(rule: Dict[str, Any], week_start_iso: str | None) -> Tuple[ChangeSet, SchedulePreviewResponse]:
+    """調整ルールのプレビューを作る。同じ (ルール, 週, スケジュールのバージョン) なら前回の結果を返す
+
+    キャッシュから返した時は proposals_ready を配り直さない（作った時に配信済み）。
+    """
     today = date.today()
     if week_start_iso:
         try:
@@ -78,30 +87,41 @@ def generate_preview(rule: Dict[str, Any], week_start_iso: str | None) -> Tuple[
         except Exception:
             pass
     week_start, week_end = _week_range_from(today)
+    version = store.schedule_version()
+    key = preview_key(rule, week_start, version, store.employees_version())
+    hit = _previews.get(key)
+    if hit is not None:
+        return hit
+    cs, preview = _compute_preview(rule, week_start, week_end)
+    # 計算中に他の書き込みが入った場合は古い版のキーで覚えない
+    if store.schedule_version() == version:
+        _previews.put(key, (cs, preview))
+    store.publish_proposals_ready(cs)
+    return cs, preview
+
+def preview_cache_stats() -> Dict[str, int]:
+    return _previews.stats()
+
+def _compute_preview(rule: Dict[str, Any], week_start: date, week_end: date) -> Tuple[ChangeSet, SchedulePreviewResponse]:
     base = store.current_schedule_copy()
     deltas: List[ChangeDelta] = []
+    score: int | None = None
+    alternatives: List[ChangeSet] = []
     
     rule_type = rule.get("type")
     
     if rule_type == "pair_not_together":
-        # 既存のpair_not_together機能をそのまま活用
+        # 週内の衝突をまとめて CP-SAT で解き、上位案を alternatives として返す
         a_id = rule.get("a_employee_id")
         b_id = rule.get("b_employee_id")
-        print(f"DEBUG: Processing pair_not_together rule for employees {a_id} and {b_id}")
         if a_id and b_id:
             conflicts = store.conflicting_shifts(a_id, b_id, week_start, week_end)
-            print(f"DEBUG: Found {len(conflicts)} conflicting shifts")
-            for s_a, s_b in conflicts:
-                print(f"DEBUG: Conflict - Employee {s_a.employee_id} and {s_b.employee_id} on {s_a.date}")
-                repl = store.find_replacement_for(s_b, exclude_ids=[a_id, b_id])
-                print(f"DEBUG: Found replacement {repl} for employee {s_b.employee_id}")
-                if repl is not None:
-                    before = s_b
-                    after = Shift(**s_b.dict())
-                    after.employee_id = repl
-                    deltas.append(ChangeDelta(kind="replace", before=before, after=after))
-                    print(f"DEBUG: Added replacement delta: {s_b.employee_id} -> {repl}")
-        print(f"DEBUG: Total deltas generated: {len(deltas)}")
+            plans = optimize_pair_not_together(conflicts, store.candidate_engine(), a_id, b_id, k=ADJUSTMENT_ALTERNATIVES)
+            logger.info("pair_not_together a=%s b=%s conflicts=%s plans=%s", a_id, b_id, len(conflicts), [p.cost for p in plans])
+            if plans:
+                deltas = plans[0].deltas
+                score = plans[0].cost
+                alternatives = [_change_set(rule, p.deltas, p.cost, week_start, week_end) for p in plans[1:]]
     
     elif rule_type == "increase_staff_day":
         # 新規: 特定日の人員増加
@@ -168,37 +188,20 @@ def generate_preview(rule: Dict[str, Any], week_start_iso: str | None) -> Tuple[
                 print(f"Error adding employee shift: {e}")
     
     elif rule_type == "redistribute_shifts":
-        # 新規: シフト再配分
-        distribution = _analyze_shift_distribution(base)
-        overworked = _find_overworked_employees(distribution)
-        underworked = _find_underworked_employees(distribution)
-        
-        # 過重労働者から軽労働者へシフトを再配分
-        for over_emp in overworked:
-            for under_emp in underworked:
-                if len(deltas) >= 3:  # 最大3つの変更まで
-                    break
-                
-                # 過重労働者のシフトを1つ軽労働者に移動
-                over_shifts = [s for s in base if s.employee_id == over_emp]
-                if over_shifts:
-                    shift_to_move = over_shifts[0]
-                    before = shift_to_move
-                    after = Shift(**shift_to_move.dict())
-                    after.employee_id = under_emp
-                    deltas.append(ChangeDelta(kind="replace", before=before, after=after))
-                    break
+        # 週内の負荷を q / q+1 件に均す最小の付け替えを最小費用流で求める
+        result = rebalance_week(store.candidate_engine(), week_start)
+        deltas = [
+            ChangeDelta(kind="replace", before=s, after=s.model_copy(update={"employee_id": emp}))
+            for s, emp in result.moves
+        ]
+        if result.before:
+            logger.info(
+                "redistribute_shifts moves=%s load %s..%s -> %s..%s",
+                len(deltas), min(result.before.values()), max(result.before.values()),
+                min(result.after.values()), max(result.after.values()),
+            )
     
-    cs = ChangeSet(
-        id=store.new_id(),
-        created_at=store.now_iso(),
-        rule=rule,
-        deltas=deltas,
-        score=len(deltas),
-        week_start=week_start.isoformat(),
-        week_end=week_end.isoformat(),
-        schedule_version=store.schedule_version()
-    )
+    cs = _change_set(rule, deltas, len(deltas) if score is None else score, week_start, week_end)
     new_shifts, added, removed, updated = store.apply_deltas_on_copy(base, deltas)
     preview = SchedulePreviewResponse(
         week_start=week_start,
@@ -207,9 +210,9 @@ def generate_preview(rule: Dict[str, Any], week_start_iso: str | None) -> Tuple[
         added=added,
         removed=removed,
         updated=updated,
-        change_set=cs
+        change_set=cs,
+        alternatives=alternatives,
     )
-    store.publish_proposals_ready(cs)
     return cs, preview
 
 def apply_changes(cs: ChangeSet) -> Dict[str, Any]:
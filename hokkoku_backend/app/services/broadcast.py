@@ -0,0 +1,149 @@
+"""WebSocket 向けのブロードキャストハブ
+
+購読者ごとに上限付きのバッファを持ち、後続で置き換わるイベント（schedule.updated など）は
+最新の 1 件だけを残す（merge を渡すと古い方と合成した結果で置き換える）。上限を超えた購読者は遅いクライアントとして切り離す。
+publish はどのスレッドから呼んでもよく、各購読者のイベントループ上で配られる。
+"""
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional
+
+logger = logging.getLogger("backend")
+
+
+class SlowConsumer(Exception):
+    """バッファ上限を超えて切り離された"""
+
+
+class Subscriber:
+    __slots__ = ("hub", "loop", "_buffer", "_coalesced", "_event", "closed")
+
+    def __init__(self, hub: "BroadcastHub", loop: Optional[asyncio.AbstractEventLoop]):
+        self.hub = hub
+        self.loop = loop
+        # 要素は [msg]。まとめ対象のイベントは同じ枠の中身だけを差し替える
+        self._buffer: Deque[List[Dict[str, Any]]] = deque()
+        self._coalesced: Dict[str, List[Dict[str, Any]]] = {}
+        self._event: Optional[asyncio.Event] = None
+        self.closed = False
+
+    def qsize(self) -> int:
+        return len(self._buffer)
+
+    def offer(self, msg: Dict[str, Any]) -> bool:
+        """バッファに積む。上限を超えたら切り離して False を返す"""
+        key = msg.get("type")
+        if key in self.hub.coalesce:
+            slot = self._coalesced.get(key)
+            if slot is not None:
+                merge = self.hub.merge
+                slot[0] = merge(slot[0], msg) if merge is not None else msg
+                self.hub.coalesced += 1
+                return True
+        if len(self._buffer) >= self.hub.limit:
+            self.closed = True
+            self._buffer.clear()
+            self._coalesced.clear()
+            self._wake()
+            return False
+        slot = [msg]
+        self._buffer.append(slot)
+        self.hub.enqueued += 1
+        if key in self.hub.coalesce:
+            self._coalesced[key] = slot
+        self._wake()
+        return True
+
+    def _wake(self) -> None:
+        if self._event is not None:
+            self._event.set()
+
+    def get_nowait(self) -> Dict[str, Any]:
+        if not self._buffer:
+            raise asyncio.QueueEmpty
+        slot = self._buffer.popleft()
+        msg = slot[0]
+        key = msg.get("type")
+        if self._coalesced.get(key) is slot:
+            del self._coalesced[key]
+        return msg
+
+    async def get(self) -> Dict[str, Any]:
+        while True:
+            if self.closed:
+                raise SlowConsumer
+            if self._buffer:
+                return self.get_nowait()
+            if self._event is None:
+                self._event = asyncio.Event()
+            self._event.clear()
+            await self._event.wait()
+
+
+class BroadcastHub:
+    def __init__(
+        self,
+        limit: int = 64,
+        coalesce: Iterable[str] = ("schedule.updated",),
+        merge: Optional[Callable[[Dict[str, Any], Dict[str, Any]], Dict[str, Any]]] = None,
+    ):
+        self.limit = limit
+        self.coalesce = frozenset(coalesce)
+        self.merge = merge
+        self._subs: "set[Subscriber]" = set()
+        self.published = 0
+        self.enqueued = 0
+        self.coalesced = 0
+        self.slow_disconnects = 0
+
+    def subscribe(self) -> Subscriber:
+        try:
+            loop: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+        sub = Subscriber(self, loop)
+        self._subs.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        self._subs.discard(sub)
+
+    def publish(self, msg: Dict[str, Any]) -> None:
+        self.published += 1
+        groups: Dict[Optional[asyncio.AbstractEventLoop], List[Subscriber]] = {}
+        for sub in list(self._subs):
+            if sub.loop is not None and sub.loop.is_closed():
+                self._subs.discard(sub)
+                continue
+            groups.setdefault(sub.loop, []).append(sub)
+        try:
+            current: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            current = None
+        for loop, subs in groups.items():
+            if loop is None or loop is current:
+                self._fanout(subs, msg)
+            else:
+                loop.call_soon_threadsafe(self._fanout, subs, msg)
+
+    def _fanout(self, subs: List[Subscriber], msg: Dict[str, Any]) -> None:
+        for sub in subs:
+            if sub.closed:
+                continue
+            if not sub.offer(msg):
+                self.slow_disconnects += 1
+                self._subs.discard(sub)
+                logger.warning("ws: slow consumer disconnected (buffer limit %s)", self.limit)
+
+    def stats(self) -> Dict[str, int]:
+        sizes = [sub.qsize() for sub in list(self._subs)]
+        return {
+            "subscribers": len(sizes),
+            "published": self.published,
+            "enqueued": self.enqueued,
+            "coalesced": self.coalesced,
+            "slow_disconnects": self.slow_disconnects,
+            "buffered": sum(sizes),
+            "max_buffered": max(sizes, default=0),
+        }
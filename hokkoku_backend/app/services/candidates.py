@@ -0,0 +1,203 @@
+"""交代候補の検索
+
+週ごとの占有インデックス（従業員 × 日 の配列）を作り、対象シフトをまとめて判定・採点する。
+採点関数は SCORERS に登録し、"weekly_load:1,skill:0.5" のような指定で重み付きに組み合わせる。
+値が小さいほど良い候補で、上位 k 件はヒープで取り出す。
+"""
+import heapq
+from datetime import date, time, timedelta
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .schedule_table import ScheduleTable, slot_times
+
+_NIGHT_START = time(0, 0)
+_LATE_START = time(16, 0)
+
+
+def week_start_of(d: date) -> date:
+    return d - timedelta(days=d.weekday())
+
+
+class WeekOccupancy:
+    """1 週間分（前後 1 日を含む 9 日）の占有状況
+
+    assigned[e, i]: 従業員 e が (週初め - 1 + i) 日に何か入っている
+    late[e, i] / night[e, i]: その日に 16:00 / 00:00 開始の枠に入っている
+    week_load[e]: 週内のシフト数
+    """
+
+    __slots__ = ("week_start", "assigned", "late", "night", "week_load")
+
+    def __init__(self, table: ScheduleTable, week_start: date, emp_ids: np.ndarray):
+        self.week_start = week_start
+        n = len(emp_ids)
+        self.assigned = np.zeros((n, 9), dtype=bool)
+        self.late = np.zeros((n, 9), dtype=bool)
+        self.night = np.zeros((n, 9), dtype=bool)
+        self.week_load = np.zeros(n, dtype=np.int64)
+
+        rows = table.rows[table.query(week_start - timedelta(days=1), week_start + timedelta(days=7))]
+        if not len(rows) or not n:
+            return
+        order = np.argsort(emp_ids, kind="stable")
+        pos = np.searchsorted(emp_ids, rows["employee_id"], sorter=order)
+        pos = np.minimum(pos, n - 1)
+        e = order[pos]
+        known = emp_ids[e] == rows["employee_id"]
+        if not known.any():
+            # マスタに無い従業員（CSV で入れ替えた後の旧 ID など）の行しか無い週
+            return
+        e = e[known]
+        offset = rows["day"][known] - (week_start.toordinal() - 1)
+        slots = rows["slot"][known]
+        starts = np.array([slot_times(c)[0] for c in range(int(slots.max()) + 1)], dtype=object)
+        is_late = starts[slots] == _LATE_START
+        is_night = starts[slots] == _NIGHT_START
+        self.assigned[e, offset] = True
+        self.late[e[is_late], offset[is_late]] = True
+        self.night[e[is_night], offset[is_night]] = True
+        in_week = (offset >= 1) & (offset <= 7)
+        self.week_load = np.bincount(e[in_week], minlength=n)
+
+    def eligible(self, shifts: Sequence[Any]) -> np.ndarray:
+        """対象シフト × 従業員 の可否。同じ日に入っておらず、
+        前日 16:00 → 当日 00:00、当日 16:00 → 翌日 00:00 の連続にならないこと
+        """
+        i = np.array([(s.date - self.week_start).days + 1 for s in shifts], dtype=np.intp)
+        ok = ~self.assigned[:, i].T
+        night = np.array([s.start_time == _NIGHT_START for s in shifts], dtype=bool)
+        late = np.array([s.start_time == _LATE_START for s in shifts], dtype=bool)
+        if night.any():
+            ok[night] &= ~self.late[:, i[night] - 1].T
+        if late.any():
+            ok[late] &= ~self.night[:, i[late] + 1].T
+        return ok
+
+
+# 採点関数: (占有インデックス, 対象シフト, エンジン) -> (対象 × 従業員 に broadcast できる配列, 理由ラベル)
+Scorer = Callable[[WeekOccupancy, Sequence[Any], "CandidateEngine"], Tuple[np.ndarray, str]]
+
+
+def _weekly_load(occ: WeekOccupancy, shifts: Sequence[Any], engine: "CandidateEngine") -> Tuple[np.ndarray, str]:
+    return occ.week_load[None, :].astype(float), "week_shifts"
+
+
+def _skill(occ: WeekOccupancy, shifts: Sequence[Any], engine: "CandidateEngine") -> Tuple[np.ndarray, str]:
+    """元の担当者とのスキル差"""
+    base = np.array([engine.skill_of(s.employee_id) for s in shifts])
+    return np.abs(engine.skills[None, :] - base[:, None]), "skill_gap"
+
+
+def _role_balance(occ: WeekOccupancy, shifts: Sequence[Any], engine: "CandidateEngine") -> Tuple[np.ndarray, str]:
+    """元の担当者と役割が違えば 1（元の担当者が不明なら 0）"""
+    roles = np.array([engine.role_of(s.employee_id) for s in shifts], dtype=object)
+    known = np.array([r is not None for r in roles], dtype=bool)
+    return ((engine.roles[None, :] != roles[:, None]) & known[:, None]).astype(float), "role_mismatch"
+
+
+SCORERS: Dict[str, Scorer] = {
+    "weekly_load": _weekly_load,
+    "skill": _skill,
+    "role_balance": _role_balance,
+}
+
+
+def parse_scoring(spec: str) -> List[Tuple[str, float]]:
+    """"weekly_load:1,skill:0.5" -> [("weekly_load", 1.0), ("skill", 0.5)]"""
+    out: List[Tuple[str, float]] = []
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, weight = part.partition(":")
+        if name not in SCORERS:
+            raise ValueError(f"unknown scorer: {name}")
+        out.append((name, float(weight) if weight else 1.0))
+    return out
+
+
+class CandidateEngine:
+    """あるスケジュール（コミット済みテーブル）と従業員マスタに対する候補検索
+
+    週ごとの占有インデックスは最初に使う時に作り、エンジンが生きている間は使い回す。
+    """
+
+    def __init__(self, table: ScheduleTable, employees: Sequence[Dict[str, Any]], scoring: Sequence[Tuple[str, float]] = (("weekly_load", 1.0),)):
+        self.table = table
+        self.employees = [e for e in employees if e.get("id") is not None]
+        self.emp_ids = np.array([e["id"] for e in self.employees], dtype=np.int64)
+        self.col = {int(eid): i for i, eid in enumerate(self.emp_ids.tolist())}
+        self.skills = np.array([float(e.get("skill_level") or 0) for e in self.employees])
+        self.roles = np.array([e.get("role") for e in self.employees], dtype=object)
+        self.scoring = list(scoring)
+        self._weeks: Dict[date, WeekOccupancy] = {}
+
+    def week(self, d: date) -> WeekOccupancy:
+        ws = week_start_of(d)
+        occ = self._weeks.get(ws)
+        if occ is None:
+            occ = self._weeks[ws] = WeekOccupancy(self.table, ws, self.emp_ids)
+        return occ
+
+    def skill_of(self, employee_id: int) -> float:
+        i = self.col.get(employee_id)
+        return float(self.skills[i]) if i is not None else 0.0
+
+    def role_of(self, employee_id: int) -> Optional[str]:
+        i = self.col.get(employee_id)
+        return self.roles[i] if i is not None else None
+
+    def suggest(self, shift: Any, max_candidates: int = 3, exclude_ids: Iterable[int] = ()) -> List[Dict[str, Any]]:
+        return self.suggest_many([shift], max_candidates, [exclude_ids])[0]
+
+    def suggest_many(
+        self,
+        shifts: Sequence[Any],
+        max_candidates: int = 3,
+        exclude_ids: Optional[Sequence[Iterable[int]]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """対象シフトを週ごとにまとめ、可否と点数を 対象 × 従業員 の行列で一度に求める"""
+        if exclude_ids is None:
+            exclude_ids = [()] * len(shifts)
+        out: List[List[Dict[str, Any]]] = [[] for _ in shifts]
+        by_week: Dict[date, List[int]] = {}
+        for t, s in enumerate(shifts):
+            by_week.setdefault(week_start_of(s.date), []).append(t)
+
+        for ws, targets in by_week.items():
+            occ = self.week(ws)
+            group = [shifts[t] for t in targets]
+            ok = occ.eligible(group)
+            for row, t in enumerate(targets):
+                for eid in exclude_ids[t]:
+                    i = self.col.get(int(eid))
+                    if i is not None:
+                        ok[row, i] = False
+            total = np.zeros(ok.shape)
+            parts: List[Tuple[str, np.ndarray]] = []
+            for name, weight in self.scoring:
+                values, label = SCORERS[name](occ, group, self)
+                values = np.broadcast_to(values, ok.shape)
+                total = total + weight * values
+                parts.append((label, values))
+
+            for row, t in enumerate(targets):
+                idx = np.flatnonzero(ok[row])
+                scores = total[row, idx].tolist()
+                best = heapq.nsmallest(max_candidates, zip(scores, self.emp_ids[idx].tolist(), idx.tolist()))
+                out[t] = [
+                    {
+                        "employee_id": emp_id,
+                        "name": self.employees[i].get("name"),
+                        "score": float(score),
+                        "reasons": [f"{label}={_fmt(values[row, i])}" for label, values in parts],
+                    }
+                    for score, emp_id, i in best
+                ]
+        return out
+
+
+def _fmt(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else f"{v:g}"
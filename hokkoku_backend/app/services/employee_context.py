@@ -0,0 +1,84 @@
+"""調整ルール生成に渡す従業員リストを絞る
+
+従業員マスタ全員を "名前 (ID: n)" で並べるとプロンプトが支店の人数に比例して膨らむ。
+先に手元で名前を照合し（/api/chat/parse と同じ規則: 完全一致 → 姓 + さん → 姓のみ）、当たった人だけを送る。
+フルネームで当たった人がいれば、同じ姓で姓だけ当たった人は取り違えやすい候補として EMPLOYEE_PROMPT_EXTRA 人まで添える。
+誰にも当たらない時は、人数が EMPLOYEE_PROMPT_MAX 以下なら全員、それより多ければ名だけ一致する人を送る
+（名前の要らないルールではこれで足り、名前の要るルールは LLM に全員を見せても当てにくい）。
+
+送る前後のトークン数（概算）を stats に積む。
+"""
+import threading
+from typing import Any, Dict, List
+
+from ..config import EMPLOYEE_PROMPT_MAX, EMPLOYEE_PROMPT_EXTRA
+
+try:
+    import tiktoken
+    _enc = tiktoken.get_encoding("cl100k_base")
+except Exception:  # tiktoken が無ければ概算（ASCII は 4 文字、それ以外は 1 文字で 1 トークン）
+    _enc = None
+
+_lock = threading.Lock()
+stats: Dict[str, int] = {"requests": 0, "tokens_full": 0, "tokens_sent": 0, "employees_full": 0, "employees_sent": 0}
+
+
+def count_tokens(text: str) -> int:
+    if _enc is not None:
+        return len(_enc.encode(text))
+    ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+    return (ascii_chars + 3) // 4 + len(text) - ascii_chars
+
+
+def _surname(name: str) -> str:
+    # 日本語の姓名を最初の 2 文字で分ける
+    return name[:2]
+
+
+def match_names(text: str, employees: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """本文に名前が出てくる従業員（マスタ順、同じ ID は 1 回）。同姓同名の別人はそれぞれ返す"""
+    out: List[Dict[str, Any]] = []
+    seen = set()
+    for e in employees:
+        n = e.get("name")
+        key = e.get("id", n)
+        if not n or key in seen:
+            continue
+        surname = _surname(n)
+        if n in text or (len(n) >= 2 and (surname + "さん" in text or surname in text)):
+            seen.add(key)
+            out.append(e)
+    return out
+
+
+def line(e: Dict[str, Any]) -> str:
+    return f"{e['name']} (ID: {e['id']})"
+
+
+def prompt_employees(text: str, employees: List[Dict[str, Any]]) -> List[str]:
+    """プロンプトに載せる "名前 (ID: n)" の並び"""
+    named = [e for e in employees if e.get("name") and e.get("id")]
+    matched = match_names(text, named)
+    if matched:
+        # フルネームで書かれた人がいれば、同じ姓の他の人は紛らわしい候補として少数だけ添える
+        exact = [e for e in matched if e["name"] in text]
+        covered = {_surname(e["name"]) for e in exact}
+        primary = exact + [e for e in matched if e["name"] not in text and _surname(e["name"]) not in covered]
+        primary = primary[:EMPLOYEE_PROMPT_MAX]
+        picked = {id(e) for e in primary}
+        extra = [e for e in matched if id(e) not in picked][:EMPLOYEE_PROMPT_EXTRA]
+        chosen = primary + extra
+    elif len(named) <= EMPLOYEE_PROMPT_MAX:
+        chosen = named
+    else:
+        # 名だけで書かれている場合（「花子さん」など）
+        chosen = [e for e in named if len(e["name"]) > 2 and e["name"][2:] in text][:EMPLOYEE_PROMPT_MAX]
+    lines = [line(e) for e in chosen]
+    full = ", ".join(line(e) for e in named)
+    with _lock:
+        stats["requests"] += 1
+        stats["tokens_full"] += count_tokens(full)
+        stats["tokens_sent"] += count_tokens(", ".join(lines))
+        stats["employees_full"] += len(named)
+        stats["employees_sent"] += len(lines)
+    return lines
@@ -0,0 +1,80 @@
+"""Unix ドメインソケットによるワーカー間イベント配信
+
+各ワーカーが共有ディレクトリに 1 つずつデータグラムソケットを bind し、publish は
+自分以外の全ソケットへ送る。ブローカープロセスは不要で、落ちたワーカーのソケットは
+送信時に検知して削除する。
+"""
+import json
+import logging
+import os
+import socket
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict
+from uuid import uuid4
+
+logger = logging.getLogger("backend")
+
+MAX_DATAGRAM = 1 << 20
+
+
+class EventBus:
+    def __init__(self, directory: Path, deliver: Callable[[Dict[str, Any]], None]):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.path = self.directory / f"{os.getpid()}-{uuid4().hex[:6]}.sock"
+        self._deliver = deliver
+        self._rx = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._rx.bind(str(self.path))
+        self._tx = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._tx.setblocking(False)
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="event-bus", daemon=True)
+        self._thread.start()
+
+    def publish(self, msg: Dict[str, Any]) -> int:
+        """他ワーカーへ送る。受け手のバッファが詰まっている場合は待たずに捨てる"""
+        data = json.dumps(msg, ensure_ascii=False, default=str).encode("utf-8")
+        sent = 0
+        for peer in self.directory.glob("*.sock"):
+            if peer == self.path:
+                continue
+            try:
+                self._tx.sendto(data, str(peer))
+                sent += 1
+            except (ConnectionRefusedError, FileNotFoundError):
+                peer.unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning("event bus: dropped %s for %s: %s", msg.get("type"), peer.name, e)
+        return sent
+
+    def _run(self) -> None:
+        while True:
+            try:
+                data = self._rx.recv(MAX_DATAGRAM)
+            except OSError:
+                return
+            if self._closed:
+                return
+            try:
+                msg = json.loads(data)
+            except ValueError:
+                continue
+            try:
+                self._deliver(msg)
+            except Exception:
+                logger.exception("event bus: deliver failed")
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            # recv で待っているスレッドを起こす
+            self._tx.sendto(b"", str(self.path))
+        except OSError:
+            pass
+        self._thread.join(timeout=1)
+        self._rx.close()
+        self._tx.close()
+        self.path.unlink(missing_ok=True)
@@ -0,0 +1,27 @@
+import threading
+
+
+class IdAllocator:
+    """単調増加の整数 ID を払い出す。削除された ID は再利用しない。"""
+
+    __slots__ = ("_next", "_lock")
+
+    def __init__(self, start: int = 1):
+        self._next = start
+        self._lock = threading.Lock()
+
+    def allocate(self) -> int:
+        with self._lock:
+            value = self._next
+            self._next += 1
+            return value
+
+    def observe(self, used: int) -> None:
+        """外部から指定された ID を払い出し済みとして扱う"""
+        if used >= self._next:
+            with self._lock:
+                if used >= self._next:
+                    self._next = used + 1
+
+    def peek(self) -> int:
+        return self._next
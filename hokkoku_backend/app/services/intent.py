@@ -1,17 +1,73 @@
-from typing import Dict, Any, Tuple
-from ..config import INTENT_THRESHOLD
-from . import openai_client
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+from ..config import INTENT_THRESHOLD, LLM_SPECULATIVE
+from . import openai_client, intent_classifier
+from .llm_budget import Budget
 
-def route(mode: str, content: str, context: Dict[str, Any]) -> Tuple[str, float]:
-    if mode == "apply":
-        return "apply", 1.0
-    if mode == "qa":
-        return "qa", 1.0
-    if mode == "adjust":
-        return "adjust", 1.0
-    result = openai_client.detect_intent(content, context)
+T = TypeVar("T")
+
+# 手元の判定で決まった数と LLM に回した数。speculated 以降は route_speculative の先行生成の当たり外れ
+stats = {"local": 0, "llm": 0, "speculated": 0, "speculation_hits": 0, "speculation_misses": 0}
+
+_FIXED = {"apply", "qa", "adjust"}
+
+async def route(mode: str, content: str, context: Dict[str, Any], budget: Optional[Budget] = None) -> Tuple[str, float]:
+    if mode in _FIXED:
+        return mode, 1.0
+    # 手元の判定で十分確かなら LLM を呼ばない
+    intent, confidence = intent_classifier.classify(content)
+    if confidence >= INTENT_THRESHOLD:
+        stats["local"] += 1
+        return intent, confidence
+    return await _ask_llm(content, context, budget)
+
+async def _ask_llm(content: str, context: Dict[str, Any], budget: Optional[Budget]) -> Tuple[str, float]:
+    stats["llm"] += 1
+    result = await openai_client.detect_intent(content, context, budget)
     intent = result.get("intent", "qa")
     confidence = float(result.get("confidence", 0.0))
     if confidence < INTENT_THRESHOLD:
         return "qa", confidence
     return intent, confidence
+
+async def route_speculative(
+    mode: str,
+    content: str,
+    context: Dict[str, Any],
+    generate: Callable[[str, Budget], Awaitable[T]],
+    budget: Optional[Budget] = None,
+    branch: Callable[[str], str] = lambda intent: intent,
+) -> Tuple[str, float, Optional[T]]:
+    """route と同じ判定をしつつ、LLM に聞く間に手元の推測で generate(推測) を走らせておく
+
+    branch は意図を呼び出し側の処理の分岐に揃える（例: apply と adjust を同じ扱いにする）。
+    確定した意図の分岐が推測と同じならその生成結果を返し、違えば取り消して None を返す（呼び出し側で生成し直す）。
+    意図が LLM 無しで決まった時も None（生成はまだ始めていない）。
+    generate(意図, 予算) の予算は budget.fork() した子予算。当たれば使った回数を budget に付け、
+    外れれば捨てる（取り消した先行生成のせいで本番の生成の試行回数が減らない）。
+    """
+    if mode in _FIXED or not LLM_SPECULATIVE:
+        intent, confidence = await route(mode, content, context, budget)
+        return intent, confidence, None
+    guess, confidence = intent_classifier.classify(content)
+    if confidence >= INTENT_THRESHOLD:
+        stats["local"] += 1
+        return guess, confidence, None
+    stats["speculated"] += 1
+    # 並行して走る意図判定の 1 回分を残しておく
+    spec_budget = Budget() if budget is None else budget.fork(reserve=1)
+    task = asyncio.ensure_future(generate(guess, spec_budget))
+    try:
+        intent, confidence = await _ask_llm(content, context, budget)
+    except BaseException:
+        task.cancel()
+        raise
+    if branch(intent) == branch(guess):
+        stats["speculation_hits"] += 1
+        result = await task
+        if budget is not None:
+            budget.absorb(spec_budget)
+        return intent, confidence, result
+    task.cancel()
+    stats["speculation_misses"] += 1
+    return intent, confidence, None
@@ -0,0 +1,180 @@
+"""意図判定のローカル版（qa / apply / adjust）
+
+LLM に聞く前に手元で判定する。
+1. 規則: 言い回しがはっきりしているもの（「A さんと B さんを一緒にしない」「最小人員を 2 にして」など）は正規表現で決める。
+   疑問文（「か」「?」で終わる）には adjust / apply の規則を当てない（「同じシフトですか？」は質問）
+2. 線形モデル: 文字 1〜3-gram をハッシュした特徴の多クラスロジスティック回帰。
+   _EXAMPLES を起動時（warm）か初回の判定時に学習する（0.1 秒ほど）。日本語は分かち書きが要らない文字 n-gram で扱う
+
+確信度が INTENT_THRESHOLD に届かない時だけ呼び出し側が LLM に回す。
+"""
+import re
+import threading
+import unicodedata
+import zlib
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+INTENTS = ("qa", "apply", "adjust")
+
+_DIM = 1 << 12
+_NGRAMS = (1, 2, 3)
+
+# 疑問文の終わり方。「〜してもらえますか？」のような依頼もあるので、疑問文で qa 以外になった時は確信度を
+# QUESTION_ACTION_CAP までに抑えて LLM に判断を回す
+_QUESTION = re.compile(r"(\?|か)[。.]?$")
+QUESTION_ACTION_CAP = 0.5
+
+# (パターン, 意図, 確信度)。上から順に見て最初に当たったものを使う
+_RULES: List[Tuple["re.Pattern[str]", str, float]] = [
+    (re.compile(r"(さん|氏|くん|君).{0,20}(と|&|,|、).{0,20}(同じ|一緒|同時|別々|離し|離れ|避け|重ならない)"), "adjust", 0.95),
+    (re.compile(r"(均等に|平準化|偏りをなく|偏らない|再配分|ならして|割り振り直)"), "adjust", 0.9),
+    (re.compile(r"(min_staff_weekend|weekend_minimum|重み|最小人員|最低人員|最小人数|最低人数)"
+                r".{0,15}(して|変更|設定|上げ|下げ|増や|減ら|戻し|戻す|引き上げ|引き下げ)"), "apply", 0.9),
+    (re.compile(r"(週末|土日).{0,10}(最小|最低).{0,6}[+＋]\s*\d"), "apply", 0.9),
+    (re.compile(r"(何|なに|なぜ|なんで|どう|どこ|誰|だれ|いつ|いくつ|どれ|どの|理由|意味|とは).{0,30}(\?|？|か)$"), "qa", 0.85),
+]
+
+_EXAMPLES: List[Tuple[str, str]] = [
+    # qa
+    ("週末の最小人員はいくつですか", "qa"),
+    ("今の制約を教えて", "qa"),
+    ("シフトの作り方を説明して", "qa"),
+    ("なぜこの人が夜勤なの", "qa"),
+    ("来週の夜勤は誰", "qa"),
+    ("人員不足の日はどこ", "qa"),
+    ("この警告はどういう意味ですか", "qa"),
+    ("スキルレベルとは何ですか", "qa"),
+    ("田中さんの今週のシフトを教えて", "qa"),
+    ("どうやって調整すればいい", "qa"),
+    ("最適化が失敗した理由は", "qa"),
+    ("連続勤務の警告について教えて", "qa"),
+    ("何人必要ですか", "qa"),
+    ("現在の重みはどうなっている", "qa"),
+    ("使い方を教えてください", "qa"),
+    ("今月のシフト数は", "qa"),
+    ("休みの希望はどう反映されますか", "qa"),
+    ("この結果は妥当ですか", "qa"),
+    ("土曜日の担当者は誰ですか", "qa"),
+    ("説明してください", "qa"),
+    ("ヘルプ", "qa"),
+    ("佐藤さんは何回夜勤に入っていますか", "qa"),
+    ("what is the minimum weekend staff", "qa"),
+    ("how does the optimizer work", "qa"),
+    ("explain the warnings", "qa"),
+    # apply（制約の変更）
+    ("週末の最小人員を2にして", "apply"),
+    ("週末最小+1", "apply"),
+    ("週末の最低人数を3人に変更", "apply"),
+    ("weekend_minimumの重みを2.0に設定", "apply"),
+    ("重みを上げて", "apply"),
+    ("最小人員を1人減らして", "apply"),
+    ("週末は最低2名にしてください", "apply"),
+    ("制約を変更して週末を手厚くする", "apply"),
+    ("重みを0.5に下げて", "apply"),
+    ("min_staff_weekend を 3 に", "apply"),
+    ("週末の最小人数を変更したい", "apply"),
+    ("制約の重みを1.5に", "apply"),
+    ("週末最低人員を4に設定して", "apply"),
+    ("土日の最小人員を引き上げて", "apply"),
+    ("週末最小人員の重みを強くして", "apply"),
+    ("制約を元に戻して", "apply"),
+    ("週末の必要人数を2人に設定", "apply"),
+    ("週末の制約を緩めて", "apply"),
+    ("最低人数の条件を厳しくして", "apply"),
+    ("set weekend minimum to 2", "apply"),
+    ("increase the weekend minimum weight", "apply"),
+    ("change min staff weekend to 3", "apply"),
+    # adjust（シフトの調整）
+    ("田中さんと佐藤さんを同じシフトに入れない", "adjust"),
+    ("山田さんと鈴木さんを一緒にしないで", "adjust"),
+    ("月曜日の人員を増やして", "adjust"),
+    ("火曜の朝に1人追加して", "adjust"),
+    ("シフトを均等に割り振って", "adjust"),
+    ("負荷を平準化して", "adjust"),
+    ("偏りをなくして", "adjust"),
+    ("田中さんを水曜の遅番に入れて", "adjust"),
+    ("佐藤さんのシフトを追加", "adjust"),
+    ("夜勤の時間帯を調整して", "adjust"),
+    ("金曜日の人数を増やす", "adjust"),
+    ("高橋さんと伊藤さんを別々のシフトに", "adjust"),
+    ("週の勤務回数をならして", "adjust"),
+    ("渡辺さんを木曜日に追加してください", "adjust"),
+    ("早番を1人増やして", "adjust"),
+    ("二人を同じ日に入れないで", "adjust"),
+    ("シフトを再配分して", "adjust"),
+    ("小林さんと加藤さんを離して", "adjust"),
+    ("日曜日のシフトに吉田さんを入れて", "adjust"),
+    ("10月20日の人員を増やして", "adjust"),
+    ("時間帯をずらして", "adjust"),
+    ("中村さんを土曜に入れて", "adjust"),
+    ("水曜の夜勤を1人増やして", "adjust"),
+    ("don't put tanaka and sato on the same shift", "adjust"),
+    ("add a shift for suzuki on friday", "adjust"),
+]
+
+_lock = threading.Lock()
+_weights: Optional[np.ndarray] = None
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text or "")).strip().casefold()
+
+
+def features(text: str) -> np.ndarray:
+    """文字 n-gram をハッシュした 0/1 特徴（L2 正規化済み）+ バイアス"""
+    t = f"^{normalize(text)}$"
+    idx = {zlib.crc32(t[i:i + n].encode("utf-8")) % _DIM for n in _NGRAMS for i in range(len(t) - n + 1)}
+    x = np.zeros(_DIM + 1)
+    if idx:
+        x[list(idx)] = 1.0 / np.sqrt(len(idx))
+    x[_DIM] = 1.0
+    return x
+
+
+def _train(examples: List[Tuple[str, str]], epochs: int = 300, lr: float = 2.0, l2: float = 1e-3) -> np.ndarray:
+    X = np.stack([features(t) for t, _ in examples])
+    y = np.array([INTENTS.index(label) for _, label in examples])
+    Y = np.eye(len(INTENTS))[y]
+    W = np.zeros((X.shape[1], len(INTENTS)))
+    for _ in range(epochs):
+        P = _softmax(X @ W)
+        W -= lr * (X.T @ (P - Y) / len(X) + l2 * W)
+    return W
+
+
+def _softmax(z: np.ndarray) -> np.ndarray:
+    z = z - z.max(axis=-1, keepdims=True)
+    e = np.exp(z)
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def warm() -> None:
+    """起動時に学習を済ませておく（最初のメッセージで待たせない）"""
+    _model()
+
+
+def _model() -> np.ndarray:
+    global _weights
+    if _weights is None:
+        with _lock:
+            if _weights is None:
+                _weights = _train(_EXAMPLES)
+    return _weights
+
+
+def classify(text: str) -> Tuple[str, float]:
+    """(意図, 確信度)。規則に当たればその確信度、当たらなければモデルの確率"""
+    t = normalize(text)
+    question = _QUESTION.search(t) is not None
+    for pattern, intent, confidence in _RULES:
+        if question and intent != "qa":
+            continue
+        if pattern.search(t):
+            return intent, confidence
+    p = _softmax(features(t) @ _model())
+    k = int(p.argmax())
+    if question and INTENTS[k] != "qa":
+        return INTENTS[k], min(float(p[k]), QUESTION_ACTION_CAP)
+    return INTENTS[k], float(p[k])
@@ -0,0 +1,48 @@
+"""ストリームで届く LLM の応答から JSON オブジェクトを切り出す
+
+断片を feed() するたびに、閉じ終わった最上位の {...} を json.loads できたものから返す。
+文字列リテラル内の括弧とエスケープは数えない。読めなかったオブジェクトは捨てて続きを探す。
+```json のコードフェンスや前後の説明文はそのまま読み飛ばす。
+"""
+import json
+from typing import Any, Dict, List
+
+
+class JsonObjectScanner:
+    def __init__(self):
+        self._buf: List[str] = []
+        self._depth = 0
+        self._in_str = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        for ch in chunk:
+            if self._depth == 0:
+                if ch == "{":
+                    self._buf = [ch]
+                    self._depth = 1
+                continue
+            self._buf.append(ch)
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_str = False
+            elif ch == '"':
+                self._in_str = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    try:
+                        obj = json.loads("".join(self._buf))
+                    except ValueError:
+                        obj = None
+                    if isinstance(obj, dict):
+                        out.append(obj)
+                    self._buf = []
+        return out
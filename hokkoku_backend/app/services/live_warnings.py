@@ -0,0 +1,266 @@
+"""スケジュール全体の警告（validate_shift_constraints と同じ 3 種）を差分更新で保つ
+
+コミットごとの差分行（追加・削除・更新前後）だけを当て、影響する近傍だけを数え直す。
+- 人員不足: (日, 時間枠) ごとの人数と、人数が 1 の枠の日ごとの数
+- スキル不足: 日ごとのシフト数と、スキル 3 以上の人のシフト数
+- 連続勤務: 従業員ごとの (日, 開始時刻) の並び。変わった日の前後 1 日から連続をたどって、その範囲の連続だけを判定し直す
+
+警告は項目（キー -> 内容）の集合で持ち、前回 take_delta() からの追加・解消を取り出せる。
+warnings() は項目が変わった時だけ組み立て直すので、読み取りはスケジュールの規模によらない。
+"""
+import bisect
+import threading
+from collections import Counter
+from datetime import date
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from .schedule_table import slot_times
+
+Key = Tuple[int, int]                        # (日の序数, 開始時刻の分)
+
+# validate_shift_constraints と同じ連続の定義（開始時刻の分）
+_SAME_DAY = {(0, 480), (480, 960), (960, 0)}
+_NEXT_DAY = {(960, 0), (0, 480)}
+SKILLED = 3
+
+
+def _linked(a: Key, b: Key) -> bool:
+    gap = b[0] - a[0]
+    if gap == 0:
+        return (a[1], b[1]) in _SAME_DAY
+    return gap == 1 and (a[1], b[1]) in _NEXT_DAY
+
+
+def _period(k: Key) -> str:
+    return f"{date.fromordinal(k[0]).isoformat()}_{k[1] // 60:02d}:{k[1] % 60:02d}"
+
+
+def _display(dates: List[str]) -> str:
+    return dates[0] if len(dates) == 1 else "、".join(dates)
+
+
+class _Timeline:
+    """1 人分の (日, 開始時刻) の多重集合。同じキーが重複している所で連続は切れる"""
+
+    __slots__ = ("keys", "count")
+
+    def __init__(self):
+        self.keys: List[Key] = []
+        self.count: Dict[Key, int] = {}
+
+    def add(self, k: Key) -> None:
+        n = self.count.get(k, 0)
+        if not n:
+            bisect.insort(self.keys, k)
+        self.count[k] = n + 1
+
+    def remove(self, k: Key) -> None:
+        n = self.count.get(k, 0)
+        if n <= 1:
+            self.count.pop(k, None)
+            i = bisect.bisect_left(self.keys, k)
+            if i < len(self.keys) and self.keys[i] == k:
+                del self.keys[i]
+        else:
+            self.count[k] = n - 1
+
+    def flagged_runs(self, lo_day: int, hi_day: int) -> Tuple[Key, Key, Dict[Key, List[Key]]]:
+        """lo_day〜hi_day に触れる連続を両側へたどり、その範囲 [始点, 終点] と 3 枠以上の連続（始点 -> 最初の 3 枠）を返す"""
+        keys = self.keys
+        i0 = bisect.bisect_left(keys, (lo_day, -1))
+        i1 = bisect.bisect_right(keys, (hi_day, 1 << 30)) - 1
+        lo: Key = (lo_day, -1)
+        hi: Key = (hi_day, 1 << 30)
+        out: Dict[Key, List[Key]] = {}
+        if i0 > i1:
+            return lo, hi, out
+        while i0 > 0 and _linked(keys[i0 - 1], keys[i0]):
+            i0 -= 1
+        while i1 + 1 < len(keys) and _linked(keys[i1], keys[i1 + 1]):
+            i1 += 1
+        lo, hi = min(lo, keys[i0]), max(hi, keys[i1])
+        run: List[Key] = []
+        for i in range(i0, i1 + 1):
+            k = keys[i]
+            if run and not _linked(keys[i - 1], k):
+                run = []
+            run.append(k)
+            if len(run) == 3:
+                out[run[0]] = list(run)
+            if self.count[k] > 1:
+                # 重複しているキーで連続は切れ、最後の 1 件から次の連続が始まる
+                run = [k]
+        return lo, hi, out
+
+
+class WarningIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._skill: Dict[int, int] = {}
+        self._cells: Counter = Counter()          # (日, 時間枠) -> 人数
+        self._short: Counter = Counter()          # 日 -> 人数 1 の枠の数
+        self._day_n: Counter = Counter()          # 日 -> シフト数
+        self._day_skilled: Counter = Counter()    # 日 -> スキル 3 以上の人のシフト数
+        self._timelines: Dict[int, _Timeline] = {}
+        self._runs: Dict[int, Dict[Key, List[Key]]] = {}
+        self._items: Dict[tuple, Dict[str, Any]] = {}
+        # 前回 take_delta() 以降に触った項目の、その時点の内容（無ければ None）
+        self._pending: Dict[tuple, Optional[Dict[str, Any]]] = {}
+        self._built: Optional[List[Dict[str, Any]]] = None
+        self._names: Dict[int, str] = {}
+        self._start_min: List[int] = []
+        self.size = 0                             # 数えているシフト数（テーブルの行数と食い違えば作り直す）
+
+    # --- 更新 ---------------------------------------------------------------
+
+    def rebuild(self, rows: np.ndarray, employees: Iterable[Dict[str, Any]]) -> None:
+        """全件から作り直す（従業員マスタが変わった時、差分を追えない時）"""
+        with self._lock:
+            old = self._items
+            for key, item in old.items():
+                self._pending.setdefault(key, item)
+            emps = list(employees)
+            self._skill = {int(e["id"]): int(e.get("skill_level") or 1) for e in emps if e.get("id") is not None}
+            self._names = {int(e["id"]): e.get("name") for e in emps if e.get("id") is not None}
+            self._cells.clear()
+            self._short.clear()
+            self._day_n.clear()
+            self._day_skilled.clear()
+            self._timelines.clear()
+            self._runs.clear()
+            self._items = {}
+            self.size = 0
+            self._apply(rows, ())
+
+    def apply(self, added: np.ndarray, removed: np.ndarray, before: np.ndarray, after: np.ndarray) -> None:
+        """コミットの差分行を当てる（更新は 更新前を削除 + 更新後を追加 として扱う）"""
+        if not (len(added) or len(removed) or len(before)):
+            return
+        with self._lock:
+            self._apply(np.concatenate([added, after]), np.concatenate([removed, before]))
+
+    def _apply(self, add_rows, remove_rows) -> None:
+        touched_days: set = set()
+        touched: Dict[int, set] = {}
+        for sign, rows in ((-1, remove_rows), (1, add_rows)):
+            if not len(rows):
+                continue
+            for emp, day, slot in zip(rows["employee_id"].tolist(), rows["day"].tolist(), rows["slot"].tolist()):
+                self._count(emp, day, slot, sign)
+                self.size += sign
+                touched_days.add(day)
+                touched.setdefault(emp, set()).add(day)
+        for day in touched_days:
+            self._set(("insufficient_staff", day), {"type": "insufficient_staff", "date": date.fromordinal(day).isoformat()}
+                      if self._short[day] else None)
+            self._set(("skill_requirement", day), {"type": "skill_requirement", "date": date.fromordinal(day).isoformat()}
+                      if self._day_n[day] and not self._day_skilled[day] else None)
+        for emp, days in touched.items():
+            self._recheck_runs(emp, sorted(days))
+        self._built = None
+
+    def _count(self, emp: int, day: int, slot: int, sign: int) -> None:
+        cell = (day, slot)
+        n = self._cells[cell]
+        m = n + sign
+        self._short[day] += (m == 1) - (n == 1)
+        if m:
+            self._cells[cell] = m
+        else:
+            del self._cells[cell]
+        self._day_n[day] += sign
+        if self._skill.get(emp, 1) >= SKILLED:
+            self._day_skilled[day] += sign
+        while slot >= len(self._start_min):
+            t = slot_times(len(self._start_min))[0]
+            self._start_min.append(t.hour * 60 + t.minute)
+        timeline = self._timelines.get(emp)
+        if timeline is None:
+            timeline = self._timelines[emp] = _Timeline()
+        (timeline.add if sign > 0 else timeline.remove)((day, self._start_min[slot]))
+
+    def _recheck_runs(self, emp: int, days: List[int]) -> None:
+        timeline = self._timelines[emp]
+        runs = self._runs.setdefault(emp, {})
+        # 近い日はまとめて 1 つの範囲としてたどる
+        spans: List[List[int]] = []
+        for d in days:
+            if spans and d - 1 <= spans[-1][1] + 1:
+                spans[-1][1] = d + 1
+            else:
+                spans.append([d - 1, d + 1])
+        for lo_day, hi_day in spans:
+            lo, hi, found = timeline.flagged_runs(lo_day, hi_day)
+            for start in [s for s in runs if lo <= s <= hi and s not in found]:
+                del runs[start]
+                self._set(("consecutive_timeslots", emp, *start), None)
+            for start, periods in found.items():
+                runs[start] = periods
+                self._set(("consecutive_timeslots", emp, *start), {
+                    "type": "consecutive_timeslots",
+                    "employee_id": emp,
+                    "affected_dates": [_period(k) for k in periods],
+                })
+        if not timeline.keys:
+            del self._timelines[emp]
+        if not runs:
+            del self._runs[emp]
+
+    def _set(self, key: tuple, item: Optional[Dict[str, Any]]) -> None:
+        current = self._items.get(key)
+        if current == item:
+            return
+        self._pending.setdefault(key, current)
+        if item is None:
+            del self._items[key]
+        else:
+            self._items[key] = item
+
+    # --- 読み取り -----------------------------------------------------------
+
+    def take_delta(self) -> Dict[str, List[Dict[str, Any]]]:
+        """前回呼んでから追加・変化した項目（added）と解消した項目（resolved）"""
+        with self._lock:
+            added: List[Dict[str, Any]] = []
+            resolved: List[Dict[str, Any]] = []
+            for key in sorted(self._pending, key=repr):
+                old, new = self._pending[key], self._items.get(key)
+                if new is None and old is not None:
+                    resolved.append(old)
+                elif new is not None and new != old:
+                    added.append(new)
+            self._pending.clear()
+            return {"added": added, "resolved": resolved}
+
+    def warnings(self) -> List[Dict[str, Any]]:
+        """ShiftValidationWarning 相当の dict（従業員・日付は昇順）。項目が変わるまで同じリストを返す"""
+        with self._lock:
+            if self._built is None:
+                self._built = self._build()
+            return self._built
+
+    def _build(self) -> List[Dict[str, Any]]:
+        out: List[Dict[str, Any]] = []
+        labels: List[str] = []
+        last: Dict[int, List[Key]] = {}
+        for emp in sorted(self._runs):
+            for start in sorted(self._runs[emp]):
+                labels.append(f"{self._names.get(emp) or f'従業員ID{emp}'}(ID：{emp}番)")
+                last[emp] = self._runs[emp][start]
+        if labels:
+            out.append({
+                "type": "consecutive_timeslots",
+                "message": f"{'、'.join(labels)}が連続する時間枠でシフトに入っています",
+                "affected_employees": list(last),
+                "affected_dates": sorted({_period(k) for periods in last.values() for k in periods}),
+            })
+        for kind, text in (
+            ("insufficient_staff", "において人員が不足しています"),
+            ("skill_requirement", "においてスキルレベル3以上の従業員が不足しています"),
+        ):
+            dates = sorted(item["date"] for key, item in self._items.items() if key[0] == kind)
+            if dates:
+                out.append({"type": kind, "message": f"{_display(dates)}{text}", "affected_dates": dates})
+        return out
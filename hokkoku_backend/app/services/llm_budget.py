@@ -0,0 +1,89 @@
+"""1 リクエスト分の LLM 呼び出しの予算（締め切りと試行回数）
+
+ルーターで Budget を作って openai_client の各関数に渡す。再生成・再試行はすべて同じ予算から引くので、
+入れ子のループでも呼び出し回数と経過時間は LLM_MAX_ATTEMPTS / LLM_DEADLINE_MS で頭打ちになる。
+各呼び出しのタイムアウトは残り時間で切り詰め、失敗後の待ちは指数バックオフ + ジッター（残り時間を超えない）。
+打ち切った場合は explain() で何がどこまで進んで止まったかを利用者向けに説明する。
+"""
+import asyncio
+import random
+import time
+from typing import List, Optional
+
+from ..config import LLM_BACKOFF_BASE_MS, LLM_BACKOFF_MAX_MS, LLM_DEADLINE_MS, LLM_MAX_ATTEMPTS
+
+# 残りがこれより短ければ新しい呼び出しを始めない
+MIN_CALL_S = 0.5
+
+
+def describe_error(e: BaseException) -> str:
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError)) or type(e).__name__ in ("APITimeoutError", "ReadTimeout"):
+        return "タイムアウト"
+    name = type(e).__name__
+    if name == "RateLimitError":
+        return "レート制限"
+    if name in ("APIConnectionError", "ConnectError"):
+        return "接続エラー"
+    return f"応答エラー（{name}）"
+
+
+class Budget:
+    def __init__(self, deadline_s: Optional[float] = None, attempts: Optional[int] = None):
+        self.deadline_s = LLM_DEADLINE_MS / 1000.0 if deadline_s is None else deadline_s
+        self.max_attempts = LLM_MAX_ATTEMPTS if attempts is None else attempts
+        self.started = time.monotonic()
+        self.attempts = 0
+        self.failures: List[str] = []
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def remaining(self) -> float:
+        return max(0.0, self.deadline_s - self.elapsed())
+
+    @property
+    def exhausted(self) -> bool:
+        return self.attempts >= self.max_attempts or self.remaining() < MIN_CALL_S
+
+    def take(self) -> bool:
+        """呼び出しを 1 回始めてよければ数えて True"""
+        if self.exhausted:
+            return False
+        self.attempts += 1
+        return True
+
+    def fork(self, reserve: int = 0) -> "Budget":
+        """締め切りは共有し、試行回数は別に数える子予算（残り回数から reserve 回を除いた分まで）
+
+        取り消すかもしれない先行生成に渡す。使った分は absorb() で親に付けるまで親の回数を減らさない。
+        """
+        child = Budget(deadline_s=self.deadline_s, attempts=max(0, self.max_attempts - self.attempts - reserve))
+        child.started = self.started
+        return child
+
+    def absorb(self, child: "Budget") -> None:
+        self.attempts += child.attempts
+        self.failures.extend(child.failures)
+
+    def timeout(self, cap_s: float) -> float:
+        return max(MIN_CALL_S, min(cap_s, self.remaining()))
+
+    def fail(self, stage: str, reason: str) -> None:
+        self.failures.append(f"{stage}: {reason}")
+
+    async def backoff(self) -> None:
+        """失敗の後の待ち。full jitter（0〜上限の一様乱数）で同時に失敗したリクエストをばらす"""
+        cap = min(LLM_BACKOFF_MAX_MS, LLM_BACKOFF_BASE_MS * 2 ** max(0, self.attempts - 1)) / 1000.0
+        delay = min(random.uniform(0, cap), self.remaining() - MIN_CALL_S)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def explain(self, what: str) -> str:
+        if self.remaining() < MIN_CALL_S:
+            head = f"{what}が制限時間（{self.deadline_s:g} 秒）内に終わらなかったため中断しました"
+        elif self.attempts >= self.max_attempts:
+            head = f"{what}の試行回数の上限（{self.max_attempts} 回）に達したため中断しました"
+        else:
+            head = f"{what}に失敗しました"
+        tail = f"最後の失敗: {self.failures[-1]}" if self.failures else "応答がありませんでした"
+        return f"{head}（{self.attempts} 回試行・{self.elapsed():.1f} 秒、{tail}）。時間をおいて再度お試しください。"
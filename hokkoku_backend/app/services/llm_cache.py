@@ -0,0 +1,214 @@
+"""LLM 応答のキャッシュ（TTL + LRU、ローカル SQLite に永続化）
+
+キーは (種類, モデル, システムプロンプト, 正規化したユーザー入力, 関係する文脈) の正規化 JSON のハッシュ。
+文脈（制約・従業員マスタなど）はプロセス内のバージョン番号ではなく中身をキーに入れる。
+番号は再起動で振り直されるので、永続化したキャッシュと食い違うため。
+
+読み取りはメモリの LRU を先に見る。無ければ SQLite を引き（他のワーカーが書いた分も使える）、メモリに載せる。
+起動時に新しいものから maxsize 件をメモリに読み込む。
+
+SQLite はイベントループで触らない。書き込みはメモリに載せた後、専用スレッドがキューから順に書く（write-behind）。
+ファイル側の刈り込み（期限切れ・maxsize 超え）は PRUNE_EVERY 件書くごと。async の呼び出し側は aget() を使う
+（メモリに無い時だけ SQLite の読み取りをスレッドで行う）。
+"""
+import asyncio
+import copy
+import hashlib
+import json
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+logger = logging.getLogger("backend")
+
+_SPACES = re.compile(r"\s+")
+
+# ファイル側を刈り込む間隔（書き込み件数）
+PRUNE_EVERY = 64
+
+
+def normalize_prompt(text: str) -> str:
+    """全角半角・大文字小文字・空白の違いを吸収する"""
+    return _SPACES.sub(" ", unicodedata.normalize("NFKC", text or "")).strip().casefold()
+
+
+def cache_key(kind: str, model: str, system: str, prompt: str, **context: Any) -> str:
+    body = json.dumps(
+        {"kind": kind, "model": model, "system": system, "prompt": normalize_prompt(prompt), "context": context},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: Optional[Path] = None, maxsize: int = 512, ttl_s: float = 21600.0):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._items: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()   # key -> (期限, 値)
+        self._lock = threading.Lock()          # メモリ側
+        self._db_lock = threading.Lock()       # SQLite 接続（イベントループからは取らない）
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes: "queue.Queue[Optional[Tuple[str, str, str, float, float]]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+        self._since_prune = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if path and maxsize > 0:
+            try:
+                self._open(Path(path))
+            except sqlite3.Error as e:
+                logger.warning("llm cache: cannot open %s (%s), using memory only", path, e)
+                self._conn = None
+
+    def _open(self, path: Path) -> None:
+        self._conn = sqlite3.connect(str(path), timeout=5.0, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, kind TEXT NOT NULL, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, used_at REAL NOT NULL)"
+        )
+        now = time.time()
+        self._conn.execute("DELETE FROM llm_cache WHERE expires_at <= ?", (now,))
+        rows = self._conn.execute(
+            "SELECT key, value, expires_at FROM llm_cache ORDER BY used_at DESC LIMIT ?", (self.maxsize,)
+        ).fetchall()
+        for key, value, expires_at in reversed(rows):
+            self._items[key] = (expires_at, json.loads(value))
+
+    def get(self, key: str) -> Optional[Any]:
+        """同期版（スレッドから呼ぶ時・テスト用）。メモリに無ければ SQLite を読む"""
+        found, hit = self._get_memory(key)
+        if not found:
+            hit = self._get_db(key)
+        return self._finish(key, hit)
+
+    async def aget(self, key: str) -> Optional[Any]:
+        """イベントループ用。メモリで済めばそのまま、SQLite を読む時だけスレッドに回す"""
+        found, hit = self._get_memory(key)
+        if not found:
+            hit = await asyncio.to_thread(self._get_db, key)
+        return self._finish(key, hit)
+
+    def _get_memory(self, key: str) -> Tuple[bool, Optional[Tuple[float, Any]]]:
+        """(決着したか, 項目)。メモリに無く SQLite を見る必要がある時は (False, None)"""
+        with self._lock:
+            hit = self._items.get(key)
+            if hit is not None and hit[0] <= time.time():
+                del self._items[key]
+                hit = None
+            return hit is not None or self._conn is None, hit
+
+    def _get_db(self, key: str) -> Optional[Tuple[float, Any]]:
+        with self._db_lock:
+            try:
+                row = self._conn.execute(
+                    "SELECT value, expires_at FROM llm_cache WHERE key = ? AND expires_at > ?", (key, time.time())
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning("llm cache: read failed (%s)", e)
+                return None
+        return None if row is None else (row[1], json.loads(row[0]))
+
+    def _finish(self, key: str, hit: Optional[Tuple[float, Any]]) -> Optional[Any]:
+        with self._lock:
+            if hit is None:
+                self.misses += 1
+                return None
+            self._remember(key, hit)
+            self.hits += 1
+        # 呼び出し側が書き換えてもキャッシュに響かないよう複製を返す
+        return copy.deepcopy(hit[1])
+
+    def put(self, key: str, value: Any, kind: str = "") -> None:
+        """メモリに載せ、ファイルへの書き込みはキューに積むだけ（待たない）"""
+        if self.maxsize <= 0:
+            return
+        now = time.time()
+        entry = (now + self.ttl_s, copy.deepcopy(value))
+        with self._lock:
+            self._remember(key, entry)
+        if self._conn is None:
+            return
+        self._writes.put((key, kind, json.dumps(value, ensure_ascii=False), entry[0], now))
+        if self._writer is None:
+            with self._lock:
+                if self._writer is None:
+                    self._writer = threading.Thread(target=self._write_loop, name="llm-cache-writer", daemon=True)
+                    self._writer.start()
+
+    def flush(self) -> None:
+        """積んだ書き込みがファイルに入るまで待つ"""
+        if self._writer is not None:
+            self._writes.join()
+
+    def _write_loop(self) -> None:
+        while True:
+            item = self._writes.get()
+            try:
+                if item is None:
+                    return
+                self._write(*item)
+            finally:
+                self._writes.task_done()
+
+    def _write(self, key: str, kind: str, value: str, expires_at: float, now: float) -> None:
+        with self._db_lock:
+            try:
+                self._conn.execute(
+                    "INSERT INTO llm_cache (key, kind, value, expires_at, used_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at, used_at = excluded.used_at",
+                    (key, kind, value, expires_at, now),
+                )
+                self._since_prune += 1
+                if self._since_prune >= PRUNE_EVERY:
+                    self._since_prune = 0
+                    self._prune(now)
+            except sqlite3.Error as e:
+                logger.warning("llm cache: write failed (%s)", e)
+
+    def _prune(self, now: float) -> None:
+        # ファイル側は期限切れと、書き込みの古いものから落として maxsize 件に保つ
+        self._conn.execute(
+            "DELETE FROM llm_cache WHERE expires_at <= ? OR key NOT IN "
+            "(SELECT key FROM llm_cache ORDER BY used_at DESC LIMIT ?)",
+            (now, self.maxsize),
+        )
+
+    def _remember(self, key: str, entry: Tuple[float, Any]) -> None:
+        self._items[key] = entry
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+        if self._conn is not None:
+            self.flush()
+            with self._db_lock:
+                self._conn.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "ttl_s": self.ttl_s,
+            "persistent": self._conn is not None,
+            "pending_writes": self._writes.qsize(),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
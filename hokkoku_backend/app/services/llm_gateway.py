@@ -0,0 +1,212 @@
+"""LLM 呼び出しの入口
+
+AsyncOpenAI をイベントループごとに 1 つの httpx.AsyncClient（接続プール）の上で使い回し、
+TLS 接続をリクエストごとに張り直さない。同時実行数は LLM_CONCURRENCY のセマフォで抑え、
+遅い LLM 応答が他の API のワーカーやイベントループを塞がないようにする。
+
+API キーはサーバー設定（OPENAI_API_KEY）を既定とし、呼び出し側が渡したキー（X-API-Key など）にも対応する。
+キーごとのクライアントは同じ接続プールを共有する。
+"""
+import asyncio
+import contextlib
+import logging
+import weakref
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+import httpx
+
+try:
+    from openai import AsyncOpenAI
+except ImportError:  # pragma: no cover - openai は必須依存だが、無ければモック応答になる
+    AsyncOpenAI = None
+
+from ..config import (
+    LLM_CONCURRENCY,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE,
+    OPENAI_API_KEY,
+    OPENAI_BASE_URL,
+)
+from . import llm_metrics
+
+logger = logging.getLogger("backend")
+
+# キーごとの AsyncOpenAI を何個まで持つか（利用者のキーを受け取る API 用）
+MAX_CLIENTS = 16
+
+
+class _LoopState:
+    __slots__ = ("http", "clients", "semaphore", "in_flight", "waiting")
+
+    def __init__(self):
+        self.http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_KEEPALIVE),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+        self.clients: "OrderedDict[str, Any]" = OrderedDict()
+        self.semaphore = asyncio.Semaphore(max(1, LLM_CONCURRENCY))
+        self.in_flight = 0
+        self.waiting = 0
+
+
+# httpx の接続とセマフォは作ったイベントループに属するので、ループごとに持つ
+_states: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _LoopState]" = weakref.WeakKeyDictionary()
+
+
+def available(api_key: Optional[str] = None) -> bool:
+    return AsyncOpenAI is not None and bool(api_key or OPENAI_API_KEY)
+
+
+def _state() -> _LoopState:
+    loop = asyncio.get_running_loop()
+    st = _states.get(loop)
+    if st is None:
+        st = _states[loop] = _LoopState()
+    return st
+
+
+def client(api_key: Optional[str] = None) -> Any:
+    """このイベントループの共有プールを使う AsyncOpenAI"""
+    st = _state()
+    key = api_key or OPENAI_API_KEY or ""
+    c = st.clients.get(key)
+    if c is None:
+        # 再試行は呼び出し側の予算（llm_budget）で数えるので SDK 側では行わない
+        c = AsyncOpenAI(api_key=key, base_url=OPENAI_BASE_URL, http_client=st.http, max_retries=0)
+        st.clients[key] = c
+        while len(st.clients) > MAX_CLIENTS:
+            st.clients.popitem(last=False)
+    else:
+        st.clients.move_to_end(key)
+    return c
+
+
+async def chat(
+    messages: List[Dict[str, str]],
+    *,
+    model: str,
+    max_tokens: int,
+    timeout: float,
+    temperature: float = 0.0,
+    api_key: Optional[str] = None,
+    op: str = "chat",
+) -> str:
+    """chat.completions を 1 回呼び、本文を返す（失敗は呼び出し側で扱う）
+
+    timeout は順番待ちも含めた経過時間の上限（超えたら asyncio.TimeoutError）。
+    op は計測（llm_metrics）での呼び出しの種類。
+    """
+    with llm_metrics.track(op, model) as call:
+        return await asyncio.wait_for(
+            _chat(messages, model=model, max_tokens=max_tokens, timeout=timeout, temperature=temperature,
+                  api_key=api_key, call=call),
+            timeout,
+        )
+
+
+async def _chat(messages, *, model, max_tokens, timeout, temperature, api_key, call) -> str:
+    st = _state()
+    st.waiting += 1
+    try:
+        await st.semaphore.acquire()
+    finally:
+        st.waiting -= 1
+    st.in_flight += 1
+    try:
+        r = await client(api_key).chat.completions.create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            timeout=timeout,
+        )
+    finally:
+        st.in_flight -= 1
+        st.semaphore.release()
+    usage = getattr(r, "usage", None)
+    if usage is not None:
+        call.usage(usage.prompt_tokens, usage.completion_tokens)
+    return r.choices[0].message.content or ""
+
+
+async def stream(
+    messages: List[Dict[str, str]],
+    *,
+    model: str,
+    max_tokens: int,
+    timeout: float,
+    temperature: float = 0.0,
+    api_key: Optional[str] = None,
+    op: str = "stream",
+) -> AsyncIterator[str]:
+    """chat.completions をストリームで呼び、本文の断片を届いた順に返す
+
+    timeout は順番待ちを含めた全体の上限。途中で超えたら asyncio.TimeoutError。
+    """
+    with llm_metrics.track(op, model) as call:
+        # 途中で読むのをやめられた場合も内側を閉じて接続とセマフォをすぐ返す
+        async with contextlib.aclosing(_stream(messages, model=model, max_tokens=max_tokens, timeout=timeout,
+                                               temperature=temperature, api_key=api_key, call=call)) as pieces:
+            async for piece in pieces:
+                call.first_token()
+                yield piece
+
+
+async def _stream(messages, *, model, max_tokens, timeout, temperature, api_key, call) -> AsyncIterator[str]:
+    loop = asyncio.get_running_loop()
+    end = loop.time() + timeout
+    st = _state()
+    st.waiting += 1
+    try:
+        await asyncio.wait_for(st.semaphore.acquire(), timeout)
+    finally:
+        st.waiting -= 1
+    st.in_flight += 1
+    try:
+        resp = await asyncio.wait_for(
+            client(api_key).chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens,
+                timeout=max(0.0, end - loop.time()),
+                stream=True,
+                stream_options={"include_usage": True},
+            ),
+            max(0.0, end - loop.time()),
+        )
+        chunks = resp.__aiter__()
+        try:
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(chunks.__anext__(), max(0.0, end - loop.time()))
+                except StopAsyncIteration:
+                    break
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if getattr(chunk, "usage", None) is not None:
+                    call.usage(chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+        finally:
+            await resp.close()
+    finally:
+        st.in_flight -= 1
+        st.semaphore.release()
+
+
+def stats() -> Dict[str, int]:
+    states = list(_states.values())
+    return {
+        "loops": len(states),
+        "concurrency": LLM_CONCURRENCY,
+        "in_flight": sum(s.in_flight for s in states),
+        "waiting": sum(s.waiting for s in states),
+    }
+
+
+async def aclose() -> None:
+    """このイベントループの接続プールを閉じる（アプリ終了時）"""
+    st = _states.pop(asyncio.get_running_loop(), None)
+    if st is not None:
+        st.clients.clear()
+        await st.http.aclose()
@@ -0,0 +1,175 @@
+"""LLM 呼び出しの計測（レイテンシ・トークン・再試行・失敗の種類）
+
+llm_gateway の chat / stream が 1 回呼ぶごとに track() で記録する。
+- 呼び出し数: (操作, モデル, 結果) ごと。結果は ok / timeout / rate_limit / connection / api_error / cancelled / error
+- レイテンシのヒストグラム: (操作, モデル) ごと（ストリームは最初のトークンまでも別に持つ）
+- トークン数: (操作, モデル) ごとの prompt / completion の合計（API が usage を返した時だけ）
+- その他の件数: count() で (名前, 操作) ごと（キャッシュヒット、応答の形式不正、再試行など）
+
+1 呼び出しごとに "llm_call" の構造化ログ（JSON 1 行）を backend ロガーに出す。
+snapshot() は /api/llm/metrics の JSON、render_prometheus() は Prometheus のテキスト形式。
+"""
+import asyncio
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("backend")
+
+# レイテンシの区切り（秒）
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 60.0)
+
+
+def classify_error(e: BaseException) -> str:
+    if isinstance(e, (asyncio.CancelledError, GeneratorExit)):
+        return "cancelled"
+    if isinstance(e, (asyncio.TimeoutError, TimeoutError)):
+        return "timeout"
+    name = type(e).__name__
+    if name in ("APITimeoutError", "ReadTimeout", "ConnectTimeout", "DeadlineExceeded"):
+        return "timeout"
+    if name in ("RateLimitError", "ResourceExhausted", "TooManyRequests"):
+        return "rate_limit"
+    if name in ("APIConnectionError", "ConnectError", "ServiceUnavailable"):
+        return "connection"
+    if (name.startswith("API") and name.endswith("Error")) or name in ("BadRequestError", "AuthenticationError", "InternalServerError"):
+        return "api_error"
+    return "error"
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "n")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, v: float) -> None:
+        i = 0
+        while i < len(BUCKETS) and v > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += v
+        self.n += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        cum, buckets = 0, {}
+        for le, c in zip([*map(str, BUCKETS), "+Inf"], self.counts):
+            cum += c
+            buckets[le] = cum
+        return {"count": self.n, "sum": round(self.total, 6), "buckets": buckets}
+
+
+_lock = threading.Lock()
+_calls: Dict[Tuple[str, str, str], int] = defaultdict(int)
+_latency: Dict[Tuple[str, str], _Histogram] = defaultdict(_Histogram)
+_first_token: Dict[Tuple[str, str], _Histogram] = defaultdict(_Histogram)
+_tokens: Dict[Tuple[str, str, str], int] = defaultdict(int)
+_counters: Dict[Tuple[str, str], int] = defaultdict(int)
+
+
+class Call:
+    """1 回の呼び出しの記録。with を抜ける時に結果とレイテンシを確定する"""
+
+    def __init__(self, op: str, model: str, provider: str):
+        self.op = op
+        self.model = model
+        self.provider = provider
+        self.outcome = "ok"
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self.first_token_s: Optional[float] = None
+        self._t0 = time.perf_counter()
+
+    def usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> None:
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+    def first_token(self) -> None:
+        if self.first_token_s is None:
+            self.first_token_s = time.perf_counter() - self._t0
+
+    def __enter__(self) -> "Call":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc is not None:
+            self.outcome = classify_error(exc)
+        latency = time.perf_counter() - self._t0
+        key = (self.op, self.model)
+        with _lock:
+            _calls[(self.op, self.model, self.outcome)] += 1
+            _latency[key].observe(latency)
+            if self.first_token_s is not None:
+                _first_token[key].observe(self.first_token_s)
+            if self.prompt_tokens is not None:
+                _tokens[(self.op, self.model, "prompt")] += self.prompt_tokens
+            if self.completion_tokens is not None:
+                _tokens[(self.op, self.model, "completion")] += self.completion_tokens
+        record = {
+            "event": "llm_call",
+            "provider": self.provider,
+            "op": self.op,
+            "model": self.model,
+            "outcome": self.outcome,
+            "latency_ms": round(latency * 1000, 1),
+            "first_token_ms": None if self.first_token_s is None else round(self.first_token_s * 1000, 1),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+        if exc is not None and self.outcome != "cancelled":
+            record["error"] = f"{type(exc).__name__}: {exc}"[:300]
+        (logger.info if self.outcome in ("ok", "cancelled") else logger.warning)(json.dumps(record, ensure_ascii=False))
+        return False
+
+
+def track(op: str, model: str, provider: str = "openai") -> Call:
+    return Call(op, model, provider)
+
+
+def count(name: str, op: str, n: int = 1) -> None:
+    with _lock:
+        _counters[(name, op)] += n
+
+
+def reset() -> None:
+    with _lock:
+        for d in (_calls, _latency, _first_token, _tokens, _counters):
+            d.clear()
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "calls": [{"op": o, "model": m, "outcome": r, "count": c} for (o, m, r), c in sorted(_calls.items())],
+            "latency_seconds": [{"op": o, "model": m, **h.to_dict()} for (o, m), h in sorted(_latency.items())],
+            "first_token_seconds": [{"op": o, "model": m, **h.to_dict()} for (o, m), h in sorted(_first_token.items())],
+            "tokens": [{"op": o, "model": m, "kind": k, "count": c} for (o, m, k), c in sorted(_tokens.items())],
+            "counters": [{"name": n, "op": o, "count": c} for (n, o), c in sorted(_counters.items())],
+        }
+
+
+def _labels(**kv: str) -> str:
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in kv.items()) + "}"
+
+
+def render_prometheus() -> str:
+    snap = snapshot()
+    lines: List[str] = ["# TYPE llm_calls_total counter"]
+    lines += [f"llm_calls_total{_labels(op=c['op'], model=c['model'], outcome=c['outcome'])} {c['count']}" for c in snap["calls"]]
+    for metric, rows in (("llm_latency_seconds", snap["latency_seconds"]), ("llm_first_token_seconds", snap["first_token_seconds"])):
+        lines.append(f"# TYPE {metric} histogram")
+        for h in rows:
+            for le, c in h["buckets"].items():
+                lines.append(f"{metric}_bucket{_labels(op=h['op'], model=h['model'], le=le)} {c}")
+            lines.append(f"{metric}_sum{_labels(op=h['op'], model=h['model'])} {h['sum']}")
+            lines.append(f"{metric}_count{_labels(op=h['op'], model=h['model'])} {h['count']}")
+    lines.append("# TYPE llm_tokens_total counter")
+    lines += [f"llm_tokens_total{_labels(op=t['op'], model=t['model'], kind=t['kind'])} {t['count']}" for t in snap["tokens"]]
+    lines.append("# TYPE llm_events_total counter")
+    lines += [f"llm_events_total{_labels(name=c['name'], op=c['op'])} {c['count']}" for c in snap["counters"]]
+    return "\n".join(lines) + "\n"
@@ -1,15 +1,82 @@
-from typing import Dict, Any, Tuple, Optional
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import copy
 import json
+import logging
 import re
-from ..config import OPENAI_API_KEY, MOCK_OPENAI, OPENAI_MODEL, OPENAI_TIMEOUT_QA_MS, OPENAI_TIMEOUT_APPLY_MS, MAX_REPROMPTS
+from ..config import (
+    MOCK_OPENAI, OPENAI_MODEL, OPENAI_TIMEOUT_QA_MS, OPENAI_TIMEOUT_APPLY_MS, MAX_REPROMPTS,
+    LLM_CACHE_PATH, LLM_CACHE_SIZE, LLM_CACHE_TTL_S,
+)
+from . import employee_context, llm_gateway, llm_metrics
+from .llm_cache import LLMCache, cache_key
+from .llm_budget import Budget, describe_error
+from .json_stream import JsonObjectScanner
+from .validation import validate_constraints
+from .diff import materialize
 
-_client = None
-if not MOCK_OPENAI and OPENAI_API_KEY:
+logger = logging.getLogger("backend")
+
+# 同じ言い回しの問い合わせは API を呼ばずに返す（成功した応答だけ入れる）
+_cache = LLMCache(LLM_CACHE_PATH or None, LLM_CACHE_SIZE, LLM_CACHE_TTL_S)
+
+def _mock() -> bool:
+    return MOCK_OPENAI or not llm_gateway.available()
+
+def _remember(key: str, kind: str, value: Any) -> Any:
+    _cache.put(key, value, kind)
+    return value
+
+def _valid_spec(spec: Dict[str, Any], base: Dict[str, Any]) -> bool:
     try:
-        from openai import OpenAI
-        _client = OpenAI(api_key=OPENAI_API_KEY)
-    except Exception:
-        _client = None
+        return validate_constraints(materialize(spec, copy.deepcopy(base)))[0]
+    except Exception as e:  # LLM の案は形が崩れていることがある（patch が配列でない等）
+        logger.debug("LLM spec cannot be applied: %s", e)
+        return False
+
+async def _cached(key: str, op: str) -> Any:
+    hit = await _cache.aget(key)
+    if hit is not None:
+        llm_metrics.count("cache_hit", op)
+    return hit
+
+def _invalid(budget: Budget, stage: str, op: str, reason: str) -> None:
+    """応答は来たが使えなかった（JSON が無い・形式が違う）"""
+    llm_metrics.count("invalid_output", op)
+    budget.fail(stage, reason)
+
+def _gave_up(budget: Budget, stage: str, op: str) -> str:
+    llm_metrics.count("budget_exhausted" if budget.exhausted else "gave_up", op)
+    return budget.explain(stage)
+
+def cache_stats() -> Dict[str, Any]:
+    return _cache.stats()
+
+def flush_cache() -> None:
+    """積んであるキャッシュの書き込みをファイルに入れ切る（終了時用）"""
+    _cache.flush()
+
+_APPLY_SYSTEM = (
+    "You are an assistant that proposes constraint changes for a shift optimizer. "
+    "Output concise assistant_text and a strict JSON object named spec with either: "
+    "{'type':'patch','patch':[{'op':'replace','path':'/min_staff_weekend','value':2}]} "
+    "or {'type':'full','full':{...full constraints json...}}. Return only a short explanation first then JSON."
+)
+_QA_SYSTEM = "You are a helpful assistant for a call center shift optimization tool. Answer briefly and clearly in Japanese."
+_MOCK_QA = "現在の条件では週末の最小人員は1です。必要なら適用案を生成できます。"
+_MOCK_APPLY = {
+    "assistant_text": "変更案を提案します。週末の最小人員を+1します。",
+    "json": {"type": "patch", "patch": [{"op": "replace", "path": "/min_staff_weekend", "value": 2}]}
+}
+
+def _apply_user(content: str, constraints: Dict[str, Any]) -> str:
+    return f"Current constraints JSON:\n{json.dumps(constraints, ensure_ascii=False)}\nUser request:\n{content}"
+
+def _spec_of(js: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """応答の JSON から変更案（patch / full）を取り出す。spec で包まれていても可"""
+    spec = js if js.get("type") in ("patch","full") else js.get("spec")
+    if isinstance(spec, dict) and spec.get("type") in ("patch","full"):
+        return spec
+    return None
 
 def _extract_json(text: str) -> Optional[dict]:
     if not text:
@@ -19,95 +86,106 @@ def _extract_json(text: str) -> Optional[dict]:
     if m:
         try:
             return json.loads(m.group(1))
-        except Exception:
-            pass
+        except ValueError as e:
+            logger.debug("fenced JSON in LLM reply is not valid: %s", e)
     
     m = re.search(r"\{[\s\S]*\}", text)
     if m:
         try:
             return json.loads(m.group(0))
-        except Exception:
-            pass
+        except ValueError as e:
+            logger.debug("JSON object in LLM reply is not valid: %s", e)
     
-    try:
-        type_match = re.search(r'"type"\s*:\s*"pair_not_together"', text)
-        if type_match:
-            a_id_match = re.search(r'"a_employee_id"\s*:\s*(\d+)', text)
-            b_id_match = re.search(r'"b_employee_id"\s*:\s*(\d+)', text)
-            if a_id_match and b_id_match:
-                return {
-                    "type": "pair_not_together",
-                    "a_employee_id": int(a_id_match.group(1)),
-                    "b_employee_id": int(b_id_match.group(1))
-                }
-    except Exception:
-        pass
+    # 壊れた JSON でも pair_not_together の 2 人の ID だけは拾う
+    if re.search(r'"type"\s*:\s*"pair_not_together"', text):
+        a_id_match = re.search(r'"a_employee_id"\s*:\s*(\d+)', text)
+        b_id_match = re.search(r'"b_employee_id"\s*:\s*(\d+)', text)
+        if a_id_match and b_id_match:
+            return {
+                "type": "pair_not_together",
+                "a_employee_id": int(a_id_match.group(1)),
+                "b_employee_id": int(b_id_match.group(1))
+            }
     
     return None
 
-def detect_intent(content: str, context: Dict[str, Any]) -> Dict[str, Any]:
-    if MOCK_OPENAI or not _client:
+async def detect_intent(content: str, context: Dict[str, Any], budget: Optional[Budget] = None) -> Dict[str, Any]:
+    if _mock():
         return {"intent": "qa", "confidence": 0.5}
     sys = "You are an intent router for a shift optimization assistant. Return JSON with keys intent and confidence. intent is 'qa', 'apply', or 'adjust'."
     user = f"Message: {content}"
+    key = cache_key("intent", OPENAI_MODEL, sys, content)
+    hit = await _cached(key, "intent")
+    if hit is not None:
+        return hit
+    budget = budget or Budget()
+    if not budget.take():
+        return {"intent": "qa", "confidence": 0.5}
     try:
-        r = _client.chat.completions.create(
+        txt = await llm_gateway.chat(
+            [{"role":"system","content":sys},{"role":"user","content":user}],
             model=OPENAI_MODEL,
-            messages=[{"role":"system","content":sys},{"role":"user","content":user}],
             temperature=0,
             max_tokens=60,
-            timeout=OPENAI_TIMEOUT_QA_MS/1000.0
+            timeout=budget.timeout(OPENAI_TIMEOUT_QA_MS/1000.0),
+            op="intent"
         )
-        txt = r.choices[0].message.content or ""
         js = _extract_json(txt)
         if isinstance(js, dict) and js.get("intent") in ("qa","apply","adjust"):
             c = float(js.get("confidence", 0.5))
-            return {"intent": js["intent"], "confidence": max(0.0, min(1.0, c))}
-    except Exception:
-        pass
+            return _remember(key, "intent", {"intent": js["intent"], "confidence": max(0.0, min(1.0, c))})
+        _invalid(budget, "意図判定", "intent", "応答の形式が不正")
+    except Exception as e:
+        budget.fail("意図判定", describe_error(e))
     return {"intent": "qa", "confidence": 0.5}
 
-def generate_apply(content: str, context: Dict[str, Any]) -> Dict[str, Any]:
-    if MOCK_OPENAI or not _client:
-        return {
-            "assistant_text": "変更案を提案します。週末の最小人員を+1します。",
-            "json": {"type": "patch", "patch": [{"op": "replace", "path": "/min_staff_weekend", "value": 2}]}
-        }
-    sys = (
-        "You are an assistant that proposes constraint changes for a shift optimizer. "
-        "Output concise assistant_text and a strict JSON object named spec with either: "
-        "{'type':'patch','patch':[{'op':'replace','path':'/min_staff_weekend','value':2}]} "
-        "or {'type':'full','full':{...full constraints json...}}. Return only a short explanation first then JSON."
-    )
+async def generate_apply(content: str, context: Dict[str, Any], budget: Optional[Budget] = None) -> Dict[str, Any]:
+    if _mock():
+        return copy.deepcopy(_MOCK_APPLY)
+    sys = _APPLY_SYSTEM
     ctx_constraints = context.get("constraints", {})
-    user = f"Current constraints JSON:\n{json.dumps(ctx_constraints, ensure_ascii=False)}\nUser request:\n{content}"
+    user = _apply_user(content, ctx_constraints)
+    key = cache_key("apply", OPENAI_MODEL, sys, content, constraints=ctx_constraints)
+    hit = await _cached(key, "apply")
+    if hit is not None:
+        return hit
+    budget = budget or Budget()
     last_text = ""
-    for _ in range(MAX_REPROMPTS + 1):
+    for attempt in range(MAX_REPROMPTS + 1):
+        if not budget.take():
+            break
+        if attempt:
+            llm_metrics.count("reprompt", "apply")
         try:
-            r = _client.chat.completions.create(
+            txt = await llm_gateway.chat(
+                [{"role":"system","content":sys},{"role":"user","content":user}],
                 model=OPENAI_MODEL,
-                messages=[{"role":"system","content":sys},{"role":"user","content":user}],
                 temperature=0.2,
                 max_tokens=500,
-                timeout=OPENAI_TIMEOUT_APPLY_MS/1000.0
+                timeout=budget.timeout(OPENAI_TIMEOUT_APPLY_MS/1000.0),
+                op="apply"
             )
-            txt = r.choices[0].message.content or ""
-            last_text = txt
-            js = _extract_json(txt)
-            if isinstance(js, dict):
-                if js.get("type") in ("patch","full"):
-                    return {"assistant_text": txt.strip(), "json": js}
-                if "spec" in js and isinstance(js["spec"], dict):
-                    spec = js["spec"]
-                    if spec.get("type") in ("patch","full"):
-                        return {"assistant_text": txt.strip(), "json": spec}
-        except Exception:
+        except Exception as e:
+            budget.fail("変更案の生成", describe_error(e))
+            await budget.backoff()
             continue
-    return {"assistant_text": last_text.strip() or "変更案の生成に失敗しました。", "json": {"type": "full", "full": ctx_constraints}}
+        last_text = txt
+        js = _extract_json(txt)
+        if isinstance(js, dict):
+            spec = _spec_of(js)
+            if spec is not None:
+                out = {"assistant_text": txt.strip(), "json": spec}
+                # 検証を通らない案は呼び出し側が再生成するので、キャッシュしない
+                if _valid_spec(spec, ctx_constraints):
+                    _remember(key, "apply", out)
+                return out
+        _invalid(budget, "変更案の生成", "apply", "応答に変更案の JSON がありませんでした")
+    text = last_text.strip() if last_text.strip() and not budget.exhausted else _gave_up(budget, "変更案の生成", "apply")
+    return {"assistant_text": text, "json": {"type": "full", "full": ctx_constraints}, "failed": True}
 
-def generate_adjustment_rule(content: str, context: Dict[str, Any]) -> Dict[str, Any]:
+async def generate_adjustment_rule(content: str, context: Dict[str, Any], budget: Optional[Budget] = None) -> Dict[str, Any]:
     """シフト調整ルールを生成する"""
-    if MOCK_OPENAI or not _client:
+    if _mock():
         return {
             "assistant_text": "シフト調整案を生成しました。",
             "rule": {
@@ -130,12 +208,8 @@ def generate_adjustment_rule(content: str, context: Dict[str, Any]) -> Dict[str,
         "Return only a short explanation first then the JSON object."
     )
     
-    # 従業員マスタを取得
-    employees = context.get("employees", [])
-    employee_info = []
-    for e in employees:
-        if e.get("name") and e.get("id"):
-            employee_info.append(f"{e['name']} (ID: {e['id']})")
+    # 従業員マスタのうち、本文の名前に当たる人と紛らわしい人だけを載せる
+    employee_info = employee_context.prompt_employees(content, context.get("employees", []))
     
     from datetime import date
     today = date.today()
@@ -143,42 +217,156 @@ def generate_adjustment_rule(content: str, context: Dict[str, Any]) -> Dict[str,
     current_year = today.year
     
     user = f"Available employees: {', '.join(employee_info)}\nCurrent date: {today.isoformat()} (month: {current_month}, year: {current_year})\nUser request: {content}"
+    key = cache_key("adjust", OPENAI_MODEL, sys, content, employees=employee_info, today=today.isoformat())
+    hit = await _cached(key, "adjust")
+    if hit is not None:
+        return hit
+    budget = budget or Budget()
     last_text = ""
     
-    for _ in range(MAX_REPROMPTS + 1):
+    for attempt in range(MAX_REPROMPTS + 1):
+        if not budget.take():
+            break
+        if attempt:
+            llm_metrics.count("reprompt", "adjust")
         try:
-            r = _client.chat.completions.create(
+            txt = await llm_gateway.chat(
+                [{"role":"system","content":sys},{"role":"user","content":user}],
                 model=OPENAI_MODEL,
-                messages=[{"role":"system","content":sys},{"role":"user","content":user}],
                 temperature=0.2,
                 max_tokens=500,
-                timeout=OPENAI_TIMEOUT_APPLY_MS/1000.0
+                timeout=budget.timeout(OPENAI_TIMEOUT_APPLY_MS/1000.0),
+                op="adjust"
             )
-            txt = r.choices[0].message.content or ""
-            last_text = txt
-            js = _extract_json(txt)
-            print(f"DEBUG: Raw OpenAI response: {txt}")
-            print(f"DEBUG: Generated rule JSON: {js}")
-            if isinstance(js, dict) and js.get("type") in ("pair_not_together", "increase_staff_day", "redistribute_shifts", "time_slot_adjustment", "add_employee_shift"):
-                return {"assistant_text": txt.strip(), "rule": js}
-        except Exception:
+        except Exception as e:
+            budget.fail("調整ルールの生成", describe_error(e))
+            await budget.backoff()
             continue
+        last_text = txt
+        js = _extract_json(txt)
+        logger.debug("adjustment rule reply: %r -> %r", txt, js)
+        if isinstance(js, dict) and js.get("type") in ("pair_not_together", "increase_staff_day", "redistribute_shifts", "time_slot_adjustment", "add_employee_shift"):
+            return _remember(key, "adjust", {"assistant_text": txt.strip(), "rule": js})
+        _invalid(budget, "調整ルールの生成", "adjust", "応答に調整ルールの JSON がありませんでした")
     
-    return {"assistant_text": last_text.strip() or "調整ルールの生成に失敗しました。", "rule": None}
+    text = last_text.strip() if last_text.strip() and not budget.exhausted else _gave_up(budget, "調整ルールの生成", "adjust")
+    return {"assistant_text": text, "rule": None}
 
-def generate_qa(content: str, context: Dict[str, Any]) -> str:
-    if MOCK_OPENAI or not _client:
-        return "現在の条件では週末の最小人員は1です。必要なら適用案を生成できます。"
-    sys = "You are a helpful assistant for a call center shift optimization tool. Answer briefly and clearly in Japanese."
+async def generate_qa(content: str, context: Dict[str, Any], budget: Optional[Budget] = None) -> str:
+    if _mock():
+        return _MOCK_QA
+    sys = _QA_SYSTEM
     user = content
+    key = cache_key("qa", OPENAI_MODEL, sys, content)
+    hit = await _cached(key, "qa")
+    if hit is not None:
+        return hit
+    budget = budget or Budget()
+    if not budget.take():
+        return _gave_up(budget, "回答の生成", "qa")
     try:
-        r = _client.chat.completions.create(
+        txt = await llm_gateway.chat(
+            [{"role":"system","content":sys},{"role":"user","content":user}],
             model=OPENAI_MODEL,
-            messages=[{"role":"system","content":sys},{"role":"user","content":user}],
             temperature=0.3,
             max_tokens=300,
-            timeout=OPENAI_TIMEOUT_QA_MS/1000.0
+            timeout=budget.timeout(OPENAI_TIMEOUT_QA_MS/1000.0),
+            op="qa"
         )
-        return (r.choices[0].message.content or "").strip()
-    except Exception:
-        return "回答の生成に失敗しました。"
+        return _remember(key, "qa", txt.strip())
+    except Exception as e:
+        return f"回答の生成に失敗しました（{describe_error(e)}）。"
+
+async def stream_qa(content: str, context: Dict[str, Any], budget: Optional[Budget] = None) -> AsyncIterator[Dict[str, Any]]:
+    """generate_qa のストリーム版。{"type": "delta", "text"} を届いた順に返し、失敗すれば {"type": "error", "message"}"""
+    if _mock():
+        yield {"type": "delta", "text": _MOCK_QA}
+        return
+    key = cache_key("qa", OPENAI_MODEL, _QA_SYSTEM, content)
+    hit = await _cached(key, "qa_stream")
+    if hit is not None:
+        yield {"type": "delta", "text": hit}
+        return
+    budget = budget or Budget()
+    if not budget.take():
+        yield {"type": "error", "message": _gave_up(budget, "回答の生成", "qa_stream")}
+        return
+    parts: List[str] = []
+    try:
+        async for piece in llm_gateway.stream(
+            [{"role":"system","content":_QA_SYSTEM},{"role":"user","content":content}],
+            model=OPENAI_MODEL,
+            temperature=0.3,
+            max_tokens=300,
+            timeout=budget.timeout(OPENAI_TIMEOUT_QA_MS/1000.0),
+            op="qa_stream"
+        ):
+            parts.append(piece)
+            yield {"type": "delta", "text": piece}
+    except Exception as e:
+        budget.fail("回答の生成", describe_error(e))
+        yield {"type": "error", "message": _gave_up(budget, "回答の生成", "qa_stream")}
+        return
+    _remember(key, "qa", "".join(parts).strip())
+
+async def stream_apply(content: str, context: Dict[str, Any], budget: Optional[Budget] = None) -> AsyncIterator[Dict[str, Any]]:
+    """generate_apply のストリーム版（1 回分の生成）
+
+    {"type": "delta", "text"} を届いた順に、変更案の JSON が閉じた時点で {"type": "spec", "json"} を返し、
+    最後に {"type": "end", "assistant_text", "json"}（案が無ければ json は None）。失敗すれば {"type": "error", "message"}。
+    """
+    if _mock():
+        out = copy.deepcopy(_MOCK_APPLY)
+        yield {"type": "delta", "text": out["assistant_text"]}
+        yield {"type": "spec", "json": out["json"]}
+        yield {"type": "end", **out}
+        return
+    ctx_constraints = context.get("constraints", {})
+    key = cache_key("apply", OPENAI_MODEL, _APPLY_SYSTEM, content, constraints=ctx_constraints)
+    hit = await _cached(key, "apply_stream")
+    if hit is not None:
+        yield {"type": "delta", "text": hit["assistant_text"]}
+        yield {"type": "spec", "json": hit["json"]}
+        yield {"type": "end", **hit}
+        return
+    budget = budget or Budget()
+    if not budget.take():
+        yield {"type": "error", "message": _gave_up(budget, "変更案の生成", "apply_stream")}
+        return
+    scanner = JsonObjectScanner()
+    parts: List[str] = []
+    spec = None
+    try:
+        async for piece in llm_gateway.stream(
+            [{"role":"system","content":_APPLY_SYSTEM},{"role":"user","content":_apply_user(content, ctx_constraints)}],
+            model=OPENAI_MODEL,
+            temperature=0.2,
+            max_tokens=500,
+            timeout=budget.timeout(OPENAI_TIMEOUT_APPLY_MS/1000.0),
+            op="apply_stream"
+        ):
+            parts.append(piece)
+            yield {"type": "delta", "text": piece}
+            if spec is None:
+                for js in scanner.feed(piece):
+                    spec = _spec_of(js)
+                    if spec is not None:
+                        yield {"type": "spec", "json": spec}
+                        break
+    except Exception as e:
+        budget.fail("変更案の生成", describe_error(e))
+        yield {"type": "error", "message": _gave_up(budget, "変更案の生成", "apply_stream")}
+        return
+    text = "".join(parts).strip()
+    if spec is None:
+        # 断片の境目で読めなかった場合に備えて全文からも探す
+        js = _extract_json(text)
+        spec = _spec_of(js) if isinstance(js, dict) else None
+        if spec is None:
+            _invalid(budget, "変更案の生成", "apply_stream", "応答に変更案の JSON がありませんでした")
+        else:
+            yield {"type": "spec", "json": spec}
+    out = {"assistant_text": text, "json": spec}
+    if spec is not None and _valid_spec(spec, ctx_constraints):
+        _remember(key, "apply", out)
+    yield {"type": "end", **out}
@@ -0,0 +1,188 @@
+"""pair_not_together の調整案を CP-SAT で求める
+
+週内で 2 人が同じ日に入っている日ごとに「どちらの側のシフトを誰に替えるか」を 1 つの問題として解く。
+交代先は CandidateEngine の占有インデックスで可否を判定し（同日の重複・前日遅番→夜勤・遅番→翌日夜勤を除く）、
+新しく割り当てたシフト同士でも同じ規則を守らせる。
+
+目的関数（小さいほど良い）
+- 変更 1 件ごとに DISRUPTION（a 側を動かす場合は +1。従来どおり b を動かす案を優先）
+- 交代先のその週のシフト数（負荷の低い人を優先）
+- 同じ人に 2 件以上寄せた場合は 1 件ごとに CONCENTRATION
+- 解消できない日は UNRESOLVED
+
+上位 k 案は、見つかった案の各割り当てを 1 つずつ禁止した問題を並列に解いて集める。
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import date, time
+from typing import Any, Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from ortools.sat.python import cp_model
+
+from ..schemas import ChangeDelta
+from .candidates import CandidateEngine
+
+logger = logging.getLogger("backend")
+
+DISRUPTION = 10
+CONCENTRATION = 5
+UNRESOLVED = 1000
+# 代替案を探す時に禁止を重ねる段数の上限
+MAX_ROUNDS = 3
+
+_NIGHT_START = time(0, 0)
+_LATE_START = time(16, 0)
+
+
+@dataclass
+class PairPlan:
+    cost: int
+    deltas: List[ChangeDelta]
+    unresolved: List[date]
+
+
+def _clash(s1: Any, s2: Any) -> bool:
+    """同じ人が両方に入れない組み合わせ（同日、または遅番 → 翌日夜勤）"""
+    gap = (s2.date - s1.date).days
+    if gap == 0:
+        return True
+    if gap == 1:
+        return s1.start_time == _LATE_START and s2.start_time == _NIGHT_START
+    if gap == -1:
+        return s2.start_time == _LATE_START and s1.start_time == _NIGHT_START
+    return False
+
+
+class _Problem:
+    def __init__(self, conflicts: Sequence[Tuple[Any, Any]], engine: CandidateEngine, a_id: int, b_id: int):
+        # 日ごとに a 側・b 側のシフトをまとめる
+        days: Dict[date, Tuple[Dict[Any, Any], Dict[Any, Any]]] = {}
+        for s_a, s_b in conflicts:
+            side_a, side_b = days.setdefault(s_a.date, ({}, {}))
+            side_a[(s_a.employee_id, s_a.start_time, s_a.end_time)] = s_a
+            side_b[(s_b.employee_id, s_b.start_time, s_b.end_time)] = s_b
+        self.days = sorted(days)
+        self.sides: List[Tuple[int, int, List[int]]] = []  # (日の番号, 0=a/1=b, 対象シフトの番号)
+        self.targets: List[Any] = []
+        for d_i, d in enumerate(self.days):
+            for side, shifts in ((1, days[d][1]), (0, days[d][0])):
+                idx = []
+                for s in shifts.values():
+                    idx.append(len(self.targets))
+                    self.targets.append(s)
+                self.sides.append((d_i, side, idx))
+
+        ranked = engine.suggest_many(self.targets, max_candidates=len(engine.emp_ids), exclude_ids=[[a_id, b_id]] * len(self.targets))
+        # 対象シフト -> [(従業員, 週の負荷)]
+        self.options: List[List[Tuple[int, int]]] = [
+            [(c["employee_id"], int(engine.week(t.date).week_load[engine.col[c["employee_id"]]])) for c in cands]
+            for t, cands in zip(self.targets, ranked)
+        ]
+
+    def solve(self, forbid: FrozenSet[Tuple[int, int]] = frozenset(), time_limit: float = 2.0) -> Optional[Tuple[int, Dict[int, int]]]:
+        model = cp_model.CpModel()
+        x: Dict[Tuple[int, int], Any] = {}
+        by_target: List[List[Any]] = [[] for _ in self.targets]
+        for t, opts in enumerate(self.options):
+            for e, _ in opts:
+                if (t, e) not in forbid:
+                    x[t, e] = model.NewBoolVar(f"x{t}_{e}")
+                    by_target[t].append(x[t, e])
+
+        cost = []
+        chosen_by_day: Dict[int, List[Any]] = {}
+        for d_i, side, idx in self.sides:
+            z = model.NewBoolVar(f"z{d_i}_{side}")
+            chosen_by_day.setdefault(d_i, []).append(z)
+            for t in idx:
+                model.Add(sum(by_target[t]) == z)
+                cost.append((DISRUPTION + (1 - side)) * z)
+        for d_i, zs in chosen_by_day.items():
+            u = model.NewBoolVar(f"u{d_i}")
+            model.Add(sum(zs) + u == 1)
+            cost.append(UNRESOLVED * u)
+
+        load = {}
+        for t, opts in enumerate(self.options):
+            for e, w in opts:
+                if (t, e) in x:
+                    cost.append(w * x[t, e])
+                    load.setdefault(e, []).append(x[t, e])
+        for e, vs in load.items():
+            if len(vs) > 1:
+                extra = model.NewIntVar(0, len(vs), f"extra{e}")
+                model.Add(extra >= sum(vs) - 1)
+                cost.append(CONCENTRATION * extra)
+        for t1 in range(len(self.targets)):
+            for t2 in range(t1 + 1, len(self.targets)):
+                if not _clash(self.targets[t1], self.targets[t2]):
+                    continue
+                for e, _ in self.options[t1]:
+                    if (t1, e) in x and (t2, e) in x:
+                        model.Add(x[t1, e] + x[t2, e] <= 1)
+
+        model.Minimize(sum(cost))
+        solver = cp_model.CpSolver()
+        solver.parameters.max_time_in_seconds = time_limit
+        solver.parameters.num_workers = 1
+        status = solver.Solve(model)
+        if status not in (cp_model.OPTIMAL, cp_model.FEASIBLE):
+            return None
+        chosen = {t: e for (t, e), v in x.items() if solver.Value(v)}
+        return int(solver.ObjectiveValue()), chosen
+
+    def plan(self, cost: int, chosen: Dict[int, int]) -> PairPlan:
+        deltas = [
+            ChangeDelta(kind="replace", before=self.targets[t], after=self.targets[t].model_copy(update={"employee_id": e}))
+            for t, e in sorted(chosen.items())
+        ]
+        moved_days = {self.targets[t].date for t in chosen}
+        return PairPlan(cost=cost, deltas=deltas, unresolved=[d for d in self.days if d not in moved_days])
+
+
+def optimize_pair_not_together(
+    conflicts: Sequence[Tuple[Any, Any]],
+    engine: CandidateEngine,
+    a_id: int,
+    b_id: int,
+    k: int = 3,
+    time_limit: float = 2.0,
+) -> List[PairPlan]:
+    """調整案を良い順に最大 k 件返す（conflicts は store.conflicting_shifts の結果）"""
+    if not conflicts:
+        return [PairPlan(cost=0, deltas=[], unresolved=[])]
+    problem = _Problem(conflicts, engine, a_id, b_id)
+    best = problem.solve(time_limit=time_limit)
+    if best is None:
+        return []
+    found: Dict[FrozenSet[Tuple[int, int]], Tuple[int, Dict[int, int]]] = {frozenset(best[1].items()): best}
+
+    # 見つかった案の割り当てを 1 つずつ禁止に加えた問題を並列に解き、k 案集まるまで広げる
+    tried: set = {frozenset()}
+    frontier = [(frozenset(), best[1])]
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        for _ in range(MAX_ROUNDS):
+            if len(found) >= k or not frontier:
+                break
+            bans = []
+            for ban, chosen in frontier:
+                for pair in sorted(chosen.items()):
+                    b = ban | {pair}
+                    if b not in tried:
+                        tried.add(b)
+                        bans.append(b)
+            frontier = []
+            for ban, result in zip(bans, pool.map(lambda b: problem.solve(b, time_limit), bans)):
+                if result is None:
+                    continue
+                key = frozenset(result[1].items())
+                if key not in found:
+                    found[key] = result
+                    frontier.append((ban, result[1]))
+
+    ranked = sorted(found.values(), key=lambda r: (r[0], sorted(r[1].items())))[:k]
+    plans = [problem.plan(cost, chosen) for cost, chosen in ranked]
+    if plans[0].unresolved:
+        logger.info("pair_not_together: unresolved days %s", [d.isoformat() for d in plans[0].unresolved])
+    return plans
@@ -0,0 +1,70 @@
+"""調整プレビューの LRU キャッシュ
+
+キーは (ルール, 週初め, スケジュールのバージョン, 従業員マスタのバージョン) の正規化 JSON のハッシュ。
+スケジュールか従業員が変わればキーが変わるので、明示的な無効化は要らない。
+ヒットした値は呼び出し側ごとに複製して返す（ChangeSet やプレビューを書き換えてもキャッシュに響かない）。
+"""
+import copy
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Dict, Generic, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+def preview_key(rule: Dict[str, Any], week_start: date, schedule_version: int, employees_version: int) -> str:
+    body = json.dumps(
+        {"rule": rule, "week_start": week_start.isoformat(), "schedule": schedule_version, "employees": employees_version},
+        sort_keys=True,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=str,
+    )
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class PreviewCache(Generic[T]):
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._items: "OrderedDict[str, T]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key: str) -> Optional[T]:
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(value)
+
+    def put(self, key: str, value: T) -> None:
+        if self.maxsize <= 0:
+            return
+        value = copy.deepcopy(value)
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._items.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._items),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
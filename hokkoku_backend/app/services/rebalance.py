@@ -0,0 +1,171 @@
+"""redistribute_shifts: 週内の負荷を均す最小の付け替えを最小費用流で求める
+
+週のシフト数を N、従業員数を E とすると、全員を q = N // E か q + 1 件に収めるのが目標。
+q + 1 を超える人（出し手）の超過分と q に満たない人（受け手）の不足分を負の費用の辺で「必須」にし、
+付け替え 1 件ごとに MOVE の費用を払う循環流として解く。必須分を最大限満たしつつ、付け替えは最少になる。
+
+  S -> 出し手 -> 出し手のシフト -> (受け手, 日) -> 受け手 -> T -> S
+
+(受け手, 日) の容量 1 で同じ日に 2 件入れないようにし、シフト -> 受け手の辺は
+CandidateEngine の占有インデックスで休息規則（同日・遅番→翌日夜勤）を満たすものだけ張る。
+新しく入れたシフト同士の遅番→翌日夜勤は流れでは表せないので、受け手ごとに遅番・夜勤を入れてよい日を
+1 日おきに限った問題を解く（構造上その連続が起きない）。受け手が少ない時だけ、まず制限なしで解いてみる。
+付け替え先の辺はシフトごとに MAX_RECEIVERS 人に絞り、数百人規模でも辺の数を抑える。
+"""
+import logging
+from dataclasses import dataclass, field
+from datetime import date, time, timedelta
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from ortools.graph.python import min_cost_flow
+
+from .candidates import CandidateEngine, week_start_of
+
+logger = logging.getLogger("backend")
+
+MOVE = 100
+REQUIRED = 10_000
+# シフト 1 件あたりに張る付け替え先の数
+MAX_RECEIVERS = 24
+
+_NIGHT_START = time(0, 0)
+_LATE_START = time(16, 0)
+
+
+@dataclass
+class Rebalance:
+    moves: List[Tuple[Any, int]] = field(default_factory=list)   # (元のシフト, 付け替え先の従業員)
+    before: Dict[int, int] = field(default_factory=dict)         # 従業員 -> 週のシフト数
+    after: Dict[int, int] = field(default_factory=dict)
+    target: Tuple[int, int] = (0, 0)
+
+
+def rebalance_week(engine: CandidateEngine, day_in_week: date) -> Rebalance:
+    ws = week_start_of(day_in_week)
+    occ = engine.week(ws)
+    loads = occ.week_load.astype(np.int64)
+    n_emp = len(engine.emp_ids)
+    if not n_emp:
+        return Rebalance()
+    total = int(loads.sum())
+    q = total // n_emp
+    result = Rebalance(
+        before={int(e): int(c) for e, c in zip(engine.emp_ids.tolist(), loads.tolist())},
+        target=(q, q + 1 if total % n_emp else q),
+    )
+    result.after = dict(result.before)
+
+    donors = np.flatnonzero(loads > q)
+    receivers = np.flatnonzero(loads <= q)
+    if not len(donors) or not len(receivers):
+        return result
+
+    table = engine.table
+    idx = table.query(ws, ws + timedelta(days=6))
+    rows = table.rows[idx]
+    donor_ids = engine.emp_ids[donors]
+    own = np.isin(rows["employee_id"], donor_ids)
+    shift_idx = idx[own]
+    shifts = table.to_shifts(shift_idx)
+    if not shifts:
+        return result
+    ok = _prune(occ.eligible(shifts)[:, receivers])      # シフト × 受け手
+    # 受け手が多ければ余裕があるので、最初から遅番・夜勤を 1 日おきに限って 1 回で解く
+    moves = [] if len(receivers) > MAX_RECEIVERS else _solve(engine, loads, q, donors, receivers, shifts, ok)
+    if not moves or _has_rest_clash(moves):
+        day = np.array([(s.date - ws).days for s in shifts])
+        parity = (day[:, None] + np.arange(len(receivers))[None, :]) % 2 == 0
+        # (day + k) が偶数の日だけ遅番・夜勤を許す。d 日の遅番と d+1 日の夜勤は必ずどちらかが外れる
+        late_or_night = np.array([s.start_time in (_LATE_START, _NIGHT_START) for s in shifts], dtype=bool)
+        moves = _solve(engine, loads, q, donors, receivers, shifts, ok & ~(late_or_night[:, None] & ~parity))
+
+    for j, k, _, _ in moves:
+        emp = int(engine.emp_ids[receivers[k]])
+        result.moves.append((shifts[j], emp))
+        result.after[shifts[j].employee_id] -= 1
+        result.after[emp] += 1
+    return result
+
+
+def _solve(engine, loads, q, donors, receivers, shifts, ok) -> List[Tuple[int, int, date, time]]:
+    n_shift, n_recv = ok.shape
+    # ノード: S, T, 出し手, シフト, 受け手, (受け手, 日)
+    S, T = 0, 1
+    donor_base = 2
+    shift_base = donor_base + len(donors)
+    recv_base = shift_base + n_shift
+    day_base = recv_base + n_recv
+
+    tails: List[np.ndarray] = [np.array([T])]
+    heads: List[np.ndarray] = [np.array([S])]
+    caps: List[np.ndarray] = [np.array([n_shift])]
+    costs: List[np.ndarray] = [np.array([0])]
+
+    def arcs(t, h, cap, cost):
+        t, h, cap, cost = np.broadcast_arrays(np.asarray(t), np.asarray(h), np.asarray(cap), np.asarray(cost))
+        keep = cap > 0
+        tails.append(t[keep])
+        heads.append(h[keep])
+        caps.append(cap[keep])
+        costs.append(cost[keep])
+
+    donor_nodes = donor_base + np.arange(len(donors))
+    extra = np.maximum(loads[donors] - (q + 1), 0)
+    arcs(S, donor_nodes, extra, -REQUIRED)
+    arcs(S, donor_nodes, loads[donors] - q - extra, 0)
+
+    donor_pos = {int(o): k for k, o in enumerate(donors.tolist())}
+    col = {int(e): i for i, e in enumerate(engine.emp_ids.tolist())}
+    owner = np.array([donor_pos[col[s.employee_id]] for s in shifts])
+    arcs(donor_base + owner, shift_base + np.arange(n_shift), 1, 0)
+
+    recv_nodes = recv_base + np.arange(n_recv)
+    need = np.maximum(q - loads[receivers], 0)
+    arcs(recv_nodes, T, need, -REQUIRED)
+    arcs(recv_nodes, T, (loads[receivers] <= q).astype(np.int64), 0)
+
+    # (受け手, 日) は容量 1。同じ日に 2 件入れない
+    arcs(day_base + np.arange(n_recv * 7), np.repeat(recv_nodes, 7), 1, 0)
+    js, ks = np.nonzero(ok)
+    if not len(js):
+        return []
+    weekday = np.array([s.date.weekday() for s in shifts])
+    n_fixed = sum(len(t) for t in tails)
+    arcs(shift_base + js, day_base + ks * 7 + weekday[js], 1, MOVE)
+
+    flow = min_cost_flow.SimpleMinCostFlow()
+    flow.add_arcs_with_capacity_and_unit_cost(
+        np.concatenate(tails).astype(np.int32), np.concatenate(heads).astype(np.int32),
+        np.concatenate(caps).astype(np.int64), np.concatenate(costs).astype(np.int64),
+    )
+    if flow.solve() != flow.OPTIMAL:
+        logger.warning("rebalance: min cost flow did not solve")
+        return []
+    used = np.flatnonzero(flow.flows(np.arange(n_fixed, n_fixed + len(js))))
+    return [
+        (int(js[i]), int(ks[i]), shifts[int(js[i])].date, shifts[int(js[i])].start_time)
+        for i in used.tolist()
+    ]
+
+
+def _prune(ok: np.ndarray) -> np.ndarray:
+    """各シフトの付け替え先を MAX_RECEIVERS 人に絞る。シフトごとに受け手をずらして選び、特定の人に偏らせない"""
+    n_shift, n_recv = ok.shape
+    if n_recv <= MAX_RECEIVERS:
+        return ok.copy()
+    spread = (np.arange(n_shift)[:, None] * 7919 + np.arange(n_recv)[None, :]) % n_recv
+    rank = np.where(ok, spread, n_recv)
+    keep = np.argpartition(rank, MAX_RECEIVERS - 1, axis=1)[:, :MAX_RECEIVERS]
+    out = np.zeros_like(ok)
+    np.put_along_axis(out, keep, True, axis=1)
+    return out & ok
+
+
+def _has_rest_clash(moves: List[Tuple[int, int, date, time]]) -> bool:
+    """同じ受け手に 遅番 → 翌日夜勤 を新しく入れていないか"""
+    late = {(k, d) for _, k, d, st in moves if st == _LATE_START}
+    return any(
+        st == _NIGHT_START and (k, date.fromordinal(d.toordinal() - 1)) in late
+        for _, k, d, st in moves
+    )
@@ -0,0 +1,89 @@
+from typing import Any, Callable, Optional, Tuple
+from collections import OrderedDict
+from uuid import uuid4
+
+import orjson
+from fastapi import Response
+
+# プロセス再起動でバージョンが 0 に戻っても ETag が衝突しないよう起動ごとのトークンを含める
+_BOOT = uuid4().hex[:8]
+
+# name -> (version, 直列化済み JSON)。絞り込みクエリごとに name が増えるため LRU で上限を設ける
+_MAX_BODIES = 64
+_bodies: "OrderedDict[str, Tuple[int, bytes]]" = OrderedDict()
+
+
+def _default(o: Any) -> Any:
+    if hasattr(o, "isoformat"):
+        return o.isoformat()
+    if hasattr(o, "model_dump"):
+        return o.model_dump()
+    raise TypeError(f"Object of type {type(o).__name__} is not JSON serializable")
+
+
+def dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, default=_default)
+
+
+def etag_for(name: str, version: int) -> str:
+    return f'"{_BOOT}-{name}-{version}"'
+
+
+def not_modified(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*" or tag.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+def cached_body(name: str, version: int, build: Callable[[], Any], encode: Callable[[Any], bytes] = dumps) -> bytes:
+    """version が変わっていなければ前回の直列化結果を返す"""
+    hit = _bodies.get(name)
+    if hit is not None and hit[0] == version:
+        _bodies.move_to_end(name)
+        return hit[1]
+    body = encode(build())
+    _bodies[name] = (version, body)
+    _bodies.move_to_end(name)
+    while len(_bodies) > _MAX_BODIES:
+        _bodies.popitem(last=False)
+    return body
+
+
+def use_token(token: str) -> None:
+    """ETag のトークンを差し替える。共有モードでは全ワーカーで同じ ETag になるよう共有側のものを使う"""
+    global _BOOT
+    _BOOT = token
+    _bodies.clear()
+
+
+def invalidate(name: Optional[str] = None) -> None:
+    if name is None:
+        _bodies.clear()
+    else:
+        _bodies.pop(name, None)
+
+
+def versioned_json(
+    name: str,
+    version: int,
+    if_none_match: Optional[str],
+    build: Callable[[], Any],
+    media_type: str = "application/json",
+    encode: Callable[[Any], bytes] = dumps,
+    vary: Optional[str] = None,
+) -> Response:
+    """ETag 付き JSON レスポンス。If-None-Match が一致すれば 304 を返す
+
+    media_type / encode で別の表現を返す時は name を表現ごとに分けること（ETag も分かれる）。
+    """
+    etag = etag_for(name, version)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if vary:
+        headers["Vary"] = vary
+    if not_modified(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=cached_body(name, version, build, encode), media_type=media_type, headers=headers)
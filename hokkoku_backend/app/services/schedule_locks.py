@@ -0,0 +1,59 @@
+import threading
+import time as _time
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List
+
+import numpy as np
+
+
+def week_of(day: int | np.ndarray) -> int | np.ndarray:
+    """date.toordinal() の値をその週の月曜日の ordinal に丸める（ordinal 1 は月曜日）"""
+    return day - (day - 1) % 7
+
+
+class WeekLockTable:
+    """週（月曜日の ordinal）ごとのロック表
+
+    複数週を取る時は昇順に取るのでデッドロックしない。同一スレッドからは再入できる。
+    """
+
+    def __init__(self):
+        self._locks: Dict[int, threading.RLock] = {}
+        self._guard = threading.Lock()
+        self.acquired = 0
+        self.contended = 0
+        self.wait_seconds = 0.0
+
+    def _lock(self, week: int) -> threading.RLock:
+        with self._guard:
+            lock = self._locks.get(week)
+            if lock is None:
+                lock = self._locks[week] = threading.RLock()
+            return lock
+
+    @contextmanager
+    def hold(self, weeks: Iterable[int]) -> Iterator[List[int]]:
+        keys = sorted(set(int(w) for w in weeks))
+        held: List[threading.RLock] = []
+        try:
+            for week in keys:
+                lock = self._lock(week)
+                if not lock.acquire(blocking=False):
+                    t0 = _time.perf_counter()
+                    lock.acquire()
+                    self.contended += 1
+                    self.wait_seconds += _time.perf_counter() - t0
+                held.append(lock)
+            self.acquired += len(held)
+            yield keys
+        finally:
+            for lock in reversed(held):
+                lock.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "weeks": len(self._locks),
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "wait_seconds": round(self.wait_seconds, 6),
+        }
@@ -0,0 +1,497 @@
+from __future__ import annotations
+
+import threading
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Type
+
+import numpy as np
+
+from .ids import IdAllocator
+
+# 時間枠コード: early/late/night は固定で 0/1/2、それ以外の時間帯は初出時に採番する
+# 登録はプロセス内で消えないので MAX_SLOTS 種類で打ち止めにする（int16 の列に収まる範囲）
+SLOT_IDS: List[str] = ["early", "late", "night"]
+MAX_SLOTS = 4096
+_slot_times: List[Tuple[time, time]] = [
+    (time(8, 0), time(16, 0)),
+    (time(16, 0), time(0, 0)),
+    (time(0, 0), time(8, 0)),
+]
+_slot_codes: Dict[Tuple[time, time], int] = {t: i for i, t in enumerate(_slot_times)}
+_slot_lock = threading.Lock()
+
+# touched_days() の「全体を書き換えた」印
+ALL_DAYS = object()
+
+# None を表す番兵値（id / created_at / updated_at 列で使用）
+NULL = np.iinfo(np.int64).min
+_EPOCH = datetime(1970, 1, 1)
+
+SHIFT_DTYPE = np.dtype([
+    ("id", np.int64),
+    ("employee_id", np.int64),
+    ("day", np.int32),            # date.toordinal()
+    ("slot", np.int16),           # slot_code(start_time, end_time)
+    ("break_minutes", np.int16),
+    ("created_at", np.int64),     # epoch マイクロ秒
+    ("updated_at", np.int64),
+])
+
+
+class SlotLimitError(ValueError):
+    """登録できる時間帯の種類（MAX_SLOTS）を超えた"""
+
+
+def slot_code(start: time, end: time) -> int:
+    key = (start, end)
+    code = _slot_codes.get(key)
+    if code is not None:
+        return code
+    with _slot_lock:
+        code = _slot_codes.get(key)
+        if code is None:
+            if len(_slot_times) >= MAX_SLOTS:
+                raise SlotLimitError(f"時間帯の種類が上限（{MAX_SLOTS}）に達しています: {start}-{end}")
+            code = len(_slot_times)
+            _slot_times.append(key)
+            _slot_codes[key] = code
+    return code
+
+
+def slot_code_for(slot_id: str) -> Optional[int]:
+    """'early' | 'late' | 'night' をコードに変換する"""
+    try:
+        return SLOT_IDS.index(slot_id)
+    except ValueError:
+        return None
+
+
+def slot_times(code: int) -> Tuple[time, time]:
+    return _slot_times[code]
+
+
+def _encode_ts(v: Optional[datetime]) -> int:
+    if v is None:
+        return NULL
+    if v.tzinfo is not None:
+        v = v.astimezone(timezone.utc).replace(tzinfo=None)
+    return (v - _EPOCH) // timedelta(microseconds=1)
+
+
+def _decode_ts(v: int) -> Optional[datetime]:
+    if v == NULL:
+        return None
+    return _EPOCH + timedelta(microseconds=v)
+
+
+def _encode_day(v: Any) -> int:
+    if isinstance(v, str):
+        v = date.fromisoformat(v)
+    return v.toordinal()
+
+
+def _after_mask(rows: np.ndarray, after: Tuple[int, int, int, int]) -> np.ndarray:
+    """(day, slot, employee_id, id) の順で after より後ろの行"""
+    d, sl, emp, sid = after
+    return (
+        (rows["day"] > d)
+        | ((rows["day"] == d) & (rows["slot"] > sl))
+        | ((rows["day"] == d) & (rows["slot"] == sl) & (rows["employee_id"] > emp))
+        | ((rows["day"] == d) & (rows["slot"] == sl) & (rows["employee_id"] == emp) & (rows["id"] > sid))
+    )
+
+
+class ScheduleTable:
+    """Shift の列指向テーブル。
+
+    1 アサイン = SHIFT_DTYPE の 1 行で保持し、pydantic モデル（main.Shift / schemas.Shift）は
+    to_shifts() / [] などで API 境界に渡す時だけ生成する。
+    """
+
+    __slots__ = ("model", "ids", "_rows", "_size", "_has_ts", "_order", "_id_index", "_touched")
+
+    # これ以下の件数の削除は末尾行との入れ替えで O(1) に行う（超える場合は一括で詰める）
+    SWAP_DELETE_LIMIT = 32
+
+    def __init__(self, model: Type[Any], capacity: int = 0):
+        self.model = model
+        self._rows = np.empty(max(capacity, 16), dtype=SHIFT_DTYPE)
+        self._size = 0
+        self._has_ts = "created_at" in model.model_fields
+        # 日付順インデックス（(day, slot, employee_id, id) の昇順の行番号）。変更時に破棄し、次の検索で再構築する
+        self._order: Optional[np.ndarray] = None
+        # id -> 行番号。None の間は次の find_id() で再構築する
+        self._id_index: Optional[Dict[int, int]] = None
+        # 新規行の ID 採番。既存行・外部指定の ID も払い出し済みとして扱う
+        self.ids = IdAllocator()
+        # track_days() 以降に書き換えた行の日（day 列の値）。None なら記録しない、ALL_DAYS なら全体
+        self._touched: Optional[Any] = None
+
+    @classmethod
+    def from_rows(cls, model: Type[Any], rows: np.ndarray) -> "ScheduleTable":
+        table = cls(model, capacity=len(rows))
+        table._rows[: len(rows)] = rows
+        table._size = len(rows)
+        table._observe_ids(rows["id"])
+        return table
+
+    @classmethod
+    def from_shifts(cls, model: Type[Any], shifts: Iterable[Any]) -> "ScheduleTable":
+        if isinstance(shifts, ScheduleTable):
+            return shifts.copy(model)
+        items = list(shifts)
+        table = cls(model, capacity=len(items))
+        table.extend(items)
+        return table
+
+    @property
+    def rows(self) -> np.ndarray:
+        """有効行のビュー（読み取り用。書き換えは update() / replace() を使うこと）"""
+        return self._rows[: self._size]
+
+    @property
+    def nbytes(self) -> int:
+        return int(self._rows.nbytes)
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.to_shifts())
+
+    def __getitem__(self, index: int) -> Any:
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError(index)
+        return self._materialize(self._rows[index].tolist())
+
+    def copy(self, model: Type[Any] | None = None, share_ids: bool = False) -> "ScheduleTable":
+        """share_ids=True なら採番器を共有する（同じ版から作った作業コピー同士で ID が重ならない）"""
+        out = ScheduleTable(model or self.model, capacity=self._size)
+        out._rows[: self._size] = self.rows
+        out._size = self._size
+        out._order = self._order
+        if self._id_index is not None:
+            out._id_index = dict(self._id_index)
+        if share_ids:
+            out.ids = self.ids
+        else:
+            out.ids.observe(self.ids.peek() - 1)
+        return out
+
+    def with_model(self, model: Type[Any]) -> "ScheduleTable":
+        """同じ行を別のモデルで読むためのビュー。行配列を共有するので読み取り専用として扱うこと"""
+        if model is self.model:
+            return self
+        out = ScheduleTable.__new__(ScheduleTable)
+        out.model = model
+        out._has_ts = "created_at" in model.model_fields
+        out._rows = self._rows
+        out._size = self._size
+        out._order = self._order
+        out._id_index = self._id_index
+        out.ids = self.ids
+        out._touched = None
+        return out
+
+    def track_days(self) -> None:
+        """以降の書き換えで触った日を記録する（touched_days() で取り出す）"""
+        self._touched = set()
+
+    def touched_days(self) -> Optional[np.ndarray]:
+        """track_days() 以降に行が増減・変化した可能性のある日。記録していない・全体を書き換えた場合は None"""
+        if self._touched is None or self._touched is ALL_DAYS:
+            return None
+        return np.fromiter(self._touched, dtype=np.int32, count=len(self._touched))
+
+    def _touch(self, days: Iterable[int]) -> None:
+        if self._touched is not None and self._touched is not ALL_DAYS:
+            self._touched.update(days)
+
+    def _reserve(self, extra: int) -> None:
+        need = self._size + extra
+        if need <= len(self._rows):
+            return
+        grown = np.empty(max(need, len(self._rows) * 2), dtype=SHIFT_DTYPE)
+        grown[: self._size] = self.rows
+        self._rows = grown
+
+    @staticmethod
+    def _encode(shift: Any) -> tuple:
+        sid = getattr(shift, "id", None)
+        return (
+            NULL if sid is None else int(sid),
+            int(shift.employee_id),
+            _encode_day(shift.date),
+            slot_code(shift.start_time, shift.end_time),
+            int(getattr(shift, "break_minutes", 60)),
+            _encode_ts(getattr(shift, "created_at", None)),
+            _encode_ts(getattr(shift, "updated_at", None)),
+        )
+
+    def _record(self, rec: Sequence[Any], days: Dict[int, date]) -> Dict[str, Any]:
+        sid, emp, day, slot, brk, created, updated = rec
+        d = days.get(day)
+        if d is None:
+            d = days[day] = date.fromordinal(day)
+        start, end = _slot_times[slot]
+        data: Dict[str, Any] = {
+            "id": None if sid == NULL else sid,
+            "employee_id": emp,
+            "date": d,
+            "start_time": start,
+            "end_time": end,
+            "break_minutes": brk,
+        }
+        if self._has_ts:
+            data["created_at"] = _decode_ts(created)
+            data["updated_at"] = _decode_ts(updated)
+        return data
+
+    def _materialize(self, rec: Sequence[Any]) -> Any:
+        return self.model.model_construct(**self._record(rec, {}))
+
+    def to_shifts(self, indices: Iterable[int] | np.ndarray | None = None) -> List[Any]:
+        rows = self.rows if indices is None else self.rows[np.asarray(indices, dtype=np.intp)]
+        days: Dict[int, date] = {}
+        construct = self.model.model_construct
+        return [construct(**self._record(rec, days)) for rec in rows.tolist()]
+
+    def to_dicts(self, indices: Iterable[int] | np.ndarray | None = None) -> List[Dict[str, Any]]:
+        """モデルと同じキーの dict を返す（レスポンスの直列化用。pydantic を経由しない）"""
+        rows = self.rows if indices is None else self.rows[np.asarray(indices, dtype=np.intp)]
+        days: Dict[int, date] = {}
+        return [self._record(rec, days) for rec in rows.tolist()]
+
+    def _observe_ids(self, ids: np.ndarray) -> None:
+        if ids.size:
+            self.ids.observe(int(ids.max()))
+
+    def _index_set(self, old_id: int, new_id: int, index: int) -> None:
+        if new_id != NULL:
+            self.ids.observe(new_id)
+        if self._id_index is None:
+            return
+        if old_id != NULL and self._id_index.get(old_id) == index:
+            del self._id_index[old_id]
+        if new_id != NULL:
+            self._id_index[new_id] = index
+
+    def allocate_id(self) -> int:
+        return self.ids.allocate()
+
+    def append(self, shift: Any) -> int:
+        self._reserve(1)
+        self._order = None
+        rec = self._encode(shift)
+        index = self._size
+        self._rows[index] = rec
+        self._size += 1
+        self._index_set(NULL, rec[0], index)
+        self._touch((rec[2],))
+        return index
+
+    def extend(self, shifts: Iterable[Any]) -> None:
+        encoded = [self._encode(s) for s in shifts]
+        if not encoded:
+            return
+        self._reserve(len(encoded))
+        self._order = None
+        self._rows[self._size: self._size + len(encoded)] = encoded
+        self._size += len(encoded)
+        self._id_index = None
+        self._observe_ids(self._rows["id"][self._size - len(encoded): self._size])
+        self._touch(rec[2] for rec in encoded)
+
+    def replace(self, index: int, shift: Any) -> None:
+        self._order = None
+        old_id = int(self._rows[index]["id"])
+        rec = self._encode(shift)
+        self._touch((int(self._rows[index]["day"]), rec[2]))
+        self._rows[index] = rec
+        self._index_set(old_id, rec[0], index)
+
+    def update(self, index: int, **fields: Any) -> None:
+        """指定行の一部フィールドを書き換える（モデルのフィールド名で指定）"""
+        self._order = None
+        row = self._rows[index]
+        self._touch((int(row["day"]),))
+        if "start_time" in fields or "end_time" in fields:
+            start, end = _slot_times[row["slot"]]
+            row["slot"] = slot_code(fields.pop("start_time", start), fields.pop("end_time", end))
+        if "date" in fields:
+            row["day"] = _encode_day(fields.pop("date"))
+            self._touch((int(row["day"]),))
+        if "id" in fields:
+            sid = fields.pop("id")
+            old_id = int(row["id"])
+            row["id"] = NULL if sid is None else int(sid)
+            self._index_set(old_id, int(row["id"]), index)
+        for key in ("created_at", "updated_at"):
+            if key in fields:
+                row[key] = _encode_ts(fields.pop(key))
+        for key, value in fields.items():
+            row[key] = value
+
+    def delete(self, indices: Iterable[int] | np.ndarray) -> None:
+        idx = np.asarray(list(indices) if not isinstance(indices, np.ndarray) else indices, dtype=np.intp)
+        if idx.size == 0:
+            return
+        self._order = None
+        self._touch(self._rows["day"][idx].tolist())
+        if idx.size <= self.SWAP_DELETE_LIMIT:
+            # 後ろの行番号から順に、末尾行を穴に移して詰める（行の並びは変わる）
+            for i in sorted(set(idx.tolist()), reverse=True):
+                last = self._size - 1
+                gone = int(self._rows[i]["id"])
+                if self._id_index is not None and gone != NULL and self._id_index.get(gone) == i:
+                    del self._id_index[gone]
+                if i != last:
+                    self._rows[i] = self._rows[last]
+                    moved = int(self._rows[i]["id"])
+                    if self._id_index is not None and moved != NULL:
+                        self._id_index[moved] = i
+                self._size = last
+            return
+        keep = np.ones(self._size, dtype=bool)
+        keep[idx] = False
+        kept = self.rows[keep]
+        self._rows[: len(kept)] = kept
+        self._size = len(kept)
+        self._id_index = None
+
+    def patch(self, added: np.ndarray, removed: np.ndarray, updated: np.ndarray) -> None:
+        """diff() の結果（added, removed, updated_after）を id で当てる
+
+        別の版を基に作った変更を最新版へ反映する時に使う。既に消えている行への更新は捨てる。
+        """
+        gone = [i for i in (self.find_id(sid) for sid in removed["id"].tolist()) if i is not None]
+        for rec in updated:
+            i = self.find_id(int(rec["id"]))
+            if i is not None:
+                self._order = None
+                self._touch((int(self._rows[i]["day"]), int(rec["day"])))
+                self._rows[i] = rec
+        self.delete(gone)
+        if len(added):
+            self._reserve(len(added))
+            self._order = None
+            self._rows[self._size: self._size + len(added)] = added
+            self._size += len(added)
+            self._id_index = None
+            self._observe_ids(added["id"])
+            self._touch(added["day"].tolist())
+
+    def clear(self) -> None:
+        self._order = None
+        self._size = 0
+        self._id_index = {}
+        if self._touched is not None:
+            self._touched = ALL_DAYS
+
+    def find(self, employee_id: int, d: date, start: time, end: time) -> Optional[int]:
+        code = _slot_codes.get((start, end))
+        if code is None:
+            return None
+        rows = self.rows
+        hit = np.flatnonzero(
+            (rows["employee_id"] == employee_id) & (rows["day"] == d.toordinal()) & (rows["slot"] == code)
+        )
+        return int(hit[0]) if hit.size else None
+
+    def find_id(self, shift_id: int) -> Optional[int]:
+        if self._id_index is None:
+            index: Dict[int, int] = {}
+            for i, sid in enumerate(self.rows["id"].tolist()):
+                if sid != NULL:
+                    index.setdefault(sid, i)
+            self._id_index = index
+        return self._id_index.get(shift_id)
+
+    def date_order(self) -> np.ndarray:
+        if self._order is None:
+            rows = self.rows
+            self._order = np.lexsort((rows["id"], rows["employee_id"], rows["slot"], rows["day"]))
+        return self._order
+
+    def sort_key(self, index: int) -> Tuple[int, int, int, int]:
+        row = self._rows[index]
+        return int(row["day"]), int(row["slot"]), int(row["employee_id"]), int(row["id"])
+
+    def query(
+        self,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        employee_id: Optional[int] = None,
+        slot: Optional[int] = None,
+        after: Optional[Tuple[int, int, int, int]] = None,
+    ) -> np.ndarray:
+        """条件に合う行番号を日付順で返す。after には sort_key() の値を渡す（その行より後ろから）"""
+        order = self.date_order()
+        days = self.rows["day"][order]
+        lo = int(np.searchsorted(days, start.toordinal(), "left")) if start else 0
+        if after is not None:
+            lo = max(lo, int(np.searchsorted(days, after[0], "left")))
+        hi = int(np.searchsorted(days, end.toordinal(), "right")) if end else len(order)
+        idx = order[lo:hi]
+        if idx.size == 0:
+            return idx
+        rows = self.rows[idx]
+        keep = np.ones(len(idx), dtype=bool)
+        if employee_id is not None:
+            keep &= rows["employee_id"] == employee_id
+        if slot is not None:
+            keep &= rows["slot"] == slot
+        if after is not None:
+            keep &= _after_mask(rows, after)
+        return idx[keep]
+
+    def start_after(self, idx: np.ndarray, after: Tuple[int, int, int, int]) -> int:
+        """query() の結果 idx の中で、sort_key が after より後ろになる最初の位置"""
+        if idx.size == 0:
+            return 0
+        return len(idx) - int(_after_mask(self.rows[idx], after).sum())
+
+    def mask_between(self, start: date, end: date) -> np.ndarray:
+        days = self.rows["day"]
+        return (days >= start.toordinal()) & (days <= end.toordinal())
+
+    def between(self, start: date, end: date) -> "ScheduleTable":
+        """start〜end（両端含む）の行だけを持つコピーを返す"""
+        return ScheduleTable.from_rows(self.model, self.rows[self.mask_between(start, end)])
+
+
+def _as_void(rows: np.ndarray) -> np.ndarray:
+    return np.ascontiguousarray(rows).view(np.dtype((np.void, SHIFT_DTYPE.itemsize)))
+
+
+def row_key(rec: Sequence[Any]) -> Any:
+    """差分合成用のキー。id があれば id、無ければ (従業員, 日, 枠)"""
+    return rec[0] if rec[0] != NULL else (rec[1], rec[2], rec[3])
+
+
+def diff(old: ScheduleTable, new: ScheduleTable, days: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """old -> new の差分を (added, removed, updated_before, updated_after) の行配列で返す。
+
+    行全体が一致するものは変更なしとし、残りを id で突き合わせて updated とする。
+    days（new.touched_days() の値）を渡すとその日の行だけを比べる（他の日は変わっていない前提）。
+    """
+    a, b = old.rows, new.rows
+    if days is not None:
+        a = a[np.isin(a["day"], days)]
+        b = b[np.isin(b["day"], days)]
+    va, vb = _as_void(a), _as_void(b)
+    gone = a[~np.isin(va, vb)]
+    came = b[~np.isin(vb, va)]
+    gid, cid = gone["id"], came["id"]
+    g_pair = (gid != NULL) & np.isin(gid, cid)
+    c_pair = (cid != NULL) & np.isin(cid, gid)
+    before = gone[g_pair]
+    after = came[c_pair]
+    if len(before) != len(after):
+        # id 重複時は突き合わせず追加/削除として扱う
+        return came, gone, gone[:0], came[:0]
+    before = before[np.argsort(before["id"], kind="stable")]
+    after = after[np.argsort(after["id"], kind="stable")]
+    return came[~c_pair], gone[~g_pair], before, after
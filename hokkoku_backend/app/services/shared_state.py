@@ -0,0 +1,120 @@
+"""複数ワーカー間で状態を共有する SQLite ストア
+
+名前付きドキュメントを (version, body) で保持する。書き込みは BEGIN IMMEDIATE で
+プロセス間に直列化し、読み取り側は PRAGMA data_version で他プロセスの更新を安価に検知する。
+"""
+import sqlite3
+import struct
+import threading
+from contextlib import contextmanager
+from datetime import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, Optional, Tuple, Type
+from uuid import uuid4
+
+import numpy as np
+
+from .schedule_table import ScheduleTable, SHIFT_DTYPE, slot_code, slot_times
+
+# 次に払い出す ID, 時間帯の数
+_HEADER = struct.Struct("<qi")
+# 時間帯は (開始, 終了) の 0 時からの秒数で持つ。slot コードはプロセスごとの採番なので本文には載せない
+_SLOT_DTYPE = np.dtype([("start", np.int32), ("end", np.int32)])
+
+
+def _seconds(t: time) -> int:
+    return t.hour * 3600 + t.minute * 60 + t.second
+
+
+def _clock(v: int) -> time:
+    return time(v // 3600, v // 60 % 60, v % 60)
+
+
+def pack_schedule(table: ScheduleTable) -> bytes:
+    """ヘッダー + 使っている時間帯の表 + 行バイト列（slot 列は時間帯の表の添字に置き換える）"""
+    rows = table.rows.copy()
+    codes, rows["slot"] = np.unique(rows["slot"], return_inverse=True)
+    slots = np.array([tuple(_seconds(t) for t in slot_times(int(c))) for c in codes.tolist()], dtype=_SLOT_DTYPE)
+    return _HEADER.pack(table.ids.peek(), len(slots)) + slots.tobytes() + rows.tobytes()
+
+
+def unpack_schedule(model: Type[Any], body: bytes) -> ScheduleTable:
+    next_id, n_slots = _HEADER.unpack_from(body)
+    slots = np.frombuffer(body, dtype=_SLOT_DTYPE, count=n_slots, offset=_HEADER.size)
+    rows = np.frombuffer(body, dtype=SHIFT_DTYPE, offset=_HEADER.size + slots.nbytes).copy()
+    local = np.array([slot_code(_clock(s), _clock(e)) for s, e in slots.tolist()], dtype=np.int16)
+    if len(rows):
+        rows["slot"] = local[rows["slot"]]
+    table = ScheduleTable.from_rows(model, rows)
+    table.ids.observe(next_id - 1)
+    return table
+
+
+class SharedState:
+    def __init__(self, path: Path, timeout: float = 5.0):
+        self.path = Path(path)
+        self._conn = sqlite3.connect(str(self.path), timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS shared_state (name TEXT PRIMARY KEY, version INTEGER NOT NULL, body BLOB NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS shared_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._data_version: Optional[int] = None
+        with self.transaction():
+            self._conn.execute("INSERT OR IGNORE INTO shared_meta (key, value) VALUES ('token', ?)", (uuid4().hex[:8],))
+            self.token = self._conn.execute("SELECT value FROM shared_meta WHERE key = 'token'").fetchone()[0]
+
+    def changed(self) -> bool:
+        """前回確認以降に他の接続がコミットしていれば True"""
+        with self._lock:
+            v = self._conn.execute("PRAGMA data_version").fetchone()[0]
+            changed = v != self._data_version
+            self._data_version = v
+            return changed
+
+    def versions(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT name, version FROM shared_state").fetchall())
+
+    def version(self, name: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT version FROM shared_state WHERE name = ?", (name,)).fetchone()
+        return None if row is None else row[0]
+
+    def load(self, name: str) -> Optional[Tuple[int, bytes]]:
+        with self._lock:
+            row = self._conn.execute("SELECT version, body FROM shared_state WHERE name = ?", (name,)).fetchone()
+        return None if row is None else (row[0], bytes(row[1]))
+
+    def store(self, name: str, version: int, body: bytes) -> None:
+        with self.transaction():
+            self._conn.execute(
+                "INSERT INTO shared_state (name, version, body) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET version = excluded.version, body = excluded.body",
+                (name, version, body),
+            )
+
+    @contextmanager
+    def transaction(self) -> Iterator[None]:
+        """プロセス間の書き込みロックを取る。入れ子になった場合は最も外側でコミットする"""
+        with self._lock:
+            if self._depth == 0:
+                self._conn.execute("BEGIN IMMEDIATE")
+            self._depth += 1
+            try:
+                yield
+            except BaseException:
+                self._depth -= 1
+                if self._depth == 0:
+                    self._conn.execute("ROLLBACK")
+                    # 手元の状態だけ先に進んでいる可能性があるので、次回の確認で共有側を取り込み直す
+                    self._data_version = None
+                raise
+            self._depth -= 1
+            if self._depth == 0:
+                self._conn.execute("COMMIT")
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,118 @@
+"""validate_shift_constraints の配列実装
+
+ScheduleTable の行（従業員 × 日 × 時間枠）をまとめて判定する。
+- 連続勤務: (従業員の初出順, 日, 開始時刻) に並べ、隣どうしが連続する枠かを比較して連続の長さを数える
+- 人員不足: (日, 時間枠) ごとの人数
+- スキル不足: 日ごとの最大スキル
+
+警告の文言・順序は従来のループ実装と同じ（従業員・日付は入力での初出順。affected_dates も同じ順で集合に入れる）。
+同じ従業員の同じ枠が重複している場合も従来どおり連続の区切りとして扱う。
+"""
+from datetime import date
+from typing import Any, Dict, List
+
+import numpy as np
+
+from .schedule_table import slot_times
+
+# 開始時刻（分）の組で連続とみなすもの。同日: 00→08, 08→16, 16→00 / 翌日: 16→00, 00→08
+_SAME_DAY = ((0, 480), (480, 960), (960, 0))
+_NEXT_DAY = ((960, 0), (0, 480))
+
+
+def _first_seen_rank(values: np.ndarray):
+    """値ごとの初出順の番号（行ごと）と、初出順に並べた値"""
+    uniq, first, inv = np.unique(values, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind="stable")
+    rank = np.empty(len(uniq), dtype=np.intp)
+    rank[order] = np.arange(len(uniq))
+    return rank[inv], uniq, inv, order
+
+
+def _pairs(prev: np.ndarray, cur: np.ndarray, pairs) -> np.ndarray:
+    out = np.zeros(len(cur), dtype=bool)
+    for p, c in pairs:
+        out |= (prev == p) & (cur == c)
+    return out
+
+
+def _date_str(ordinal: int) -> str:
+    return date.fromordinal(ordinal).strftime("%Y-%m-%d")
+
+
+def _display(dates: List[str]) -> str:
+    return dates[0] if len(dates) == 1 else "、".join(dates)
+
+
+def check_schedule_rows(rows: np.ndarray, skill_of: Dict[int, int], name_of: Dict[int, str]) -> List[Dict[str, Any]]:
+    """SHIFT_DTYPE の行から ShiftValidationWarning 相当の dict を返す"""
+    if not len(rows):
+        return []
+    warnings: List[Dict[str, Any]] = []
+    emp = rows["employee_id"]
+    day = rows["day"].astype(np.int64)
+    slot = rows["slot"].astype(np.intp)
+
+    starts = [slot_times(c)[0] for c in range(int(slot.max()) + 1)]
+    start_min = np.array([t.hour * 60 + t.minute for t in starts], dtype=np.int64)[slot]
+    start_str = [t.strftime("%H:%M") for t in starts]
+
+    # 連続勤務
+    emp_rank, emp_ids, emp_inv, _ = _first_seen_rank(emp)
+    order = np.lexsort((start_min, day, emp_rank))
+    e, d, st = emp_rank[order], day[order], start_min[order]
+    link = np.zeros(len(order), dtype=bool)
+    same_emp = e[1:] == e[:-1]
+    gap = d[1:] - d[:-1]
+    link[1:] = same_emp & (
+        ((gap == 0) & _pairs(st[:-1], st[1:], _SAME_DAY)) | ((gap == 1) & _pairs(st[:-1], st[1:], _NEXT_DAY))
+    )
+    run_start = np.flatnonzero(~link)
+    run_id = np.cumsum(~link) - 1
+    pos = np.arange(len(order)) - run_start[run_id]
+    third = np.flatnonzero(pos == 2)           # 3 枠目に達した位置（連続ごとに 1 回）
+    if len(third):
+        labels = []
+        periods: Dict[int, np.ndarray] = {}
+        for i in third.tolist():
+            emp_id = int(emp[order[i]])
+            labels.append(f"{name_of.get(emp_id, f'従業員ID{emp_id}')}(ID：{emp_id}番)")
+            periods[emp_id] = order[i - 2 : i + 1]
+        all_dates = [
+            f"{_date_str(int(day[r]))}_{start_str[slot[r]]}" for idx in periods.values() for r in idx.tolist()
+        ]
+        warnings.append({
+            "type": "consecutive_timeslots",
+            "message": f"{'、'.join(labels)}が連続する時間枠でシフトに入っています",
+            "affected_employees": list(periods),
+            "affected_dates": list(set(all_dates)),
+        })
+
+    _, days, day_inv, day_order = _first_seen_rank(day)
+
+    # 日 × 時間枠 の人数が 2 未満の日
+    cell = day_inv * (int(slot.max()) + 1) + slot
+    cells, counts = np.unique(cell, return_counts=True)
+    short = np.zeros(len(days), dtype=bool)
+    short[cells[counts < 2] // (int(slot.max()) + 1)] = True
+    insufficient = [_date_str(int(days[i])) for i in day_order.tolist() if short[i]]
+
+    # 日ごとの最大スキルが 3 未満の日
+    emp_skill = np.array([skill_of.get(int(i), 1) for i in emp_ids.tolist()], dtype=np.int64)
+    max_skill = np.full(len(days), np.iinfo(np.int64).min)
+    np.maximum.at(max_skill, day_inv, emp_skill[emp_inv])
+    low_skill = [_date_str(int(days[i])) for i in day_order.tolist() if max_skill[i] < 3]
+
+    if insufficient:
+        warnings.append({
+            "type": "insufficient_staff",
+            "message": f"{_display(insufficient)}において人員が不足しています",
+            "affected_dates": insufficient,
+        })
+    if low_skill:
+        warnings.append({
+            "type": "skill_requirement",
+            "message": f"{_display(low_skill)}においてスキルレベル3以上の従業員が不足しています",
+            "affected_dates": low_skill,
+        })
+    return warnings
@@ -0,0 +1,202 @@
+"""シフト系ペイロードのコンパクト表現とコンテンツネゴシエーション
+
+Accept（WebSocket は ?encoding=）で次の 3 つを選べる。
+
+- application/json: 従来の形（既定）
+- application/vnd.hokkoku.compact+json: シフトを列ごとの整数配列にした JSON。
+  day は base_date からの日数、slot は slots の添字、id の欠損は null
+- application/msgpack: compact と同じ構造の MessagePack
+"""
+from collections import OrderedDict
+from datetime import date, time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import msgpack
+import numpy as np
+
+from .response_cache import dumps
+from .schedule_table import NULL, ScheduleTable, slot_code, slot_times
+
+JSON = "application/json"
+COMPACT_JSON = "application/vnd.hokkoku.compact+json"
+MSGPACK = "application/msgpack"
+
+_ALIASES = {"json": JSON, "compact": COMPACT_JSON, "msgpack": MSGPACK}
+# キャッシュキー・ETag 用の表現ごとの接尾辞
+SUFFIX = {JSON: "", COMPACT_JSON: ".compact", MSGPACK: ".msgpack"}
+COLUMNS = ("id", "employee_id", "day", "slot", "break_minutes")
+
+
+def available() -> List[str]:
+    return [JSON, COMPACT_JSON, MSGPACK]
+
+
+def negotiate(accept: Optional[str]) -> str:
+    """Accept ヘッダ（または json|compact|msgpack）から返す形式を決める。対応外なら JSON"""
+    if not accept:
+        return JSON
+    best, best_q = JSON, -1.0
+    for part in accept.split(","):
+        media, *params = [p.strip() for p in part.split(";")]
+        media = _ALIASES.get(media, media)
+        q = 1.0
+        for p in params:
+            if p.startswith("q="):
+                try:
+                    q = float(p[2:])
+                except ValueError:
+                    q = 0.0
+        if media not in available() or q <= 0:
+            continue
+        # 同じ q なら先に書かれた方を優先する
+        if q > best_q:
+            best, best_q = media, q
+    return best
+
+
+def is_compact(media: str) -> bool:
+    return media != JSON
+
+
+def encode(media: str, payload: Any) -> bytes:
+    if media == MSGPACK:
+        return msgpack.packb(payload, default=_default)
+    return dumps(payload)
+
+
+def _default(o: Any) -> Any:
+    if hasattr(o, "isoformat"):
+        return o.isoformat()
+    raise TypeError(f"Object of type {type(o).__name__} is not serializable")
+
+
+def _nullable(col: np.ndarray) -> List[Optional[int]]:
+    values = col.tolist()
+    if (col == NULL).any():
+        return [None if v == NULL else v for v in values]
+    return values
+
+
+def _slot_labels(slot_max: int) -> List[str]:
+    return ["%s-%s" % tuple(t.strftime("%H:%M") for t in slot_times(c)) for c in range(slot_max + 1)]
+
+
+def pack_rows(rows: np.ndarray, fields: Optional[Sequence[str]] = None, timestamps: bool = False) -> Dict[str, Any]:
+    """SHIFT_DTYPE の行を列ごとの整数配列にする"""
+    fields = list(fields) if fields else list(COLUMNS)
+    base = int(rows["day"].min()) if len(rows) else 0
+    slot_max = int(rows["slot"].max()) if len(rows) else -1
+    out: Dict[str, Any] = {
+        "n": len(rows),
+        "base_date": date.fromordinal(base).isoformat() if len(rows) else None,
+        "slots": _slot_labels(slot_max),
+    }
+    for name in fields:
+        if name in ("date", "day"):
+            out["day"] = (rows["day"] - base).tolist()
+        elif name in ("start_time", "end_time", "slot"):
+            out["slot"] = rows["slot"].tolist()
+        elif name in ("id", "created_at", "updated_at"):
+            out[name] = _nullable(rows[name])
+        else:
+            out[name] = rows[name].tolist()
+    if timestamps:
+        # epoch マイクロ秒（UTC naive）
+        out["created_at"] = _nullable(rows["created_at"])
+        out["updated_at"] = _nullable(rows["updated_at"])
+    return out
+
+
+def _day(v: Any) -> int:
+    return v.toordinal() if isinstance(v, date) else date.fromisoformat(v).toordinal()
+
+
+def _time(v: Any, parsed: Dict[str, time]) -> time:
+    if isinstance(v, time):
+        return v
+    t = parsed.get(v)
+    if t is None:
+        t = parsed[v] = time.fromisoformat(v)
+    return t
+
+
+def pack_shifts(shifts: Iterable[Any]) -> Dict[str, Any]:
+    """Shift（モデルまたは model_dump(mode="json") の dict）の並びを pack_rows と同じ形にする"""
+    if isinstance(shifts, ScheduleTable):
+        return pack_rows(shifts.rows)
+    recs = [s if isinstance(s, dict) else s.__dict__ for s in shifts]
+    parsed: Dict[str, time] = {}
+    days = [_day(r["date"]) for r in recs]
+    slots = [slot_code(_time(r["start_time"], parsed), _time(r["end_time"], parsed)) for r in recs]
+    base = min(days, default=0)
+    return {
+        "n": len(recs),
+        "base_date": date.fromordinal(base).isoformat() if recs else None,
+        "slots": _slot_labels(max(slots, default=-1)),
+        "id": [r.get("id") for r in recs],
+        "employee_id": [r["employee_id"] for r in recs],
+        "day": [d - base for d in days],
+        "slot": slots,
+        "break_minutes": [r.get("break_minutes", 60) for r in recs],
+    }
+
+
+def pack_preview(preview: Any) -> Dict[str, Any]:
+    """SchedulePreviewResponse のコンパクト表現"""
+    return {
+        "week_start": preview.week_start.isoformat(),
+        "week_end": preview.week_end.isoformat(),
+        "shifts": pack_shifts(preview.shifts),
+        "added": pack_shifts(preview.added),
+        "removed": pack_shifts(preview.removed),
+        "updated": {
+            "before": pack_shifts([u.before for u in preview.updated]),
+            "after": pack_shifts([u.after for u in preview.updated]),
+        },
+        "change_set": pack_change_set(preview.change_set),
+    }
+
+
+def pack_change_set(cs: Any) -> Dict[str, Any]:
+    """ChangeSet（モデルまたは JSON の dict）のコンパクト表現。before/after は shifts の添字（無ければ -1）"""
+    data = dict(cs) if isinstance(cs, dict) else cs.model_dump(mode="json", exclude={"deltas"})
+    deltas = data.pop("deltas", None) or (cs.deltas if not isinstance(cs, dict) else [])
+    shifts: List[Any] = []
+    kinds: List[str] = []
+    before: List[int] = []
+    after: List[int] = []
+    for d in deltas:
+        rec = d if isinstance(d, dict) else d.__dict__
+        kinds.append(rec["kind"])
+        for side, out in ((rec.get("before"), before), (rec.get("after"), after)):
+            if side is None:
+                out.append(-1)
+            else:
+                out.append(len(shifts))
+                shifts.append(side)
+    data["deltas"] = {"kind": kinds, "before": before, "after": after, "shifts": pack_shifts(shifts)}
+    return data
+
+
+def pack_message(msg: Dict[str, Any]) -> Dict[str, Any]:
+    """/ws/adjustments のメッセージをコンパクト表現にする（proposals_ready 以外はそのまま）"""
+    if msg.get("type") == "proposals_ready" and isinstance(msg.get("change_set"), dict):
+        return dict(msg, change_set=pack_change_set(msg["change_set"]))
+    return msg
+
+
+# 同じメッセージを購読者ごとに符号化し直さないよう、直近のものを覚えておく
+_MAX_ENCODED = 32
+_encoded: "OrderedDict[Tuple[int, str], Tuple[Dict[str, Any], bytes]]" = OrderedDict()
+
+
+def encode_message(media: str, msg: Dict[str, Any]) -> bytes:
+    key = (id(msg), media)
+    hit = _encoded.get(key)
+    if hit is not None and hit[0] is msg:
+        return hit[1]
+    body = encode(media, pack_message(msg))
+    _encoded[key] = (msg, body)
+    while len(_encoded) > _MAX_ENCODED:
+        _encoded.popitem(last=False)
+    return body
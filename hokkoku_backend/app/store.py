@@ -1,19 +1,42 @@
 from __future__ import annotations
 
-from typing import Dict, Any, List, Tuple
+from typing import Dict, Any, List, Tuple, Callable, Iterable, Iterator
 from datetime import datetime, timedelta, date, time
 from uuid import uuid4
 import sqlite3
 from pathlib import Path
-import asyncio
+import json
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager, nullcontext
+import numpy as np
 from .schemas import Shift, ShiftUpdatePair, ChangeDelta, ChangeSet
+from .services.schedule_table import ScheduleTable, slot_code, slot_times, diff as schedule_diff, row_key
+from .services.shared_state import SharedState, pack_schedule, unpack_schedule
+from .services.event_bus import EventBus
+from .services.schedule_locks import WeekLockTable, week_of
+from .services.broadcast import BroadcastHub, Subscriber
+from .services.candidates import CandidateEngine, parse_scoring
+from .services.live_warnings import WarningIndex
+from .config import SCHEDULE_CHANGE_LOG_SIZE, WS_BUFFER_LIMIT, WS_DELTA_MAX_ROWS, REPLACEMENT_SCORING
+
+logger = logging.getLogger("backend")
 
 sessions: Dict[str, Dict[str, Any]] = {}
 messages: Dict[str, Dict[str, Any]] = {}
 constraint_versions: Dict[str, Dict[str, Any]] = {}
 audit_logs: List[Dict[str, Any]] = []
-_current_schedule: List[Shift] = []
+_current_schedule: ScheduleTable = ScheduleTable(Shift)
 _schedule_version = 0
+# (version, table) を 1 つの参照で持ち、読み取り側が版と中身を食い違いなく取れるようにする
+_snapshot: Tuple[int, ScheduleTable] = (0, _current_schedule)
+# スケジュール変更履歴のリングバッファ: (version, added, removed, updated_before, updated_after)
+_change_log: deque = deque(maxlen=SCHEDULE_CHANGE_LOG_SIZE)
+# コミット済みのテーブルは書き換えない（読み取りはロック無しで参照を取るだけ）。
+# 書き込みは schedule_transaction() で触る週だけをロックし、差し替えは _commit_lock の下で行う
+_commit_lock = threading.RLock()
+_week_locks = WeekLockTable()
 
 current_constraints: Dict[str, Any] = {
     "min_staff_weekend": 1,
@@ -27,7 +50,28 @@ def _db():
     conn.execute("CREATE TABLE IF NOT EXISTS audit (id TEXT PRIMARY KEY, actor TEXT, action TEXT, meta TEXT, created_at TEXT)")
     return conn
 
-_ws_queues: List[asyncio.Queue] = []
+
+def _merge_schedule_updated(old: Dict[str, Any], new: Dict[str, Any]) -> Dict[str, Any]:
+    """未送信の schedule.updated をまとめる。差分は合成せず、古い方の base_version からの取り直しを促す"""
+    if old.get("base_version") is None:
+        return new
+    return dict(new, base_version=old["base_version"], delta=None, warnings=None)
+
+# /ws/adjustments の購読者。バッファは購読者ごとに WS_BUFFER_LIMIT 件まで
+_hub = BroadcastHub(limit=WS_BUFFER_LIMIT, merge=_merge_schedule_updated)
+# 直近の schedule.updated が指すバージョン（次のイベントの base_version）
+_published_version = 0
+# スケジュール全体の警告。コミットごとに差分で更新する（_warnings_at は反映済みの (スケジュール版, 従業員版)）
+_warnings = WarningIndex()
+_warnings_at: Tuple[int, int] = (-1, -1)
+
+# 複数ワーカー用の共有モード（enable_shared_state で有効化）
+_shared: SharedState | None = None
+_bus: EventBus | None = None
+_shared_seen: Dict[str, int] = {}
+_state_listeners: List[Callable[[str, Any, int], None]] = []
+# この接頭辞の共有ドキュメントは JSON ではなく pack_schedule() の形で持つ
+TABLE_DOC = "table:"
 def new_id() -> str:
     return uuid4().hex
 
@@ -81,10 +125,17 @@ def add_audit(actor: str, action: str, meta: Dict[str, Any]):
 
 # グローバル変数で従業員データを管理
 _employees_cache: List[Dict[str, Any]] = []
+_employees_version = 0
+# (テーブル, 従業員マスタ, CandidateEngine)。どちらかが差し替わったら作り直す
+_candidates: Tuple[ScheduleTable, List[Dict[str, Any]], CandidateEngine] | None = None
 
-def set_employees_cache(employees: List[Dict[str, Any]]):
-    global _employees_cache
+def set_employees_cache(employees: List[Dict[str, Any]], version: int | None = None):
+    global _employees_cache, _employees_version
     _employees_cache = employees
+    _employees_version = _employees_version + 1 if version is None else version
+
+def employees_version() -> int:
+    return _employees_version
 
 def employees_master() -> List[Dict[str, Any]]:
     if _employees_cache:
@@ -109,139 +160,241 @@ def schedule_version() -> int:
     return _schedule_version
 
 def current_schedule_copy() -> List[Shift]:
-    return [Shift(**s.dict()) for s in _current_schedule]
+    return _current_schedule.to_shifts()
+
+def current_schedule_table() -> ScheduleTable:
+    """現在のスケジュール（読み取り専用として扱うこと）"""
+    return _current_schedule
+
+def schedule_snapshot() -> Tuple[int, ScheduleTable]:
+    """(version, table) の組。table は読み取り専用"""
+    return _snapshot
+
+def _notify(name: str, payload: Any, version: int):
+    for fn in _state_listeners:
+        fn(name, payload, version)
+
+def _commit_schedule(table: ScheduleTable, changes: Tuple[np.ndarray, ...] | None = None):
+    """スケジュールを差し替えてバージョンを進め、差分を変更履歴に積む（_commit_lock を持って呼ぶ）
+
+    changes は現在の版 -> table の差分 (added, removed, before, after)。分かっていれば渡す（無ければ全体を比べる）。
+    """
+    global _current_schedule, _schedule_version
+    added, removed, before, after = schedule_diff(_current_schedule, table) if changes is None else changes
+    _current_schedule = table
+    _schedule_version += 1
+    _change_log.append((_schedule_version, added, removed, before, after))
+    if _shared is not None:
+        with _shared.transaction():
+            remote = _shared.versions().get("schedule", 0)
+            if remote >= _schedule_version:
+                # shared_write() の外から書かれた場合のみ起こる。後勝ちだがバージョンは巻き戻さない
+                logger.warning("schedule overwritten concurrently: local=%s shared=%s", _schedule_version, remote)
+                _schedule_version = remote + 1
+                _change_log.clear()
+            _shared.store("schedule", _schedule_version, pack_schedule(table))
+        _shared_seen["schedule"] = _schedule_version
+    _publish_snapshot()
+
+def _publish_snapshot():
+    global _snapshot
+    _snapshot = (_schedule_version, _current_schedule)
+    _sync_warnings()
+    _notify("schedule", _current_schedule, _schedule_version)
+
+def _sync_warnings():
+    """警告を現在のスケジュールに合わせる。直前の版からなら変更履歴の差分だけを当てる（_commit_lock を持って呼ぶ）"""
+    global _warnings_at
+    at = (_schedule_version, _employees_version)
+    if _warnings_at == at:
+        return
+    last = _change_log[-1] if _change_log else None
+    incremental = _warnings_at == (_schedule_version - 1, _employees_version) and last is not None and last[0] == _schedule_version
+    if incremental:
+        _warnings.apply(*last[1:])
+    if not incremental or _warnings.size != len(_current_schedule):
+        # 差分を追えない時、または id の無い全く同じ行の重複で差分が欠けた時は全件から作り直す
+        _warnings.rebuild(_current_schedule.rows, employees_master())
+    _warnings_at = at
+
+def schedule_warnings() -> Tuple[int, List[Dict[str, Any]]]:
+    """(version, ShiftValidationWarning 相当の dict のリスト)。スケジュール全体が対象"""
+    with _commit_lock:
+        _sync_warnings()
+        return _schedule_version, _warnings.warnings()
+
+def _adopt_schedule(table: ScheduleTable, version: int):
+    global _current_schedule, _schedule_version
+    with _commit_lock:
+        if version <= _schedule_version:
+            return
+        if version == _schedule_version + 1:
+            added, removed, before, after = schedule_diff(_current_schedule, table)
+            _change_log.append((version, added, removed, before, after))
+        else:
+            # 途中のバージョンを見ていないので差分配信は全件にフォールバックさせる
+            _change_log.clear()
+        _current_schedule.ids.observe(table.ids.peek() - 1)
+        table.ids = _current_schedule.ids
+        _current_schedule = table
+        _schedule_version = version
+        _publish_snapshot()
+
+def _weeks_for(table: ScheduleTable, days: Iterable[date], ids: Iterable[int], everything: bool) -> set:
+    weeks = {int(week_of(d.toordinal())) for d in days}
+    rows = table.rows
+    if everything:
+        weeks.update(np.unique(week_of(rows["day"])).tolist())
+    else:
+        for sid in ids:
+            i = table.find_id(sid)
+            if i is not None:
+                weeks.add(int(week_of(int(rows["day"][i]))))
+    return weeks
+
+@contextmanager
+def _hold_weeks(days: Iterable[date], ids: Iterable[int], everything: bool = False) -> Iterator[ScheduleTable]:
+    """対象の週をロックし、その時点の最新版を返す。ロック待ちの間に対象行が別の週へ動いていたら取り直す"""
+    days, ids = list(days), list(ids)
+    with shared_write():
+        while True:
+            with _week_locks.hold(_weeks_for(_current_schedule, days, ids, everything)) as held:
+                base = _current_schedule
+                if not _weeks_for(base, days, ids, everything) <= set(held):
+                    continue
+                yield base
+                return
+
+@contextmanager
+def schedule_transaction(days: Iterable[date] = (), ids: Iterable[int] = (), everything: bool = False) -> Iterator[ScheduleTable]:
+    """スケジュール更新の単位。作業コピーを渡し、ブロックを抜けたら最新版へ当ててコミットする
+
+    days には書き込む日付、ids には書き換え・削除するシフトの ID を渡す。それらの週だけを
+    ロックするので、別の週を触る更新は並行に進む。例外で抜けた場合は何も反映しない。
+    ブロック内で await しないこと（イベントループ上のコルーチン同士は同じスレッドで再入できてしまう）。
+    """
+    with _hold_weeks(days, ids, everything) as base:
+        table = base.copy(share_ids=True)
+        table.track_days()
+        yield table
+        held = _weeks_for(base, days, ids, everything)
+        # 書き換えた日の行だけを 1 回比べる（ロック外の待ち時間も _commit_lock の保持時間もテーブルの大きさによらない）
+        changes = schedule_diff(base, table, table.touched_days())
+        added, removed, before, after = changes
+        touched = set(week_of(np.concatenate([added["day"], removed["day"], before["day"], after["day"]])).tolist())
+        if not touched <= held:
+            raise RuntimeError(f"schedule_transaction: ロックしていない週を変更しました: {sorted(touched - held)}")
+        with _commit_lock:
+            if _current_schedule is not base:
+                # 別の週の更新が先にコミットされている。自分の差分だけを最新版に当てる
+                # （触った週はロック中なので、最新版に対しても差分は同じ）
+                table = _current_schedule.copy(share_ids=True)
+                table.patch(added, removed, after)
+            _commit_schedule(table, changes)
+
+def schedule_lock_stats() -> Dict[str, float]:
+    return _week_locks.stats()
+
+def schedule_changes_since(since: int) -> Tuple[int, Dict[str, List[Any]] | None]:
+    """(version, since から version までの正味の差分)。履歴から追えない場合の差分は None（全件取得にフォールバック）
+
+    版と履歴はコミットと同じロックの下で写し取る（書き込み中の deque を走査しない）。
+    """
+    with _commit_lock:
+        version = _schedule_version
+        log = list(_change_log)
+    return version, _net_changes(log, since, version)
+
+def _net_changes(log: List[Tuple[Any, ...]], since: int, version: int) -> Dict[str, List[Any]] | None:
+    if since > version or since < 0:
+        return None
+    if since == version:
+        return {"added": [], "removed": [], "updated": []}
+    if not log or log[0][0] > since + 1:
+        return None
+    first: Dict[Any, Any] = {}
+    last: Dict[Any, Any] = {}
+
+    def touch(key: Any, before: Any, after: Any):
+        if key not in first:
+            first[key] = before
+        last[key] = after
+
+    for at, added, removed, before, after in log:
+        if at <= since or at > version:
+            continue
+        for rec in removed.tolist():
+            touch(row_key(rec), rec, None)
+        for rec in added.tolist():
+            touch(row_key(rec), None, rec)
+        for b, a in zip(before.tolist(), after.tolist()):
+            touch(row_key(b), b, a)
+
+    out: Dict[str, List[Any]] = {"added": [], "removed": [], "updated": []}
+    for key, b in first.items():
+        a = last[key]
+        if b is None and a is not None:
+            out["added"].append(a)
+        elif b is not None and a is None:
+            out["removed"].append(b)
+        elif b is not None and a is not None and b != a:
+            out["updated"].append((b, a))
+    return out
 
 def conflicting_shifts(a_id: int, b_id: int, start: date, end: date) -> List[Tuple[Shift, Shift]]:
+    table = _current_schedule
+    rows = table.rows
+    in_range = table.mask_between(start, end)
+    a_idx = np.flatnonzero(in_range & (rows["employee_id"] == a_id))
+    b_idx = np.flatnonzero(in_range & (rows["employee_id"] == b_id))
     out: List[Tuple[Shift, Shift]] = []
-    for sa in _current_schedule:
-        if sa.employee_id != a_id:
-            continue
-        for sb in _current_schedule:
-            if sb.employee_id != b_id:
-                continue
-            if sa.date == sb.date and start <= sa.date <= end:
-                out.append((sa, sb))
+    for i in a_idx:
+        for j in b_idx[rows["day"][b_idx] == rows["day"][i]]:
+            out.append((table[int(i)], table[int(j)]))
     return out
 
 from typing import Any
 
-def set_current_schedule(shifts: List[Any]):
-    global _current_schedule, _schedule_version
-    _current_schedule = [Shift(**s.dict()) for s in shifts]
-    _schedule_version += 1
+def set_current_schedule(shifts: ScheduleTable | List[Any]):
+    """スケジュール全体を差し替える（新旧どちらかに行のある週を全てロックする）"""
+    table = ScheduleTable.from_shifts(Shift, shifts)
+    days = {date.fromordinal(d) for d in np.unique(table.rows["day"]).tolist()}
+    with _hold_weeks(days, (), everything=True) as base:
+        base.ids.observe(table.ids.peek() - 1)
+        table.ids = base.ids
+        with _commit_lock:
+            _commit_schedule(table)
 
 def find_replacement_for(shift: Shift, exclude_ids: List[int]) -> int | None:
-    print(f"DEBUG: Finding replacement for shift - employee_id: {shift.employee_id}, date: {shift.date}, start_time: {shift.start_time}, end_time: {shift.end_time}")
-    print(f"DEBUG: Exclude IDs: {exclude_ids}")
-    print(f"DEBUG: Available employees: {[e['id'] for e in employees_master()]}")
-    
-    for e in employees_master():
-        if e["id"] in exclude_ids:
-            print(f"DEBUG: Skipping employee {e['id']} - in exclude list")
-            continue
-        conflict = False
-        for s in _current_schedule:
-            if s.employee_id == e["id"] and s.date == shift.date and s.start_time == shift.start_time and s.end_time == shift.end_time:
-                print(f"DEBUG: Employee {e['id']} has conflict on {s.date} at {s.start_time}-{s.end_time}")
-                conflict = True
-                break
-        if not conflict:
-            print(f"DEBUG: Found replacement: employee {e['id']}")
-            return e["id"]
-        else:
-            print(f"DEBUG: Employee {e['id']} has conflicts, skipping")
-    print(f"DEBUG: No replacement found for shift")
-    return None
+    """交代できる従業員を 1 人返す（同日の重複・連続枠の規則を守り、週の負荷が低い人を優先）"""
+    cands = candidate_engine().suggest(shift, 1, exclude_ids)
+    if not cands:
+        logger.debug("no replacement for employee=%s date=%s %s-%s", shift.employee_id, shift.date, shift.start_time, shift.end_time)
+        return None
+    return cands[0]["employee_id"]
+
+def candidate_engine() -> CandidateEngine:
+    """現在のスケジュールと従業員マスタに対する候補検索エンジン（どちらかが変わるまで使い回す）"""
+    global _candidates
+    table, employees = _current_schedule, employees_master()
+    cached = _candidates
+    if cached is not None and cached[0] is table and cached[1] is employees:
+        return cached[2]
+    engine = CandidateEngine(table, employees, parse_scoring(REPLACEMENT_SCORING))
+    _candidates = (table, employees, engine)
+    return engine
 
 def suggest_replacements_for(shift: Shift, max_candidates: int = 3, exclude_ids: List[int] | None = None) -> List[Dict[str, Any]]:
     """Return ranked candidates respecting simple constraints:
-    - Not already assigned in the exact same slot
-    - Not assigned any other slot on the same day (avoid double booking)
+    - Not assigned any slot on the same day (avoid double booking)
     - Not assigned on immediately consecutive slots (prev/next) across day boundaries
-    - Prefer employees with fewer shifts in the week
+    - Ranked by REPLACEMENT_SCORING (default: fewer shifts in the week first)
     """
-    if exclude_ids is None:
-        exclude_ids = []
-
-    def week_range(d: date) -> tuple[date, date]:
-        start = d - timedelta(days=d.weekday())
-        end = start + timedelta(days=6)
-        return start, end
-
-    def weekly_count(emp_id: int, d: date) -> int:
-        ws, we = week_range(d)
-        return sum(1 for s in _current_schedule if s.employee_id == emp_id and ws <= s.date <= we)
-
-    def start_str(t: time) -> str:
-        return t.strftime("%H:%M")
-
-    target_start = start_str(shift.start_time)
-
-    # Employees busy on the exact slot
-    busy_ids: set[int] = set(
-        s.employee_id
-        for s in _current_schedule
-        if s.date == shift.date and s.start_time == shift.start_time and s.end_time == shift.end_time
-    )
-
-    # Build set of per-employee same-day assignments and neighbor-day assignments
-    same_day_map: Dict[int, List[str]] = {}
-    prev_day_map: Dict[int, List[str]] = {}
-    next_day_map: Dict[int, List[str]] = {}
-    for s in _current_schedule:
-        if s.date == shift.date:
-            same_day_map.setdefault(s.employee_id, []).append(start_str(s.start_time))
-        if s.date == shift.date - timedelta(days=1):
-            prev_day_map.setdefault(s.employee_id, []).append(start_str(s.start_time))
-        if s.date == shift.date + timedelta(days=1):
-            next_day_map.setdefault(s.employee_id, []).append(start_str(s.start_time))
-
-    # Define consecutive neighbors relative to target_start
-    # Sequences: 00:00 -> 08:00 -> 16:00 -> 00:00(next day)
-    prev_same_day = {"08:00": "00:00", "16:00": "08:00", "00:00": None}.get(target_start)
-    next_same_day = {"08:00": "16:00", "16:00": None, "00:00": "08:00"}.get(target_start)
-    prev_prev_day = {"08:00": None, "16:00": None, "00:00": "16:00"}.get(target_start)
-    next_next_day = {"08:00": None, "16:00": "00:00", "00:00": None}.get(target_start)
-
-    def violates_consecutive(emp_id: int) -> bool:
-        # same day any assignment disqualifies (avoid double booking)
-        if emp_id in same_day_map and same_day_map[emp_id]:
-            return True
-        # consecutive previous on same day
-        if prev_same_day and prev_same_day in same_day_map.get(emp_id, []):
-            return True
-        # consecutive next on same day
-        if next_same_day and next_same_day in same_day_map.get(emp_id, []):
-            return True
-        # previous day late -> today 00:00
-        if prev_prev_day and prev_prev_day in prev_day_map.get(emp_id, []):
-            return True
-        # today 16:00 -> next day 00:00
-        if next_next_day and next_next_day in next_day_map.get(emp_id, []):
-            return True
-        return False
-
-    candidates: List[Dict[str, Any]] = []
-    for e in employees_master():
-        emp_id = e.get("id")
-        if emp_id is None:
-            continue
-        if emp_id in exclude_ids:
-            continue
-        if emp_id in busy_ids:
-            continue
-        if violates_consecutive(emp_id):
-            continue
-        w = weekly_count(emp_id, shift.date)
-        candidates.append({
-            "employee_id": emp_id,
-            "name": e.get("name"),
-            "score": float(w),
-            "reasons": [f"week_shifts={w}"],
-        })
+    return candidate_engine().suggest(shift, max_candidates, exclude_ids or [])
 
-    candidates.sort(key=lambda x: (x["score"], x["employee_id"]))
-    return candidates[:max_candidates]
+def suggest_replacements_many(shifts: List[Shift], max_candidates: int = 3, exclude_ids: List[List[int]] | None = None) -> List[List[Dict[str, Any]]]:
+    """suggest_replacements_for を複数の枠についてまとめて行う"""
+    return candidate_engine().suggest_many(shifts, max_candidates, exclude_ids)
 
 def apply_deltas_on_copy(base: List[Shift], deltas: List[ChangeDelta]) -> Tuple[List[Shift], List[Shift], List[Shift], List[ShiftUpdatePair]]:
     new_list = [Shift(**s.dict()) for s in base]
@@ -258,46 +411,177 @@ def apply_deltas_on_copy(base: List[Shift], deltas: List[ChangeDelta]) -> Tuple[
     return new_list, added, removed, updated
 
 def apply_change_set(cs: ChangeSet) -> bool:
-    global _current_schedule, _schedule_version
-    base = current_schedule_copy()
-    new_list, _, _, _ = apply_deltas_on_copy(base, cs.deltas)
-    _current_schedule = new_list
-    _schedule_version += 1
+    days = [s.date for d in cs.deltas for s in (d.before, d.after) if s is not None]
+    with schedule_transaction(days=days) as table:
+        for d in cs.deltas:
+            if d.kind == "replace" and d.before and d.after:
+                i = table.find(d.before.employee_id, d.before.date, d.before.start_time, d.before.end_time)
+                if i is not None:
+                    table.replace(i, d.after)
     add_audit("admin", "adjustments.apply", {"change_set_id": cs.id})
     publish_schedule_updated(cs)
     return True
 
 def rollback_change_set(change_set_id: str) -> bool:
-    global _schedule_version
-    _schedule_version += 1
+    with shared_write(), _commit_lock:
+        _commit_schedule(_current_schedule)
     add_audit("admin", "adjustments.rollback", {"change_set_id": change_set_id})
+    publish_schedule_updated()
     return True
-def subscribe_queue() -> "asyncio.Queue[Dict[str, Any]]":
-    q: asyncio.Queue = asyncio.Queue()
-    _ws_queues.append(q)
-    return q
+def subscribe_queue() -> Subscriber:
+    return _hub.subscribe()
 
-def unsubscribe_queue(q: "asyncio.Queue[Dict[str, Any]]"):
-    try:
-        _ws_queues.remove(q)
-    except ValueError:
-        pass
+def unsubscribe_queue(q: Subscriber):
+    _hub.unsubscribe(q)
 
+def broadcast_stats() -> Dict[str, int]:
+    return _hub.stats()
 
+def _deliver_remote(msg: Dict[str, Any]):
+    """イベントバスのスレッドから呼ばれる（このワーカーの購読者にだけ配る）"""
+    _hub.publish(msg)
 
+def _broadcast(msg: Dict[str, Any]):
+    _hub.publish(msg)
+    if _bus is not None:
+        _bus.publish(msg)
 
 def publish_proposals_ready(cs: ChangeSet):
-    msg = {"type": "proposals_ready", "change_set": cs.dict()}
-    for q in list(_ws_queues):
-        try:
-            q.put_nowait(msg)
-        except Exception:
-            continue
+    _broadcast({"type": "proposals_ready", "change_set": cs.model_dump(mode="json")})
 
-def publish_schedule_updated(cs: ChangeSet):
-    msg = {"type": "schedule.updated", "schedule_version": _schedule_version, "change_set_id": cs.id}
-    for q in list(_ws_queues):
-        try:
-            q.put_nowait(msg)
-        except Exception:
+def _delta_rows(recs: List[Any]) -> List[Dict[str, Any]]:
+    out = ScheduleTable.from_rows(Shift, np.array(recs, dtype=_current_schedule.rows.dtype)).to_dicts()
+    for row in out:
+        for k in ("date", "start_time", "end_time"):
+            row[k] = row[k].isoformat()
+    return out
+
+def _compact_delta(changes: Dict[str, List[Any]] | None) -> Dict[str, Any] | None:
+    """schedule_changes_since の結果をイベント用に縮める（removed は id だけ、updated は変更後の行だけ）"""
+    if changes is None:
+        return None
+    if len(changes["added"]) + len(changes["removed"]) + len(changes["updated"]) > WS_DELTA_MAX_ROWS:
+        return None
+    return {
+        "added": _delta_rows(changes["added"]),
+        "removed": [rec[0] for rec in changes["removed"]],
+        "updated": _delta_rows([a for _, a in changes["updated"]]),
+    }
+
+def publish_schedule_updated(cs: ChangeSet | None = None):
+    """schedule.updated を配る
+
+    base_version から schedule_version への差分を delta に載せる（大きすぎる・履歴から追えない時は null）。
+    クライアントは手元のバージョンが base_version と一致すれば delta を当て、
+    そうでなければ /api/shifts/changes?since=<手元のバージョン> で取り直す。
+    warnings には前回のイベント以降に出た警告（added）と解消した警告（resolved）を載せる。
+    null の時（未送信のイベントをまとめた時）は /api/shifts/warnings で取り直す。
+    """
+    global _published_version
+    with _commit_lock:
+        version = _schedule_version
+        base = min(_published_version, version)
+        _published_version = version
+        delta = _compact_delta(schedule_changes_since(base)[1]) if WS_DELTA_MAX_ROWS > 0 else None
+        _sync_warnings()
+        warnings = _warnings.take_delta()
+    _broadcast({
+        "type": "schedule.updated",
+        "schedule_version": version,
+        "base_version": base,
+        "change_set_id": cs.id if cs else None,
+        "delta": delta,
+        "warnings": warnings,
+    })
+
+def shared_state_enabled() -> bool:
+    return _shared is not None
+
+def shared_token() -> str | None:
+    return _shared.token if _shared is not None else None
+
+def on_state_change(fn: Callable[[str, Any, int], None]):
+    """(name, payload, version) で呼ばれる。schedule はコミットの度、それ以外は他ワーカーの書き込みを取り込んだ時"""
+    _state_listeners.append(fn)
+
+def enable_shared_state(directory: str | Path, seed: Dict[str, Callable[[], Any]] | None = None):
+    """複数ワーカー用の共有モードを有効にする
+
+    directory に state.db（SQLite）とイベントバスのソケットを置く。共有側に無いドキュメントは
+    このプロセスの現在値（seed）で初期化し、既にあればそちらを取り込む。
+    """
+    global _shared, _bus
+    path = Path(directory)
+    path.mkdir(parents=True, exist_ok=True)
+    _shared = SharedState(path / "state.db")
+    _bus = EventBus(path / "bus", _deliver_remote)
+    with _shared.transaction():
+        existing = _shared.versions()
+        if "schedule" not in existing:
+            _shared.store("schedule", _schedule_version, pack_schedule(_current_schedule))
+        for name, build in (seed or {}).items():
+            if name not in existing:
+                _shared.store(name, 1, json.dumps(build(), ensure_ascii=False).encode("utf-8"))
+    refresh_shared_state(force=True)
+
+def disable_shared_state():
+    global _shared, _bus
+    if _bus is not None:
+        _bus.close()
+    if _shared is not None:
+        _shared.close()
+    _shared = None
+    _bus = None
+    _shared_seen.clear()
+
+def refresh_shared_state(force: bool = False):
+    """他ワーカーが更新していれば取り込む。更新が無ければ PRAGMA 1 回で返る"""
+    if _shared is None or not (_shared.changed() or force):
+        return
+    for name, version in _shared.versions().items():
+        if _shared_seen.get(name) == version:
             continue
+        loaded = _shared.load(name)
+        if loaded is None:
+            continue
+        version, body = loaded
+        _shared_seen[name] = version
+        if name == "schedule":
+            _adopt_schedule(unpack_schedule(Shift, body), version)
+        elif name.startswith(TABLE_DOC):
+            _notify(name, unpack_schedule(Shift, body), version)
+        else:
+            _notify(name, json.loads(body), version)
+
+def shared_write():
+    """共有モードではプロセス間の書き込みロックを取り、最新状態を取り込んでから本体を実行する
+
+    ブロック内で await しないこと（同一スレッドのコルーチンからは再入できてしまう）。
+    """
+    if _shared is None:
+        return nullcontext()
+    return _shared_write()
+
+@contextmanager
+def _shared_write():
+    with _shared.transaction():
+        refresh_shared_state(force=True)
+        yield
+
+def share_document(name: str, payload: Any) -> int | None:
+    """JSON ドキュメントを共有側へ書き込み、新しいバージョンを返す（共有モードでなければ None）"""
+    return _share(name, json.dumps(payload, ensure_ascii=False).encode("utf-8"))
+
+def share_table(name: str, table: ScheduleTable) -> int | None:
+    """列指向テーブルを共有側へ書き込む。name は TABLE_DOC で始めること（他ワーカーでは ScheduleTable として届く）"""
+    assert name.startswith(TABLE_DOC), name
+    return _share(name, pack_schedule(table))
+
+def _share(name: str, body: bytes) -> int | None:
+    if _shared is None:
+        return None
+    with _shared.transaction():
+        version = (_shared.version(name) or 0) + 1
+        _shared.store(name, version, body)
+    _shared_seen[name] = version
+    return version
@@ -0,0 +1,70 @@
+"""シフト保持のメモリ比較ベンチマーク
+
+pydantic Shift のリストと ScheduleTable（列指向）で同じ計画を保持した時の使用メモリを比較する。
+
+    cd hokkoku_backend && python -m benchmarks.bench_schedule_memory --employees 1000 --days 90
+"""
+import argparse
+import gc
+import time as _time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+from app.main import Shift
+from app.services.schedule_table import ScheduleTable, SLOT_IDS, slot_times
+
+
+def build_plan(employees: int, days: int, slots: int) -> list:
+    start = date(2025, 1, 6)
+    now = datetime.now()
+    out = []
+    sid = 1
+    for d in range(days):
+        day = start + timedelta(days=d)
+        for emp in range(1, employees + 1):
+            for k in range(slots):
+                st, et = slot_times((emp + d + k) % len(SLOT_IDS))
+                out.append(Shift(id=sid, employee_id=emp, date=day, start_time=st, end_time=et, created_at=now, updated_at=now))
+                sid += 1
+    return out
+
+
+def measure(fn):
+    """(結果, 確保バイト数, 経過秒) を返す。時間は tracemalloc を外して別途計測する"""
+    gc.collect()
+    t0 = _time.perf_counter()
+    fn()
+    elapsed = _time.perf_counter() - t0
+    gc.collect()
+    tracemalloc.start()
+    obj = fn()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return obj, size, elapsed
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--employees", type=int, default=1000)
+    ap.add_argument("--days", type=int, default=90)
+    ap.add_argument("--slots", type=int, default=1, help="1日あたりの1人の枠数")
+    args = ap.parse_args()
+
+    shifts, list_bytes, list_s = measure(lambda: build_plan(args.employees, args.days, args.slots))
+    table, table_bytes, table_s = measure(lambda: ScheduleTable.from_shifts(Shift, shifts))
+    week = shifts[0].date, shifts[0].date + timedelta(days=6)
+    _, snap_list_bytes, _ = measure(lambda: [Shift(**s.model_dump()) for s in shifts if week[0] <= s.date <= week[1]])
+    _, snap_table_bytes, _ = measure(lambda: table.between(*week))
+    _, _, materialize_s = measure(lambda: table.to_shifts())
+
+    n = len(shifts)
+    print(f"assignments: {n:,}")
+    print(f"List[Shift]      : {list_bytes / 2**20:8.1f} MiB ({list_bytes / n:6.0f} B/row) build {list_s:.2f}s")
+    print(f"ScheduleTable    : {table_bytes / 2**20:8.1f} MiB ({table_bytes / n:6.0f} B/row) build {table_s:.2f}s")
+    print(f"week snapshot    : list {snap_list_bytes / 2**20:.1f} MiB -> table {snap_table_bytes / 2**20:.2f} MiB")
+    print(f"reduction        : {list_bytes / max(table_bytes, 1):.0f}x")
+    print(f"materialize all  : {materialize_s:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""validate_shift_constraints のベンチマーク
+
+置き換え前のループ実装（validate_loop としてここに残す）と、services/shift_validation の配列実装を
+同じランダムな計画で比べ、警告が一致することも確かめる。
+
+    cd hokkoku_backend && python -m benchmarks.bench_validation --employees 1000 --days 90
+"""
+import argparse
+import random
+import time as _time
+from datetime import date, timedelta
+from typing import List
+
+from app.main import Employee, Shift, ShiftValidationWarning, validate_shift_constraints
+from app.services.schedule_table import ScheduleTable, SLOT_IDS, slot_times
+
+
+def is_consecutive_timeslot(prev_time: str, current_time: str) -> bool:
+    """連続する時間枠かどうかを判定"""
+    if prev_time == "08:00" and current_time == "16:00":
+        return True
+    elif prev_time == "16:00" and current_time == "00:00":
+        return True
+    elif prev_time == "00:00" and current_time == "08:00":
+        return True
+    return False
+
+def validate_loop(shifts: List[Shift], employees: List[Employee]) -> List[ShiftValidationWarning]:
+    """置き換え前の validate_shift_constraints（そのまま）"""
+    warnings = []
+    employee_name_map = {emp.id: emp.name for emp in employees}
+    
+    employee_shifts = {}
+    daily_shifts = {}
+    
+    for shift in shifts:
+        if shift.employee_id not in employee_shifts:
+            employee_shifts[shift.employee_id] = []
+        employee_shifts[shift.employee_id].append(shift)
+        
+        if shift.date not in daily_shifts:
+            daily_shifts[shift.date] = []
+        daily_shifts[shift.date].append(shift)
+    
+    consecutive_timeslot_employees = []
+    consecutive_timeslot_data = {}
+    
+    for employee_id, emp_shifts in employee_shifts.items():
+        emp_shifts.sort(key=lambda x: (x.date, x.start_time))
+        consecutive_slots = 1
+        warning_added_for_period = False
+        consecutive_periods = [(emp_shifts[0].date, emp_shifts[0].start_time.strftime("%H:%M"))] if emp_shifts else []
+        
+        for i in range(1, len(emp_shifts)):
+            current_shift = emp_shifts[i]
+            prev_shift = emp_shifts[i-1]
+            
+            prev_time_str = prev_shift.start_time.strftime("%H:%M")
+            current_time_str = current_shift.start_time.strftime("%H:%M")
+            
+            if (current_shift.date == prev_shift.date and 
+                is_consecutive_timeslot(prev_time_str, current_time_str)) or \
+               (current_shift.date == prev_shift.date + timedelta(days=1) and 
+                prev_time_str == "16:00" and current_time_str == "00:00") or \
+               (current_shift.date == prev_shift.date + timedelta(days=1) and 
+                prev_time_str == "00:00" and current_time_str == "08:00"):
+                consecutive_slots += 1
+                consecutive_periods.append((current_shift.date, current_time_str))
+                if consecutive_slots > 2 and not warning_added_for_period:
+                    employee_name = employee_name_map.get(employee_id, f"従業員ID{employee_id}")
+                    consecutive_timeslot_employees.append(f"{employee_name}(ID：{employee_id}番)")
+                    consecutive_timeslot_data[employee_id] = consecutive_periods.copy()
+                    warning_added_for_period = True
+            else:
+                consecutive_slots = 1
+                consecutive_periods = [(current_shift.date, current_time_str)]
+                warning_added_for_period = False
+    
+    if consecutive_timeslot_employees:
+        employee_list = "、".join(consecutive_timeslot_employees)
+        all_affected_employees = list(consecutive_timeslot_data.keys())
+        all_affected_dates = []
+        for periods in consecutive_timeslot_data.values():
+            all_affected_dates.extend([f"{d.strftime('%Y-%m-%d')}_{t}" for d, t in periods])
+        
+        warnings.append(ShiftValidationWarning(
+            type="consecutive_timeslots",
+            message=f"{employee_list}が連続する時間枠でシフトに入っています",
+            affected_employees=all_affected_employees,
+            affected_dates=list(set(all_affected_dates))
+        ))
+    
+    insufficient_staff_dates = []
+    skill_requirement_dates = []
+    
+    for shift_date, day_shifts in daily_shifts.items():
+        shift_counts = {}
+        for shift in day_shifts:
+            shift_type = f"{shift.start_time}-{shift.end_time}"
+            shift_counts[shift_type] = shift_counts.get(shift_type, 0) + 1
+        
+        for shift_type, count in shift_counts.items():
+            if count < 2:
+                date_str = shift_date.strftime("%Y-%m-%d")
+                if date_str not in insufficient_staff_dates:
+                    insufficient_staff_dates.append(date_str)
+    
+    employee_skill_map = {emp.id: emp.skill_level for emp in employees}
+    
+    for shift_date, day_shifts in daily_shifts.items():
+        max_skill = max([employee_skill_map.get(shift.employee_id, 1) for shift in day_shifts], default=1)
+        if max_skill < 3:
+            date_str = shift_date.strftime("%Y-%m-%d")
+            if date_str not in skill_requirement_dates:
+                skill_requirement_dates.append(date_str)
+    
+    if insufficient_staff_dates:
+        if len(insufficient_staff_dates) == 1:
+            date_display = insufficient_staff_dates[0]
+        else:
+            date_display = "、".join(insufficient_staff_dates)
+        
+        warnings.append(ShiftValidationWarning(
+            type="insufficient_staff",
+            message=f"{date_display}において人員が不足しています",
+            affected_dates=insufficient_staff_dates
+        ))
+    
+    if skill_requirement_dates:
+        if len(skill_requirement_dates) == 1:
+            date_display = skill_requirement_dates[0]
+        else:
+            date_display = "、".join(skill_requirement_dates)
+        
+        warnings.append(ShiftValidationWarning(
+            type="skill_requirement",
+            message=f"{date_display}においてスキルレベル3以上の従業員が不足しています",
+            affected_dates=skill_requirement_dates
+        ))
+    
+    return warnings
+
+
+def build(employees: int, days: int, seed: int):
+    """1 日 0〜2 枠のランダムな計画（同じ枠の重複もまれに混ぜる）"""
+    rnd = random.Random(seed)
+    start = date(2025, 1, 6)
+    staff = [Employee(id=i, name=f"従業員{i}", role="staff", skill_level=rnd.randint(1, 4)) for i in range(1, employees + 1)]
+    shifts = []
+    for d in range(days):
+        day = start + timedelta(days=d)
+        for emp in range(1, employees + 1):
+            for code in rnd.sample(range(len(SLOT_IDS)), rnd.choice([0, 1, 1, 2])):
+                st, et = slot_times(code)
+                shifts.append(Shift(employee_id=emp, date=day, start_time=st, end_time=et))
+                if rnd.random() < 0.001:
+                    shifts.append(Shift(employee_id=emp, date=day, start_time=st, end_time=et))
+    rnd.shuffle(shifts)
+    return shifts, staff
+
+
+def timed(fn, repeat: int):
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        t0 = _time.perf_counter()
+        out = fn()
+        best = min(best, _time.perf_counter() - t0)
+    return out, best
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--employees", type=int, default=1000)
+    ap.add_argument("--days", type=int, default=90)
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    shifts, staff = build(args.employees, args.days, args.seed)
+    table = ScheduleTable.from_shifts(Shift, shifts)
+    old, old_s = timed(lambda: validate_loop(shifts, staff), args.repeat)
+    new_list, list_s = timed(lambda: validate_shift_constraints(shifts, staff), args.repeat)
+    new_table, table_s = timed(lambda: validate_shift_constraints(table, staff), args.repeat)
+
+    expected = [w.model_dump() for w in old]
+    assert [w.model_dump() for w in new_list] == expected, "list 入力の結果が一致しません"
+    assert [w.model_dump() for w in new_table] == expected, "ScheduleTable 入力の結果が一致しません"
+
+    print(f"{len(shifts):,} shifts / {args.employees:,} employees / {args.days} days, warnings={[w.type for w in old]}")
+    print(f"  loop              : {old_s * 1000:8.1f} ms")
+    print(f"  vectorized (list) : {list_s * 1000:8.1f} ms  x{old_s / list_s:5.1f}")
+    print(f"  vectorized (table): {table_s * 1000:8.1f} ms  x{old_s / table_s:5.1f}")
+
+
+if __name__ == "__main__":
+    main()
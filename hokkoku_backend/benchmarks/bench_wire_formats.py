@@ -0,0 +1,94 @@
+"""ペイロード形式の比較ベンチマーク
+
+/api/shifts・/api/adjustments/preview・proposals_ready を、現在の JSON と
+compact JSON / MessagePack（services/wire.py）で符号化した時のバイト数と時間を比べる。
+
+    cd hokkoku_backend && python -m benchmarks.bench_wire_formats --employees 1000 --days 28
+"""
+import argparse
+import json
+import time as _time
+from datetime import timedelta
+
+from app import main as app_main
+from app.schemas import ChangeDelta, ChangeSet, SchedulePreviewResponse, Shift
+from app.services import wire
+from app.services.schedule_table import ScheduleTable
+
+from .bench_schedule_memory import build_plan
+
+
+def timed(fn, repeat: int):
+    best = float("inf")
+    out = None
+    for _ in range(repeat):
+        t0 = _time.perf_counter()
+        out = fn()
+        best = min(best, _time.perf_counter() - t0)
+    return out, best
+
+
+def report(label: str, cases, repeat: int) -> None:
+    print(label)
+    base = None
+    for name, fn in cases:
+        body, secs = timed(fn, repeat)
+        base = base or len(body)
+        print(f"  {name:<14}: {len(body):>12,} B ({len(body) / base:5.0%})  encode {secs * 1000:8.1f} ms")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--employees", type=int, default=1000)
+    ap.add_argument("--days", type=int, default=28)
+    ap.add_argument("--deltas", type=int, default=200, help="proposals_ready に載せる変更数")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    shifts = build_plan(args.employees, args.days, 1)
+    table = ScheduleTable.from_shifts(app_main.Shift, shifts)
+    formats = [("compact json", wire.COMPACT_JSON)]
+    if wire.msgpack is not None:
+        formats.append(("msgpack", wire.MSGPACK))
+    else:
+        print("(msgpack 未導入のため MessagePack は省略)")
+
+    report(
+        f"/api/shifts ({len(table):,} shifts)",
+        [("json", lambda: wire.encode(wire.JSON, {"shifts": table.to_dicts(), "total": len(table)}))]
+        + [(n, lambda m=m: wire.encode(m, {"shifts": wire.pack_rows(table.rows, timestamps=True), "total": len(table)})) for n, m in formats],
+        args.repeat,
+    )
+
+    start = shifts[0].date
+    week = [Shift(**s.model_dump(exclude={"created_at", "updated_at"})) for s in shifts if s.date <= start + timedelta(days=6)]
+    deltas = [
+        ChangeDelta(kind="replace", before=s, after=s.model_copy(update={"employee_id": s.employee_id + 1}))
+        for s in week[: args.deltas]
+    ]
+    cs = ChangeSet(id="bench", created_at="", rule={"type": "pair_not_together"}, deltas=deltas,
+                   week_start=start.isoformat(), week_end=(start + timedelta(days=6)).isoformat(), schedule_version=1)
+    preview = SchedulePreviewResponse(
+        week_start=start, week_end=start + timedelta(days=6), shifts=week,
+        added=[], removed=[], updated=[{"before": d.before, "after": d.after} for d in deltas], change_set=cs,
+    )
+    report(
+        f"/api/adjustments/preview ({len(week):,} shifts)",
+        # response_model の直列化と同じく model_dump(mode="json") を経由する
+        [("json", lambda: json.dumps(preview.model_dump(mode="json")).encode())]
+        + [(n, lambda m=m: wire.encode(m, wire.pack_preview(preview))) for n, m in formats],
+        args.repeat,
+    )
+
+    msg = {"type": "proposals_ready", "change_set": cs.model_dump(mode="json")}
+    # WebSocket.send_json と同じく json.dumps
+    report(
+        f"proposals_ready ({len(deltas):,} deltas)",
+        [("json", lambda: json.dumps(msg).encode())]
+        + [(n, lambda m=m: wire.encode(m, wire.pack_message(msg))) for n, m in formats],
+        args.repeat,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""テスト用の OpenAI 互換サーバー（POST /chat/completions のみ）
+
+stream=true なら応答を chunk_size 文字ずつ SSE（chat.completion.chunk）で、delay 秒おきに返す。
+replies に入れた本文を順に返し（尽きたら最後のものを繰り返す）、受けたリクエストを requests に残す。
+stream=false の応答には usage（prompt 10、completion は本文の文字数）を付ける。
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List
+
+
+class FakeOpenAI:
+    def __init__(self, replies: List[str], chunk_size: int = 4, delay: float = 0.0):
+        self.replies = list(replies)
+        self.chunk_size = chunk_size
+        self.delay = delay
+        self.requests: List[Dict[str, Any]] = []
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def __enter__(self) -> "FakeOpenAI":
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _next_reply(self) -> str:
+        return self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                fake.requests.append(body)
+                text = fake._next_reply()
+                base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model", "fake")}
+                if not body.get("stream"):
+                    payload = json.dumps(dict(base, object="chat.completion", choices=[{
+                        "index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text},
+                    }], usage={"prompt_tokens": 10, "completion_tokens": len(text), "total_tokens": 10 + len(text)})).encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                pieces = [text[i:i + fake.chunk_size] for i in range(0, len(text), fake.chunk_size)]
+                for i, piece in enumerate(pieces):
+                    delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+                    self._event(dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": delta, "finish_reason": None}]))
+                    time.sleep(fake.delay)
+                self._event(dict(base, object="chat.completion.chunk", choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+                self.wfile.write(b"data: [DONE]\n\n")
+                self.wfile.flush()
+                self.close_connection = True
+
+            def _event(self, obj):
+                self.wfile.write(f"data: {json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+        return Handler
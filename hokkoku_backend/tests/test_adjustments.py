@@ -0,0 +1,99 @@
+from datetime import date, time, timedelta
+
+import pytest
+
+from app import store
+from app.schemas import Shift
+from app.services import adjustments
+
+MON = date(2025, 8, 4)
+EMPLOYEES = [{"id": i, "name": f"従業員{i}"} for i in range(1, 7)]
+
+@pytest.fixture(autouse=True)
+def schedule():
+    saved = store.employees_master()
+    store.set_employees_cache(EMPLOYEES)
+    yield
+    store.set_current_schedule([])
+    store.set_employees_cache(saved)
+
+def _shift(emp, day, start, end):
+    return Shift(id=None, employee_id=emp, date=MON + timedelta(days=day), start_time=time(start), end_time=time(end))
+
+def test_pair_not_together_plans_respect_rest_rules(capsys):
+    store.set_current_schedule([
+        _shift(1, 0, 16, 0), _shift(2, 0, 16, 0),   # 月: 1 と 2 が同じ遅番
+        _shift(1, 1, 0, 8), _shift(2, 1, 8, 16),    # 火: 同じ日
+        _shift(3, 0, 8, 16), _shift(3, 2, 8, 16),   # 3 は負荷高め
+        _shift(4, 1, 16, 0),                        # 4 は火曜に入っている
+        _shift(5, 2, 0, 8),                         # 5 は水曜夜勤（火曜遅番 -> 不可）
+    ])
+    cs, preview = adjustments.generate_preview({"type": "pair_not_together", "a_employee_id": 1, "b_employee_id": 2}, MON.isoformat())
+    assert "DEBUG" not in capsys.readouterr().out
+
+    plans = [cs, *preview.alternatives]
+    assert len(plans) == 3
+    assert [p.score for p in plans] == sorted(p.score for p in plans)
+    assert len({tuple((d.before.date, d.after.employee_id) for d in p.deltas) for p in plans}) == 3
+    for p in plans:
+        assert len(p.deltas) == 2
+        by_day = {d.before.date: d for d in p.deltas}
+        assert all(d.before.employee_id == 2 and d.after.employee_id not in (1, 2) for d in p.deltas)
+        assert by_day[MON + timedelta(days=1)].after.employee_id != 4
+        # 同じ人を月曜遅番 -> 火曜の 2 件に入れない（同日 or 連続）
+        assert by_day[MON].after.employee_id != by_day[MON + timedelta(days=1)].after.employee_id
+    # 最良案: 変更 2 件（b 側）+ 負荷 0 の 6 と負荷 1 の 4 か 5
+    assert cs.score == 21
+    assert 6 in {d.after.employee_id for d in cs.deltas}
+
+def test_preview_cache_reuses_change_set_until_schedule_changes():
+    from fastapi.testclient import TestClient
+    from app import main
+
+    # shift-adjust は今週を対象にする
+    monday = date.today() - timedelta(days=date.today().weekday())
+    store.set_current_schedule([
+        Shift(employee_id=e, date=monday, start_time=time(8), end_time=time(16)) for e in (1, 2)
+    ])
+    rule = {"type": "pair_not_together", "a_employee_id": 1, "b_employee_id": 2}
+    q = store.subscribe_queue()
+    try:
+        first, _ = adjustments.generate_preview(rule, monday.isoformat())
+        again, _ = adjustments.generate_preview(dict(reversed(list(rule.items()))), (monday + timedelta(days=2)).isoformat())
+        assert again.id == first.id
+        assert q.qsize() == 1
+        # 返り値を書き換えても次のヒットには響かない
+        again.deltas.clear()
+        assert adjustments.generate_preview(rule, monday.isoformat())[0].deltas == first.deltas != []
+
+        client = TestClient(main.app)
+        body = {"adjustment_rule": rule, "apply_mode": "draft"}
+        draft = client.post("/api/adjustments/shift-adjust", json=body).json()
+        applied = client.post("/api/adjustments/shift-adjust", json=dict(body, apply_mode="immediate")).json()
+        assert applied["success"] and applied["adjustment_id"] == draft["adjustment_id"] == first.id
+
+        after, _ = adjustments.generate_preview(rule, monday.isoformat())
+        assert after.id != first.id and after.deltas == []
+        assert client.get("/api/adjustments/preview/stats").json()["hits"] >= 3
+    finally:
+        store.unsubscribe_queue(q)
+
+def test_redistribute_shifts_levels_week_with_fewest_moves():
+    # 1 は毎日遅番、2 は毎日夜勤、3〜6 は 0 件 → 14 件 / 6 人で 2〜3 件ずつにするには最低 8 件動かす
+    store.set_current_schedule(
+        [_shift(1, d, 16, 0) for d in range(7)] + [_shift(2, d, 0, 8) for d in range(7)]
+    )
+    cs, preview = adjustments.generate_preview({"type": "redistribute_shifts"}, MON.isoformat())
+
+    assert len(cs.deltas) == 8
+    load = {e["id"]: 0 for e in EMPLOYEES}
+    for s in preview.shifts:
+        load[s.employee_id] += 1
+    assert set(load.values()) <= {2, 3}
+
+    moved = {(d.after.employee_id, d.after.date): d.after.start_time for d in cs.deltas}
+    assert len(moved) == len(cs.deltas)     # 同じ人・同じ日に 2 件入れない
+    for (emp, day), start in moved.items():
+        assert emp not in (1, 2)
+        if start == time(16):
+            assert moved.get((emp, day + timedelta(days=1))) != time(0)
@@ -0,0 +1,39 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services.broadcast import BroadcastHub, SlowConsumer
+
+def test_schedule_updates_are_coalesced_and_slow_consumers_dropped():
+    hub = BroadcastHub(limit=3)
+    idle = hub.subscribe()
+    for v in range(1, 101):
+        hub.publish({"type": "schedule.updated", "schedule_version": v})
+    assert idle.qsize() == 1
+    assert idle.get_nowait()["schedule_version"] == 100
+
+    hub.publish({"type": "schedule.updated", "schedule_version": 101})
+    for n in range(3):
+        hub.publish({"type": "proposals_ready", "n": n})
+    assert idle.closed
+    assert idle.qsize() == 0
+    with pytest.raises(SlowConsumer):
+        asyncio.run(idle.get())
+    stats = hub.stats()
+    assert stats["subscribers"] == 0
+    assert stats["slow_disconnects"] == 1
+    assert stats["coalesced"] == 99
+
+def test_publish_from_other_thread_wakes_loop_subscriber():
+    hub = BroadcastHub()
+
+    async def main():
+        sub = hub.subscribe()
+        t = threading.Thread(target=hub.publish, args=({"type": "proposals_ready"},))
+        t.start()
+        msg = await asyncio.wait_for(sub.get(), timeout=2)
+        t.join()
+        return msg
+
+    assert asyncio.run(main()) == {"type": "proposals_ready"}
@@ -0,0 +1,52 @@
+from datetime import date, time
+
+from app.schemas import Shift
+from app.services.candidates import CandidateEngine, parse_scoring
+from app.services.schedule_table import ScheduleTable
+
+MON = date(2025, 8, 4)
+EMPLOYEES = [
+    {"id": 1, "name": "A", "role": "staff", "skill_level": 3},
+    {"id": 2, "name": "B", "role": "staff", "skill_level": 1},
+    {"id": 3, "name": "C", "role": "manager", "skill_level": 3},
+    {"id": 4, "name": "D", "role": "staff", "skill_level": 3},
+    {"id": 5, "name": "E", "role": "staff", "skill_level": 2},
+]
+
+def _shift(emp, d, start, end):
+    return Shift(employee_id=emp, date=date(2025, 8, d), start_time=time(start), end_time=time(end))
+
+def _table():
+    return ScheduleTable.from_shifts(Shift, [
+        _shift(1, 5, 8, 16),   # 対象（火曜 日勤）
+        _shift(2, 5, 16, 0),   # 同じ日に入っている
+        _shift(3, 4, 8, 16),
+        _shift(3, 6, 8, 16),   # 週 2 回
+        _shift(4, 4, 16, 0),   # 月曜 遅番 -> 火曜 夜勤には入れない
+        _shift(5, 6, 0, 8),    # 水曜 夜勤 -> 火曜 遅番には入れない
+    ])
+
+def test_eligibility_and_weekly_load_ranking():
+    engine = CandidateEngine(_table(), EMPLOYEES)
+    day = engine.suggest(_shift(1, 5, 8, 16), max_candidates=5, exclude_ids=[1])
+    assert [c["employee_id"] for c in day] == [4, 5, 3]
+    assert day[-1]["reasons"] == ["week_shifts=2"]
+
+    night, late = engine.suggest_many([_shift(1, 5, 0, 8), _shift(1, 5, 16, 0)], max_candidates=5, exclude_ids=[[1], [1]])
+    assert 4 not in [c["employee_id"] for c in night] and 5 in [c["employee_id"] for c in night]
+    assert 5 not in [c["employee_id"] for c in late] and 4 in [c["employee_id"] for c in late]
+
+def test_pluggable_scoring_and_top_k():
+    engine = CandidateEngine(_table(), EMPLOYEES, parse_scoring("weekly_load:1,skill:1,role_balance:10"))
+    best = engine.suggest(_shift(1, 5, 8, 16), max_candidates=2, exclude_ids=[1])
+    # 4: 負荷 1 / スキル差 0、5: 負荷 1 / スキル差 1、3: 役割違い
+    assert [c["employee_id"] for c in best] == [4, 5]
+    assert best[1]["reasons"] == ["week_shifts=1", "skill_gap=1", "role_mismatch=0"]
+
+def test_week_with_only_unknown_employees():
+    # CSV で従業員マスタを入れ替えた後など、週の行がすべてマスタに無い ID
+    table = ScheduleTable.from_shifts(Shift, [_shift(901, 5, 8, 16), _shift(902, 6, 16, 0)])
+    engine = CandidateEngine(table, EMPLOYEES)
+    got = engine.suggest(_shift(901, 5, 8, 16), max_candidates=5, exclude_ids=[901])
+    assert sorted(c["employee_id"] for c in got) == [1, 2, 3, 4, 5]
+    assert all(c["reasons"] == ["week_shifts=0"] for c in got)
@@ -24,9 +24,9 @@ def app_client():
     return TestClient(app)
 
 def test_create_session_and_qa_flow(monkeypatch, app_client: TestClient):
-    def fake_detect(content, ctx):
+    async def fake_detect(content, ctx, budget=None):
         return {"intent": "qa", "confidence": 0.5}
-    def fake_qa(content, ctx):
+    async def fake_qa(content, ctx, budget=None):
         return "QA回答です"
     monkeypatch.setattr(openai_client, "detect_intent", fake_detect)
     monkeypatch.setattr(openai_client, "generate_qa", fake_qa)
@@ -42,9 +42,9 @@ def test_create_session_and_qa_flow(monkeypatch, app_client: TestClient):
     assert j["assistant_text"] == "QA回答です"
 
 def test_apply_flow_with_validation_and_diff(monkeypatch, app_client: TestClient):
-    def fake_detect(content, ctx):
+    async def fake_detect(content, ctx, budget=None):
         return {"intent": "apply", "confidence": 0.9}
-    def fake_apply(content, ctx):
+    async def fake_apply(content, ctx, budget=None):
         return {"assistant_text": "適用案", "json": {"type": "patch", "patch": [{"op": "replace", "path": "/min_staff_weekend", "value": 2}]}}
     monkeypatch.setattr(openai_client, "detect_intent", fake_detect)
     monkeypatch.setattr(openai_client, "generate_apply", fake_apply)
@@ -74,3 +74,133 @@ def test_constraints_validate_and_apply_rbac(app_client: TestClient):
 
     immediate_admin = app_client.post("/api/constraints/apply", headers={"X-Role": "admin"}, json={"constraints_json": {"min_staff_weekend": 2}, "apply_mode": "immediate"})
     assert immediate_admin.status_code == 200
+
+def test_apply_flow_stops_at_retry_budget(monkeypatch, app_client: TestClient):
+    import asyncio
+    from app.services import llm_gateway, llm_budget
+    from app.services.llm_cache import LLMCache
+
+    calls = []
+
+    async def timing_out(messages, **kwargs):
+        calls.append(kwargs["timeout"])
+        raise asyncio.TimeoutError()
+
+    monkeypatch.setattr(openai_client, "_cache", LLMCache(None))
+    monkeypatch.setattr(llm_gateway, "available", lambda api_key=None: True)
+    monkeypatch.setattr(llm_gateway, "chat", timing_out)
+    monkeypatch.setattr(llm_budget, "LLM_BACKOFF_BASE_MS", 0)
+    monkeypatch.setattr(llm_budget, "LLM_MAX_ATTEMPTS", 2)
+
+    sid = app_client.post("/api/llm/sessions", json={}).json()["session_id"]
+    r = app_client.post(f"/api/llm/sessions/{sid}/messages", json={"content": "週末最小+1", "mode": "apply"})
+    assert r.status_code == 200
+    j = r.json()
+    # 入れ子の再生成（3 回 × (MAX_REPROMPTS + 1)）ではなく、予算の 2 回で止まる
+    assert len(calls) == 2
+    assert j["validation"]["ok"] is False
+    assert j["draft_constraints"] is None
+    assert "試行回数の上限" in j["assistant_text"] and "タイムアウト" in j["assistant_text"]
+
+def test_ws_streams_deltas_and_draft_before_done(monkeypatch, app_client: TestClient):
+    from app.services import llm_gateway
+    from app.services.llm_cache import LLMCache
+    from tests.fake_openai_server import FakeOpenAI
+
+    reply = '週末の最小人員を2にします。{"type": "patch", "patch": [{"op": "replace", "path": "/min_staff_weekend", "value": 2}]} 以上です。'
+    monkeypatch.setattr(openai_client, "_cache", LLMCache(None))
+    monkeypatch.setattr(llm_gateway, "OPENAI_API_KEY", "test-key")
+    with FakeOpenAI([reply], chunk_size=5) as server:
+        monkeypatch.setattr(llm_gateway, "OPENAI_BASE_URL", server.base_url)
+        with app_client.websocket_connect("/api/llm/ws/llm/s1") as ws:
+            assert ws.receive_json()["type"] == "info"
+            ws.send_json({"content": "週末最小+1", "mode": "apply"})
+            events = []
+            while True:
+                ev = ws.receive_json()
+                events.append(ev)
+                if ev["type"] == "done":
+                    break
+    kinds = [e["type"] for e in events]
+    assert kinds[0] == "intent"
+    assert kinds.count("delta") > 5
+    # 下書きは JSON が閉じた直後（説明文の残りより先）に届く
+    draft = kinds.index("draft")
+    assert "delta" in kinds[draft + 1:-1]
+    assert events[draft]["draft_constraints"]["min_staff_weekend"] == 2
+    assert "".join(e["text"] for e in events if e["type"] == "delta") == reply
+    done = events[-1]
+    assert done["validation"]["ok"] is True and done["assistant_text"] == reply.strip()
+    assert server.requests[0]["stream"] is True
+
+def test_llm_metrics_record_outcomes_tokens_and_invalid_output(monkeypatch, app_client: TestClient):
+    import asyncio
+    from app.services import llm_gateway, llm_budget, llm_metrics
+    from app.services.llm_cache import LLMCache
+    from tests.fake_openai_server import FakeOpenAI
+
+    monkeypatch.setattr(openai_client, "_cache", LLMCache(None))
+    monkeypatch.setattr(llm_gateway, "OPENAI_API_KEY", "test-key")
+    monkeypatch.setattr(llm_budget, "LLM_BACKOFF_BASE_MS", 0)
+    llm_metrics.reset()
+
+    async def run():
+        out = await openai_client.generate_apply("週末最小+1", {"constraints": {}})
+        await llm_gateway.aclose()
+        return out
+
+    # 1 回目は JSON の無い応答 → 再プロンプトして 2 回目で通る
+    spec = '{"type": "patch", "patch": [{"op": "replace", "path": "/min_staff_weekend", "value": 2}]}'
+    with FakeOpenAI(["了解しました。", spec]) as server:
+        monkeypatch.setattr(llm_gateway, "OPENAI_BASE_URL", server.base_url)
+        out = asyncio.run(run())
+    assert "failed" not in out and len(server.requests) == 2
+
+    snap = app_client.get("/api/llm/metrics").json()
+    calls = {(c["op"], c["outcome"]): c["count"] for c in snap["calls"]}
+    assert calls[("apply", "ok")] == 2
+    latency = next(h for h in snap["latency_seconds"] if h["op"] == "apply")
+    assert latency["count"] == 2 and latency["buckets"]["+Inf"] == 2
+    tokens = {(t["op"], t["kind"]): t["count"] for t in snap["tokens"]}
+    assert tokens[("apply", "prompt")] == 20 and tokens[("apply", "completion")] == len("了解しました。") + len(spec)
+    counters = {(c["name"], c["op"]): c["count"] for c in snap["counters"]}
+    assert counters[("invalid_output", "apply")] == 1 and counters[("reprompt", "apply")] == 1
+    assert "gateway" in snap and "cache" in snap
+
+    text = app_client.get("/api/llm/metrics", params={"format": "prometheus"}).text
+    assert 'llm_calls_total{op="apply",model="' in text and 'outcome="ok"} 2' in text
+    assert 'llm_events_total{name="invalid_output",op="apply"} 1' in text
+    llm_metrics.reset()
+
+def test_malformed_patch_is_a_validation_error_not_a_crash(monkeypatch, app_client: TestClient):
+    import json
+    from app.services import llm_gateway
+    from app.services.llm_cache import LLMCache
+    from tests.fake_openai_server import FakeOpenAI
+
+    bad = {"type": "patch", "patch": {"op": "replace", "path": "/min_staff_weekend", "value": 2}}
+    good = {"type": "patch", "patch": [{"op": "replace", "path": "/min_staff_weekend", "value": 2}]}
+    replies = [bad, good]
+
+    async def fake_apply(content, ctx, budget=None):
+        return {"assistant_text": "案", "json": replies.pop(0)}
+
+    monkeypatch.setattr(openai_client, "generate_apply", fake_apply)
+    sid = app_client.post("/api/llm/sessions", json={}).json()["session_id"]
+    r = app_client.post(f"/api/llm/sessions/{sid}/messages", json={"content": "週末最小+1", "mode": "apply"})
+    assert r.status_code == 200
+    assert r.json()["validation"]["ok"] is True and replies == []
+
+    # ストリームでも同じく再生成に回り、WS は done まで届く
+    monkeypatch.setattr(openai_client, "_cache", LLMCache(None))
+    monkeypatch.setattr(llm_gateway, "OPENAI_API_KEY", "test-key")
+    with FakeOpenAI([json.dumps(bad), json.dumps(good)]) as server:
+        monkeypatch.setattr(llm_gateway, "OPENAI_BASE_URL", server.base_url)
+        with app_client.websocket_connect(f"/api/llm/ws/llm/{sid}") as ws:
+            assert ws.receive_json()["type"] == "info"
+            ws.send_json({"content": "週末最小+1", "mode": "apply"})
+            events = []
+            while not events or events[-1]["type"] != "done":
+                events.append(ws.receive_json())
+    assert "retry" in [e["type"] for e in events]
+    assert events[-1]["validation"]["ok"] is True
@@ -0,0 +1,36 @@
+from datetime import date, datetime, time
+
+from app.schemas import Shift
+from app.services.schedule_table import ScheduleTable
+
+def _shift(emp_id, d, start, end, sid=None):
+    return Shift(id=sid, employee_id=emp_id, date=d, start_time=start, end_time=end)
+
+def test_round_trip_and_find():
+    shifts = [
+        _shift(1, date(2025, 8, 4), time(8, 0), time(16, 0), sid=1),
+        _shift(2, date(2025, 8, 4), time(16, 0), time(0, 0), sid=2),
+        _shift(3, date(2025, 8, 12), time(9, 30), time(13, 0)),
+    ]
+    table = ScheduleTable.from_shifts(Shift, shifts)
+    assert len(table) == 3
+    assert [s.dict() for s in table.to_shifts()] == [s.dict() for s in shifts]
+    assert table.find(2, date(2025, 8, 4), time(16, 0), time(0, 0)) == 1
+    assert table.find(2, date(2025, 8, 4), time(8, 0), time(16, 0)) is None
+    assert table.find_id(2) == 1
+    assert len(table.between(date(2025, 8, 4), date(2025, 8, 10))) == 2
+
+def test_update_delete_and_timestamps():
+    from app.main import Shift as ApiShift
+    now = datetime(2025, 8, 1, 12, 30, 15, 123456)
+    table = ScheduleTable.from_shifts(ApiShift, [
+        ApiShift(id=i, employee_id=i, date=date(2025, 8, 4), start_time=time(8, 0), end_time=time(16, 0), created_at=now)
+        for i in range(1, 4)
+    ])
+    table.update(0, start_time=time(0, 0), end_time=time(8, 0), updated_at=now)
+    table.delete([1])
+    out = table.to_shifts()
+    assert [s.id for s in out] == [1, 3]
+    assert (out[0].start_time, out[0].end_time) == (time(0, 0), time(8, 0))
+    assert out[0].created_at == now and out[0].updated_at == now
+    assert out[1].updated_at is None
@@ -0,0 +1,110 @@
+import threading
+from datetime import date, time, timedelta
+
+import pytest
+
+from app import store
+from app.schemas import Shift
+
+MONDAY = date(2025, 8, 4)
+
+@pytest.fixture(autouse=True)
+def empty_schedule():
+    store.set_current_schedule([])
+    yield
+    store.set_current_schedule([])
+
+def _run(workers, fn):
+    threads = [threading.Thread(target=fn, args=(n,)) for n in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+def test_parallel_weeks_do_not_lose_updates():
+    v0 = store.schedule_version()
+
+    def writer(n):
+        d = MONDAY + timedelta(weeks=n % 4, days=n % 7)
+        for _ in range(25):
+            with store.schedule_transaction(days=[d]) as table:
+                table.append(Shift(id=table.allocate_id(), employee_id=n, date=d, start_time=time(8), end_time=time(16)))
+
+    _run(8, writer)
+    table = store.current_schedule_table()
+    ids = table.rows["id"].tolist()
+    assert len(ids) == len(set(ids)) == 200
+    assert store.schedule_version() == v0 + 200
+
+def test_same_week_read_modify_write_is_serialized():
+    store.set_current_schedule([Shift(id=1, employee_id=1, date=MONDAY, start_time=time(8), end_time=time(16), break_minutes=0)])
+
+    def bump(n):
+        for _ in range(50):
+            with store.schedule_transaction(ids=[1]) as table:
+                i = table.find_id(1)
+                table.update(i, break_minutes=int(table.rows["break_minutes"][i]) + 1)
+
+    _run(6, bump)
+    table = store.current_schedule_table()
+    assert int(table.rows["break_minutes"][table.find_id(1)]) == 300
+
+def test_writing_an_unlocked_week_is_rejected():
+    v0 = store.schedule_version()
+    with pytest.raises(RuntimeError):
+        with store.schedule_transaction(days=[MONDAY]) as table:
+            other = MONDAY + timedelta(weeks=1)
+            table.append(Shift(id=table.allocate_id(), employee_id=1, date=other, start_time=time(8), end_time=time(16)))
+    assert store.schedule_version() == v0
+    assert len(store.current_schedule_table()) == 0
+
+def test_changes_since_is_consistent_with_concurrent_commits():
+    v0 = store.schedule_version()
+    done = threading.Event()
+    errors = []
+
+    def reader():
+        try:
+            while not done.is_set():
+                version, changes = store.schedule_changes_since(v0)
+                # 版と差分は同じコミットの時点のもの（1 コミット = 1 行追加）
+                assert changes is not None and len(changes["added"]) == version - v0
+        except Exception as e:  # 走査中の deque の変更など
+            errors.append(e)
+
+    def writer(n):
+        d = MONDAY + timedelta(weeks=n)
+        for _ in range(50):
+            with store.schedule_transaction(days=[d]) as table:
+                table.append(Shift(id=table.allocate_id(), employee_id=n, date=d, start_time=time(8), end_time=time(16)))
+
+    t = threading.Thread(target=reader)
+    t.start()
+    _run(4, writer)
+    done.set()
+    t.join()
+    assert not errors
+    assert store.schedule_changes_since(v0)[0] == v0 + 200
+
+def test_commit_diffs_once_over_touched_days_only(monkeypatch):
+    store.set_current_schedule([
+        Shift(id=i + 1, employee_id=i % 5, date=MONDAY + timedelta(days=i % 28), start_time=time(8), end_time=time(16))
+        for i in range(280)
+    ])
+    calls = []
+    real = store.schedule_diff
+
+    def spy(old, new, days=None):
+        calls.append(None if days is None else sorted(days.tolist()))
+        return real(old, new, days)
+
+    monkeypatch.setattr(store, "schedule_diff", spy)
+    v0 = store.schedule_version()
+    moved_to = MONDAY + timedelta(days=1)
+    with store.schedule_transaction(days=[moved_to], ids=[1, 3]) as table:
+        table.delete([table.find_id(1)])
+        table.update(table.find_id(3), date=moved_to)
+    assert calls == [[MONDAY.toordinal(), moved_to.toordinal(), MONDAY.toordinal() + 2]]
+    _, changes = store.schedule_changes_since(v0)
+    assert [rec[0] for rec in changes["removed"]] == [1]
+    assert [(b[0], a[2]) for b, a in changes["updated"]] == [(3, moved_to.toordinal())]
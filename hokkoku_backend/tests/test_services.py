@@ -20,3 +20,278 @@ def test_materialize_patch_and_diff():
     assert after["min_staff_weekend"] == 3
     d = summarize_diff(base, after)
     assert "/min_staff_weekend" in d.changed_paths
+
+def test_compact_change_set_and_negotiation():
+    from datetime import date, time
+    from app.schemas import ChangeDelta, ChangeSet, Shift
+    from app.services import wire
+
+    assert wire.negotiate(None) == wire.JSON
+    assert wire.negotiate("text/html, application/vnd.hokkoku.compact+json") == wire.COMPACT_JSON
+    assert wire.negotiate("application/vnd.hokkoku.compact+json;q=0.2, application/json") == wire.JSON
+    assert wire.negotiate("msgpack") == wire.MSGPACK
+    assert wire.negotiate("application/json;q=0.5, application/msgpack") == wire.MSGPACK
+
+    s = Shift(id=7, employee_id=3, date=date(2025, 8, 5), start_time=time(16), end_time=time(0))
+    cs = ChangeSet(
+        id="cs1", created_at="now", rule={}, week_start="2025-08-04", week_end="2025-08-10", schedule_version=1,
+        deltas=[ChangeDelta(kind="replace", before=s, after=s.model_copy(update={"employee_id": 4})), ChangeDelta(kind="slide", after=s)],
+    )
+    packed = wire.pack_message({"type": "proposals_ready", "change_set": cs.model_dump(mode="json")})["change_set"]
+    d = packed["deltas"]
+    assert d["kind"] == ["replace", "slide"] and d["before"] == [0, -1] and d["after"] == [1, 2]
+    assert d["shifts"]["employee_id"] == [3, 4, 3] and d["shifts"]["slots"][d["shifts"]["slot"][0]] == "16:00-00:00"
+    assert packed["schedule_version"] == 1
+
+def test_validate_shift_constraints_vectorized():
+    from datetime import date, time
+    from app.main import Employee, Shift, validate_shift_constraints
+
+    def s(emp, d, h):
+        return Shift(employee_id=emp, date=d, start_time=time(h), end_time=time((h + 8) % 24))
+
+    mon, tue = date(2025, 8, 4), date(2025, 8, 5)
+    staff = [Employee(id=1, name="山田", role="staff", skill_level=2), Employee(id=2, name="佐藤", role="staff", skill_level=2)]
+    shifts = [
+        s(1, tue, 0),                                   # 火曜を先に渡す（日付は初出順）
+        s(1, mon, 16), s(1, mon, 0), s(1, mon, 8),      # 1: 月 00→08→16→火 00 の連続
+        s(2, mon, 0), s(2, mon, 8), s(2, mon, 8), s(2, mon, 16),  # 2: 08 の重複で連続が切れる
+    ]
+    warnings = [w.model_dump(exclude_none=True) for w in validate_shift_constraints(shifts, staff)]
+    consecutive, insufficient, skill = warnings
+    assert consecutive["message"] == "山田(ID：1番)が連続する時間枠でシフトに入っています"
+    assert consecutive["affected_employees"] == [1]
+    assert sorted(consecutive["affected_dates"]) == ["2025-08-04_00:00", "2025-08-04_08:00", "2025-08-04_16:00"]
+    assert insufficient == {"type": "insufficient_staff", "message": "2025-08-05において人員が不足しています", "affected_dates": ["2025-08-05"]}
+    assert skill["affected_dates"] == ["2025-08-05", "2025-08-04"]
+    assert skill["message"] == "2025-08-05、2025-08-04においてスキルレベル3以上の従業員が不足しています"
+
+
+def test_llm_gateway_bounds_concurrency(monkeypatch):
+    import asyncio
+    from types import SimpleNamespace
+    from app.services import llm_gateway
+
+    monkeypatch.setattr(llm_gateway, "LLM_CONCURRENCY", 2)
+    peak = {"now": 0, "max": 0}
+
+    async def create(**kwargs):
+        peak["now"] += 1
+        peak["max"] = max(peak["max"], peak["now"])
+        await asyncio.sleep(0.01)
+        peak["now"] -= 1
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=kwargs["model"]))])
+
+    fake = SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+    monkeypatch.setattr(llm_gateway, "client", lambda api_key=None: fake)
+
+    async def run():
+        calls = [llm_gateway.chat([{"role": "user", "content": "x"}], model=f"m{i}", max_tokens=1, timeout=1) for i in range(6)]
+        out = await asyncio.gather(*calls)
+        stats = llm_gateway.stats()
+        await llm_gateway.aclose()
+        return out, stats
+
+    out, stats = asyncio.run(run())
+    assert out == [f"m{i}" for i in range(6)]
+    assert peak["max"] == 2
+    assert stats["in_flight"] == 0 and stats["waiting"] == 0
+
+
+def test_llm_cache_ttl_lru_and_persistence(tmp_path, monkeypatch):
+    from app.services import llm_cache
+    from app.services.llm_cache import LLMCache, cache_key
+
+    assert cache_key("qa", "m", "s", "シフト  を教えて ") == cache_key("qa", "m", "s", "シフト を教えて")
+    assert cache_key("apply", "m", "s", "x", constraints={"a": 1}) != cache_key("apply", "m", "s", "x", constraints={"a": 2})
+
+    path = tmp_path / "llm.db"
+    cache = LLMCache(path, maxsize=2, ttl_s=60)
+    cache.put("a", {"intent": "qa"}, "intent")
+    cache.put("b", "answer", "qa")
+    cache.get("a")["intent"] = "changed"            # 返り値を書き換えてもキャッシュは変わらない
+    cache.put("c", "third", "qa")                   # b が最も古いので落ちる
+    assert cache.get("a") == {"intent": "qa"}
+    cache.flush()                                   # ファイルへの書き込みは別スレッド
+    assert LLMCache(path, maxsize=2, ttl_s=60).stats()["size"] == 2
+
+    now = llm_cache.time.time()
+    monkeypatch.setattr(llm_cache.time, "time", lambda: now + 61)
+    assert cache.get("a") is None
+    assert LLMCache(path, maxsize=2, ttl_s=60).stats()["size"] == 0
+
+
+def test_llm_cache_writes_behind_and_prunes_periodically(tmp_path, monkeypatch):
+    import threading
+    from app.services import llm_cache
+    from app.services.llm_cache import LLMCache
+
+    monkeypatch.setattr(llm_cache, "PRUNE_EVERY", 4)
+    path = tmp_path / "llm.db"
+    cache = LLMCache(path, maxsize=2, ttl_s=60)
+
+    # 書き込み中の SQLite を塞いでも put はメモリだけで返る
+    with cache._db_lock:
+        done = threading.Event()
+        threading.Thread(target=lambda: (cache.put("a", 1, "qa"), done.set())).start()
+        assert done.wait(2)
+        assert cache.get("a") == 1
+
+    for key in "bc":
+        cache.put(key, key, "qa")
+    cache.flush()
+    rows = lambda: cache._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+    assert rows() == 3                              # 3 件目ではまだ刈り込まない
+    cache.put("d", "d", "qa")
+    cache.flush()
+    assert rows() == 2
+
+
+def test_detect_intent_served_from_cache(monkeypatch):
+    import asyncio
+    from app.services import openai_client, llm_gateway
+    from app.services.llm_cache import LLMCache
+
+    calls = []
+
+    async def fake_chat(messages, **kwargs):
+        calls.append(messages)
+        return '{"intent": "adjust", "confidence": 0.9}'
+
+    monkeypatch.setattr(openai_client, "_cache", LLMCache(None, maxsize=8))
+    monkeypatch.setattr(llm_gateway, "available", lambda api_key=None: True)
+    monkeypatch.setattr(llm_gateway, "chat", fake_chat)
+
+    first = asyncio.run(openai_client.detect_intent("田中さんと佐藤さんを一緒にしない", {}))
+    second = asyncio.run(openai_client.detect_intent(" 田中さんと佐藤さんを一緒にしない\n", {}))
+    assert first == second == {"intent": "adjust", "confidence": 0.9}
+    assert len(calls) == 1
+    assert openai_client.cache_stats()["hits"] == 1
+
+
+def test_local_intent_classifier_skips_llm(monkeypatch):
+    import asyncio
+    from app.services import intent, intent_classifier, openai_client
+
+    assert intent_classifier.classify("鈴木さんと田中さんは同じ日にしないで")[0] == "adjust"
+    assert intent_classifier.classify("週末の最小人員を3人に変えて")[0] == "apply"
+    assert intent_classifier.classify("来週の人員不足はどこですか")[0] == "qa"
+    assert intent_classifier.classify("佐藤さんを金曜の夜勤に入れてほしい")[0] == "adjust"
+    # 質問は変更案・プレビューに化けない（qa と判定するか、確信度を下げて LLM に回す）
+    from app.config import INTENT_THRESHOLD
+    for question in ("田中さんと佐藤さんは同じシフトですか？", "最小人員を変更すべきですか？", "シフトを均等にするにはどうすればいいですか？"):
+        label, confidence = intent_classifier.classify(question)
+        assert label == "qa" or confidence < INTENT_THRESHOLD, (question, label, confidence)
+    assert intent_classifier.classify("シフトを均等にするにはどうすればいいですか？")[0] == "qa"
+
+    calls = []
+
+    async def fake_detect(content, ctx, budget=None):
+        calls.append(content)
+        return {"intent": "apply", "confidence": 0.9}
+
+    monkeypatch.setattr(openai_client, "detect_intent", fake_detect)
+    assert asyncio.run(intent.route("auto", "山田さんと鈴木さんを一緒にしないで", {}))[0] == "adjust"
+    assert calls == []
+    # 手元で確信が持てない時だけ LLM に聞く
+    monkeypatch.setattr(intent_classifier, "classify", lambda text: ("qa", 0.4))
+    assert asyncio.run(intent.route("auto", "ふむ", {})) == ("apply", 0.9)
+    assert calls == ["ふむ"]
+
+
+def test_adjustment_prompt_lists_only_matched_employees(monkeypatch):
+    import asyncio
+    from app.services import employee_context, llm_gateway, openai_client
+    from app.services.llm_cache import LLMCache
+
+    surnames = ["田中", "佐藤", "鈴木", "高橋", "伊藤", "渡辺", "山本", "中村", "小林", "加藤"]
+    given = ["太郎", "花子", "一郎", "次郎", "三郎", "美咲", "健太", "陽子", "直樹", "恵子"]
+    employees = [{"id": i + 1, "name": f"{surnames[i % 10]}{given[(i // 10) % 10]}{i // 100 or ''}"} for i in range(300)]
+    sent = []
+
+    async def fake_chat(messages, **kwargs):
+        sent.append(messages[1]["content"])
+        return '{"type": "pair_not_together", "a_employee_id": 1, "b_employee_id": 2}'
+
+    monkeypatch.setattr(openai_client, "_cache", LLMCache(None))
+    monkeypatch.setattr(llm_gateway, "available", lambda api_key=None: True)
+    monkeypatch.setattr(llm_gateway, "chat", fake_chat)
+    before = dict(employee_context.stats)
+
+    asyncio.run(openai_client.generate_adjustment_rule("田中太郎さんと佐藤花子さんを同じシフトに入れない", {"employees": employees}))
+    listed = sent[0].split("\n")[0]
+    assert "田中太郎 (ID: 1)" in listed and "佐藤花子 (ID: 12)" in listed
+    # 同じ姓の人は紛らわしいので少数だけ添える。関係ない姓は載せない
+    assert "鈴木" not in listed
+    assert listed.count("(ID:") == 2 + 5
+
+    assert employee_context.count_tokens("田中太郎 (ID: 1)") < 12
+    stats = employee_context.stats
+    assert stats["requests"] == before["requests"] + 1
+    assert stats["tokens_sent"] - before["tokens_sent"] < (stats["tokens_full"] - before["tokens_full"]) / 4
+
+    # 同姓同名の別人は両方の ID を載せる
+    twins = [{"id": 1, "name": "田中太郎"}, {"id": 2, "name": "佐藤花子"}, {"id": 3, "name": "田中太郎"}]
+    assert [e["id"] for e in employee_context.match_names("田中太郎さんを休みに", twins)] == [1, 3]
+    assert employee_context.prompt_employees("田中太郎さんを休みに", twins) == ["田中太郎 (ID: 1)", "田中太郎 (ID: 3)"]
+
+
+def test_route_speculative_overlaps_generation_and_cancels_misses(monkeypatch):
+    import asyncio
+    import time
+    from app.services import intent, intent_classifier, openai_client
+
+    answer = {"intent": "qa"}
+    cancelled = []
+
+    async def slow_detect(content, ctx, budget=None):
+        await asyncio.sleep(0.1)
+        return {"intent": answer["intent"], "confidence": 0.9}
+
+    async def generate(guess, budget):
+        try:
+            await asyncio.sleep(0.1)
+        except asyncio.CancelledError:
+            cancelled.append(guess)
+            raise
+        return f"{guess} result"
+
+    monkeypatch.setattr(openai_client, "detect_intent", slow_detect)
+    monkeypatch.setattr(intent_classifier, "classify", lambda text: ("qa", 0.4))
+
+    t = time.perf_counter()
+    got = asyncio.run(intent.route_speculative("auto", "ふむ", {}, generate))
+    assert got == ("qa", 0.9, "qa result")
+    assert time.perf_counter() - t < 0.18          # 判定と生成が重なっている
+
+    answer["intent"] = "adjust"
+    got = asyncio.run(intent.route_speculative("auto", "ふむ", {}, generate))
+    assert got == ("adjust", 0.9, None)
+    assert cancelled == ["qa"]
+
+    # 手元で決まる時は何も先行させない
+    monkeypatch.setattr(intent_classifier, "classify", lambda text: ("adjust", 0.95))
+    assert asyncio.run(intent.route_speculative("auto", "ふむ", {}, generate)) == ("adjust", 0.95, None)
+
+    # 先行生成は子予算で数える。外れて取り消した分は本番の生成の試行回数を減らさない
+    from app.services.llm_budget import Budget
+    monkeypatch.setattr(intent_classifier, "classify", lambda text: ("qa", 0.4))
+
+    async def counted_detect(content, ctx, budget=None):
+        budget.take()
+        await asyncio.sleep(0.05)
+        return {"intent": answer["intent"], "confidence": 0.9}
+
+    async def greedy(guess, budget):
+        while budget.take():   # 再プロンプトを繰り返す生成
+            await asyncio.sleep(0.01)
+        return f"{guess} result"
+
+    monkeypatch.setattr(openai_client, "detect_intent", counted_detect)
+    miss = Budget(deadline_s=5, attempts=4)
+    assert asyncio.run(intent.route_speculative("auto", "ふむ", {}, greedy, miss)) == ("adjust", 0.9, None)
+    assert miss.attempts == 1 and not miss.exhausted
+    answer["intent"] = "qa"
+    hit = Budget(deadline_s=5, attempts=4)
+    assert asyncio.run(intent.route_speculative("auto", "ふむ", {}, greedy, hit)) == ("qa", 0.9, "qa result")
+    assert hit.attempts == 4
@@ -0,0 +1,145 @@
+import json
+import threading
+from datetime import date, time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app import main, store
+from app.services.event_bus import EventBus
+from app.services.shared_state import SharedState, pack_schedule, unpack_schedule
+
+@pytest.fixture
+def shared(tmp_path):
+    store.enable_shared_state(tmp_path, seed={"employees": main._employees_document})
+    yield tmp_path
+    store.disable_shared_state()
+    main.shift_change_requests_db.clear()
+    main.shift_change_requests_by_id.clear()
+    store.set_current_schedule([])
+
+def test_event_bus_fans_out_to_other_workers(tmp_path):
+    got = []
+    done = threading.Event()
+    a = EventBus(tmp_path, lambda m: None)
+    b = EventBus(tmp_path, lambda m: (got.append(m), done.set()))
+    (tmp_path / "dead.sock").touch()
+    try:
+        assert a.publish({"type": "schedule.updated", "schedule_version": 3}) == 1
+        assert done.wait(2)
+        assert got == [{"type": "schedule.updated", "schedule_version": 3}]
+        assert not (tmp_path / "dead.sock").exists()
+    finally:
+        a.close()
+        b.close()
+
+def test_writes_from_other_worker_are_adopted(shared):
+    other = SharedState(shared / "state.db")
+    version, body = other.load("schedule")
+    table = unpack_schedule(main.Shift, body)
+    table.append(main.Shift(id=table.allocate_id(), employee_id=1, date=date(2025, 8, 4), start_time=time(8), end_time=time(16)))
+    other.store("schedule", version + 1, pack_schedule(table))
+
+    store.refresh_shared_state()
+    assert store.schedule_version() == version + 1
+    assert len(main.shifts_db) == 1
+    assert len(store.schedule_changes_since(version)[1]["added"]) == 1
+
+    client = TestClient(main.app)
+    assert client.delete(f"/api/shifts/{main.shifts_db[0].id}").status_code == 200
+    assert other.load("schedule")[0] == version + 2
+    assert len(unpack_schedule(main.Shift, other.load("schedule")[1])) == 0
+
+    # 申請は 1 件 1 ドキュメント、週スナップショットは列指向のまま別ドキュメント
+    client.post("/api/shifts/batch", json={"operations": [{"op": "create", "shift": {
+        "employee_id": 2, "date": "2025-08-05", "start_time": "08:00:00", "end_time": "16:00:00"}}]})
+    r = client.post("/api/shift-change", json={"employee_id": 1, "type": "absence", "date": "2025-08-04"})
+    rid = r.json()["id"]
+    doc = json.loads(other.load(f"shift_change_request:{rid}")[1])
+    assert doc["type"] == "absence" and "snapshot_shifts" not in doc
+    assert len(unpack_schedule(main.Shift, other.load(f"table:shift_change_snapshot:{rid}")[1])) == 1
+    assert client.post(f"/api/shift-change/{rid}/reject").status_code == 200
+    assert other.load(f"shift_change_request:{rid}")[0] == 2 and other.load(f"table:shift_change_snapshot:{rid}")[0] == 1
+
+    main.shift_change_requests_db.clear()
+    main.shift_change_requests_by_id.clear()
+    main.shift_change_snapshots.clear()
+    for name in (f"shift_change_request:{rid}", f"table:shift_change_snapshot:{rid}"):
+        version, body = other.load(name)
+        other.store(name, version + 1, body)
+    store.refresh_shared_state()
+    assert main.shift_change_requests_by_id[rid].status == "rejected"
+    assert [s["employee_id"] for s in client.get("/api/shift-change").json()["requests"][0]["snapshot_shifts"]] == [2]
+    other.close()
+
+def test_remote_events_reach_local_websockets(shared):
+    other = EventBus(shared / "bus", lambda m: None)
+    try:
+        with TestClient(main.app).websocket_connect("/ws/adjustments") as ws:
+            assert ws.receive_json()["type"] == "info"
+            other.publish({"type": "schedule.updated", "schedule_version": 99, "change_set_id": None})
+            assert ws.receive_json()["schedule_version"] == 99
+    finally:
+        other.close()
+
+_OTHER_WORKER = """
+import sys
+from datetime import date, time
+from app.schemas import Shift
+from app.services.shared_state import SharedState, pack_schedule, unpack_schedule
+state = SharedState(sys.argv[1])
+version, body = state.load("schedule")
+table = unpack_schedule(Shift, body)
+print(" ".join(f"{s.id}={s.start_time:%H:%M}-{s.end_time:%H:%M}" for s in table.to_shifts()))
+table.append(Shift(id=table.allocate_id(), employee_id=2, date=date(2025, 8, 5), start_time=time(6, 45), end_time=time(15, 15)))
+state.store("schedule", version + 1, pack_schedule(table))
+"""
+
+def test_nonstandard_time_pairs_survive_between_processes(shared):
+    import subprocess
+    import sys
+    from pathlib import Path
+    from app.services.schedule_table import slot_code
+
+    # このプロセスだけが知っている時間帯（相手のプロセスでは未登録か、別のコードになる）
+    slot_code(time(10, 0), time(14, 0))
+    client = TestClient(main.app)
+    r = client.post("/api/shifts/batch", json={"operations": [{"op": "create", "shift": {
+        "employee_id": 1, "date": "2025-08-04", "start_time": "09:30:00", "end_time": "13:00:00"}}]})
+    assert r.status_code == 200
+
+    out = subprocess.run(
+        [sys.executable, "-c", _OTHER_WORKER, str(shared / "state.db")],
+        cwd=Path(__file__).resolve().parents[1], capture_output=True, text=True, timeout=60,
+    )
+    assert out.returncode == 0, out.stderr
+    assert out.stdout.split() == [f"{main.shifts_db[0].id}=09:30-13:00"]
+
+    store.refresh_shared_state()
+    got = sorted((s.employee_id, s.start_time, s.end_time) for s in main.shifts_db)
+    assert got == [(1, time(9, 30), time(13, 0)), (2, time(6, 45), time(15, 15))]
+
+def test_shared_writes_wait_for_the_lock_off_the_event_loop(shared):
+    import asyncio
+    import time as _time
+    import httpx
+
+    other = SharedState(shared / "state.db")
+
+    async def run():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test") as client:
+            # 他のワーカーが書き込みロックを持っている間に申請を作る
+            other._conn.execute("BEGIN IMMEDIATE")
+            create = asyncio.create_task(client.post("/api/shift-change", json={"employee_id": 1, "type": "absence", "date": "2025-08-04"}))
+            await asyncio.sleep(0.1)
+            t0 = _time.perf_counter()
+            assert (await client.get("/api/shifts/warnings")).status_code == 200
+            elapsed = _time.perf_counter() - t0
+            assert not create.done()
+            other._conn.execute("COMMIT")
+            return elapsed, await create
+
+    elapsed, created = asyncio.run(run())
+    other.close()
+    assert elapsed < 0.5
+    assert created.status_code == 200
@@ -0,0 +1,275 @@
+import pytest
+from datetime import date, time, timedelta
+from fastapi.testclient import TestClient
+
+from app import main, store
+
+def _seed(days: int = 7, employees: int = 6):
+    start = date(2025, 8, 4)
+    slots = [(time(8, 0), time(16, 0)), (time(16, 0), time(0, 0)), (time(0, 0), time(8, 0))]
+    shifts = []
+    for d in range(days):
+        for emp in range(1, employees + 1):
+            st, et = slots[(emp + d) % 3]
+            shifts.append(main.Shift(id=len(shifts) + 1, employee_id=emp, date=start + timedelta(days=d), start_time=st, end_time=et))
+    store.set_current_schedule(shifts)
+
+@pytest.fixture
+def client():
+    _seed()
+    yield TestClient(main.app)
+    main.shift_change_requests_db.clear()
+    main.shift_change_requests_by_id.clear()
+    store.set_current_schedule([])
+
+def test_shifts_etag_and_not_modified(client: TestClient):
+    r = client.get("/api/shifts")
+    assert r.status_code == 200
+    assert r.json()["total"] == 42
+    assert r.json()["shifts"][0]["start_time"] == "16:00:00"
+    etag = r.headers["ETag"]
+
+    r2 = client.get("/api/shifts", headers={"If-None-Match": etag})
+    assert r2.status_code == 304
+    assert r2.headers["ETag"] == etag
+
+    assert client.delete("/api/shifts/1").status_code == 200
+    r3 = client.get("/api/shifts", headers={"If-None-Match": etag})
+    assert r3.status_code == 200
+    assert r3.json()["total"] == 41
+    assert r3.headers["ETag"] != etag
+
+def test_employees_etag_follows_master_version(client: TestClient):
+    r = client.get("/api/employees")
+    assert r.status_code == 200
+    etag = r.headers["ETag"]
+    assert client.get("/api/employees", headers={"If-None-Match": etag}).status_code == 304
+
+    main.sync_employees_cache()
+    assert client.get("/api/employees", headers={"If-None-Match": etag}).status_code == 200
+
+def test_shift_changes_since_version(client: TestClient, monkeypatch):
+    from collections import deque
+    monkeypatch.setattr(store, "_change_log", deque(maxlen=3))
+    v0 = store.schedule_version()
+    store.set_current_schedule(main.shifts_db)
+
+    shifts = client.get("/api/shifts").json()["shifts"]
+    moved = dict(shifts[1], start_time="00:00:00", end_time="08:00:00")
+    assert client.put("/api/shifts/2", json=moved).status_code == 200
+    assert client.delete("/api/shifts/3").status_code == 200
+
+    r = client.get("/api/shifts/changes", params={"since": v0 + 1}).json()
+    assert r["full"] is False
+    assert r["schedule_version"] == v0 + 3
+    assert [s["id"] for s in r["removed"]] == [3]
+    assert r["added"] == []
+    assert r["updated"][0]["before"]["start_time"] == shifts[1]["start_time"]
+    assert r["updated"][0]["after"]["start_time"] == "00:00:00"
+
+    assert client.get("/api/shifts/changes", params={"since": v0 + 3}).json()["updated"] == []
+
+    for _ in range(3):
+        store.set_current_schedule(main.shifts_db)
+    full = client.get("/api/shifts/changes", params={"since": v0 + 1}).json()
+    assert full["full"] is True
+    assert len(full["shifts"]) == 41
+
+def test_shifts_range_filter_and_cursor(client: TestClient):
+    r = client.get("/api/shifts", params={"from": "2025-08-05", "to": "2025-08-06", "limit": 5, "fields": "id,date,employee_id"})
+    assert r.status_code == 200
+    page = r.json()
+    assert page["total"] == 12
+    assert len(page["shifts"]) == 5
+    assert set(page["shifts"][0]) == {"id", "date", "employee_id"}
+    seen = [s["id"] for s in page["shifts"]]
+    while page["next_cursor"]:
+        page = client.get("/api/shifts", params={"from": "2025-08-05", "to": "2025-08-06", "limit": 5, "cursor": page["next_cursor"]}).json()
+        seen += [s["id"] for s in page["shifts"]]
+        assert page["total"] == 12
+    assert len(seen) == len(set(seen)) == 12
+    assert all("2025-08-05" <= s["date"] <= "2025-08-06" for s in client.get("/api/shifts", params={"from": "2025-08-05", "to": "2025-08-06"}).json()["shifts"])
+
+    early = client.get("/api/shifts", params={"employee_id": 2, "slot": "early"}).json()["shifts"]
+    assert early and all(s["employee_id"] == 2 and s["start_time"] == "08:00:00" for s in early)
+    assert client.get("/api/shifts", params={"slot": "noon"}).status_code == 400
+    assert client.get("/api/shifts", params={"fields": "id,secret"}).status_code == 400
+
+def test_batch_is_atomic_with_single_version_bump(client: TestClient):
+    v0 = store.schedule_version()
+    q = store.subscribe_queue()
+    try:
+        bad = client.post("/api/shifts/batch", json={"operations": [
+            {"op": "delete", "id": 1},
+            {"op": "delete", "id": 999},
+        ]})
+        assert bad.status_code == 404
+        assert store.schedule_version() == v0
+        assert main.shifts_db.find_id(1) is not None
+
+        moved = {"employee_id": 5, "date": "2025-08-04", "start_time": "00:00:00", "end_time": "08:00:00"}
+        r = client.post("/api/shifts/batch", json={"operations": [
+            {"op": "update", "id": 2, "shift": moved},
+            {"op": "delete", "id": 3},
+            {"op": "delete", "id": 4},
+            {"op": "create", "shift": {"employee_id": 6, "date": "2025-08-11", "start_time": "08:00:00", "end_time": "16:00:00"}},
+        ]})
+        assert r.status_code == 200
+        body = r.json()
+        assert body["deleted"] == [3, 4]
+        assert body["schedule_version"] == v0 + 1
+        assert len(main.shifts_db) == 41
+        assert main.shifts_db[main.shifts_db.find_id(2)].employee_id == 5
+        assert q.qsize() == 1 and q.get_nowait()["type"] == "schedule.updated"
+    finally:
+        store.unsubscribe_queue(q)
+
+def test_ids_are_monotonic_after_delete(client: TestClient):
+    next_id = main.shifts_db.ids.peek()
+    assert client.delete("/api/shifts/42").status_code == 200
+    assert client.delete("/api/shifts/5").status_code == 200
+    r = client.post("/api/shifts/batch", json={"operations": [
+        {"op": "create", "shift": {"employee_id": 1, "date": "2025-08-11", "start_time": "08:00:00", "end_time": "16:00:00"}},
+    ]})
+    assert r.json()["created"][0]["id"] == next_id
+    assert main.shifts_db.find_id(5) is None
+    ids = main.shifts_db.rows["id"].tolist()
+    assert len(ids) == len(set(ids)) == 41
+    assert all(main.shifts_db[main.shifts_db.find_id(i)].id == i for i in ids)
+
+    first = client.post("/api/shift-change", json={"employee_id": 1, "type": "absence", "date": "2025-08-04"}).json()
+    second = client.post("/api/shift-change", json={"employee_id": 2, "type": "absence", "date": "2025-08-04"}).json()
+    assert second["id"] == first["id"] + 1
+    assert client.post(f"/api/shift-change/{second['id']}/reject").json()["status"] == "rejected"
+    assert client.post("/api/shift-change/9999/reject").status_code == 404
+
+def test_schedule_updated_delta_patches_client_copy(client: TestClient):
+    store.publish_schedule_updated()
+    local = {s["id"]: {k: s[k] for k in ("employee_id", "date", "start_time", "end_time")} for s in client.get("/api/shifts").json()["shifts"]}
+    version = store.schedule_version()
+    q = store.subscribe_queue()
+
+    def patch(added, removed, updated):
+        for row in added + updated:
+            local[row["id"]] = {k: row[k] for k in ("employee_id", "date", "start_time", "end_time")}
+        for sid in removed:
+            local.pop(sid)
+
+    try:
+        moved = dict(local[2], start_time="00:00:00", end_time="08:00:00")
+        assert client.put("/api/shifts/2", json=moved).status_code == 200
+        msg = q.get_nowait()
+        assert msg["base_version"] == version and msg["delta"]["updated"][0]["start_time"] == "00:00:00"
+        patch(**msg["delta"])
+        version = msg["schedule_version"]
+
+        # 溜まった 2 件はまとめられ、delta の代わりに base_version からの取り直しになる
+        assert client.delete("/api/shifts/3").status_code == 200
+        assert client.post("/api/shifts/batch", json={"operations": [
+            {"op": "create", "shift": {"employee_id": 6, "date": "2025-08-11", "start_time": "08:00:00", "end_time": "16:00:00"}},
+        ]}).status_code == 200
+        assert q.qsize() == 1
+        msg = q.get_nowait()
+        assert msg["base_version"] == version and msg["delta"] is None
+        changes = client.get("/api/shifts/changes", params={"since": version}).json()
+        patch(changes["added"], [r["id"] for r in changes["removed"]], [u["after"] for u in changes["updated"]])
+    finally:
+        store.unsubscribe_queue(q)
+
+    current = {s["id"]: {k: s[k] for k in ("employee_id", "date", "start_time", "end_time")} for s in client.get("/api/shifts").json()["shifts"]}
+    assert local == current
+
+def test_shift_warnings_follow_edits(client: TestClient):
+    store.publish_schedule_updated()
+    q = store.subscribe_queue()
+
+    def by_type():
+        body = client.get("/api/shifts/warnings").json()
+        assert body["schedule_version"] == store.schedule_version()
+        return {w["type"]: w for w in body["structured_warnings"]}
+
+    try:
+        assert "insufficient_staff" not in by_type()
+        # 8/4 の遅番は 1 と 4 の 2 人。1 を消すと 1 人になる
+        assert client.delete("/api/shifts/1").status_code == 200
+        msg = q.get_nowait()
+        assert msg["warnings"]["added"] == [{"type": "insufficient_staff", "date": "2025-08-04"}]
+        # 1 の 8/4 遅番 -> 8/5 夜勤 -> 8/6 早番 の連続も切れる
+        assert [w["employee_id"] for w in msg["warnings"]["resolved"]] == [1]
+        assert by_type()["insufficient_staff"]["affected_dates"] == ["2025-08-04"]
+
+        assert client.post("/api/shifts/batch", json={"operations": [
+            {"op": "create", "shift": {"employee_id": 5, "date": "2025-08-04", "start_time": "08:00:00", "end_time": "16:00:00"}},
+            {"op": "create", "shift": {"employee_id": 5, "date": "2025-08-04", "start_time": "16:00:00", "end_time": "00:00:00"}},
+        ]}).status_code == 200
+        msg = q.get_nowait()
+        assert msg["warnings"]["resolved"] == [{"type": "insufficient_staff", "date": "2025-08-04"}]
+        # 5 は 8/4 の夜勤 -> 早番 -> 遅番 と 3 枠続く
+        assert {"type": "consecutive_timeslots", "employee_id": 5,
+                "affected_dates": ["2025-08-04_00:00", "2025-08-04_08:00", "2025-08-04_16:00"]} in msg["warnings"]["added"]
+        current = by_type()
+        assert "insufficient_staff" not in current
+        assert 5 in current["consecutive_timeslots"]["affected_employees"]
+    finally:
+        store.unsubscribe_queue(q)
+
+def test_compact_shifts_decode_to_json_form(client: TestClient):
+    import msgpack
+    from app.services import wire
+
+    plain = client.get("/api/shifts").json()["shifts"]
+    r = client.get("/api/shifts", headers={"Accept": wire.COMPACT_JSON})
+    assert r.headers["content-type"].startswith(wire.COMPACT_JSON)
+    assert r.headers["ETag"] != client.get("/api/shifts").headers["ETag"]
+    cols = r.json()["shifts"]
+    base = date.fromisoformat(cols["base_date"])
+    decoded = [
+        {
+            "id": cols["id"][i],
+            "employee_id": cols["employee_id"][i],
+            "date": (base + timedelta(days=cols["day"][i])).isoformat(),
+            "start_time": cols["slots"][cols["slot"][i]].split("-")[0] + ":00",
+        }
+        for i in range(cols["n"])
+    ]
+    assert decoded == [{k: s[k] for k in ("id", "employee_id", "date", "start_time")} for s in plain]
+    assert len(r.content) < len(client.get("/api/shifts").content) / 2
+
+    page = client.get("/api/shifts", params={"employee_id": 2, "fields": "id,date"}, headers={"Accept": "compact"}).json()
+    assert set(page["shifts"]) == {"n", "base_date", "slots", "id", "day"} and page["shifts"]["n"] == 7
+
+    r = client.get("/api/shifts", headers={"Accept": f"{wire.MSGPACK}, application/json;q=0.5"})
+    assert r.headers["content-type"].startswith(wire.MSGPACK)
+    assert msgpack.unpackb(r.content)["shifts"] == cols
+    with client.websocket_connect("/ws/adjustments?encoding=msgpack") as ws:
+        assert msgpack.unpackb(ws.receive_bytes())["type"] == "info"
+
+def test_new_time_pairs_are_rejected_once_slot_registry_is_full(client: TestClient, monkeypatch):
+    from app.services import schedule_table
+    monkeypatch.setattr(schedule_table, "MAX_SLOTS", len(schedule_table._slot_times))
+    before = client.get("/api/shifts").json()["shifts"]
+    odd = dict(before[0], start_time="07:13:00", end_time="11:47:00")
+    r = client.put(f"/api/shifts/{odd['id']}", json=odd)
+    assert r.status_code == 400 and "上限" in r.json()["detail"]
+    assert client.get("/api/shifts").json()["shifts"] == before
+    # 登録済みの時間帯はそのまま使える
+    known = dict(before[0], start_time="00:00:00", end_time="08:00:00")
+    assert client.put(f"/api/shifts/{known['id']}", json=known).status_code == 200
+
+def test_employee_import_swaps_master_only_after_all_rows_validate(client: TestClient):
+    original = list(main.employees_db)
+    try:
+        r0 = client.get("/api/employees")
+        bad = "id,name,role,skill_level\n901,新人 一郎,staff,3\n902,新人 二郎,staff,99\n"
+        r = client.post("/api/employees/import", files={"file": ("e.csv", bad.encode("utf-8"), "text/csv")})
+        assert r.status_code == 400 and "行 3" in r.json()["detail"]
+        assert main.employees_db == original
+        assert client.get("/api/employees", headers={"If-None-Match": r0.headers["ETag"]}).status_code == 304
+
+        good = "id,name,role,skill_level\n901,新人 一郎,staff,3\n"
+        assert client.post("/api/employees/import", files={"file": ("e.csv", good.encode("utf-8"), "text/csv")}).status_code == 200
+        r1 = client.get("/api/employees", headers={"If-None-Match": r0.headers["ETag"]})
+        assert r1.status_code == 200 and [e["id"] for e in r1.json()["employees"]] == [901]
+    finally:
+        main.employees_db[:] = original
+        main.sync_employees_cache()
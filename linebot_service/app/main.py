@@ -1,6 +1,6 @@
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from typing import Any, Dict, Optional
 import json as _json
 import os
@@ -15,6 +15,7 @@ from linebot.v3.exceptions import InvalidSignatureError
 from linebot.v3.webhooks import MessageEvent, TextMessageContent
 
 from .config import settings
+from . import metrics
 
 
 app = FastAPI(title="LINE Bot Service", version="0.1.0")
@@ -40,6 +41,8 @@ if settings.gemini_api_key and genai:
     genai.configure(api_key=settings.gemini_api_key)
 
 logger = logging.getLogger("linebot_service")
+
+GEMINI_MODEL = "gemini-2.5-flash"
 if not logger.handlers:
     logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s - %(message)s")
 
@@ -118,14 +121,16 @@ def parse_with_gemini(message_text: str, today_iso: str) -> Dict[str, Any]:
         }
     # Structured output per official docs: force JSON only
     model = genai.GenerativeModel(
-        "gemini-2.5-flash",
+        GEMINI_MODEL,
         generation_config={
             "response_mime_type": "application/json",
             "temperature": 0.2,
         },
     )
     prompt = f"今日は {today_iso} です。次のメッセージを解析: {message_text}\n{PROMPT}"
-    resp = model.generate_content(prompt)
+    with metrics.track("parse", GEMINI_MODEL) as call:
+        resp = model.generate_content(prompt)
+        call.usage_from(resp)
     text = resp.text or "{}"
     try:
         logger.info("Gemini response: %s", text)
@@ -141,6 +146,7 @@ def parse_with_gemini(message_text: str, today_iso: str) -> Dict[str, Any]:
                 logger.exception("Failed to parse fenced JSON from Gemini")
         else:
             logger.exception("Failed to parse with Gemini")
+        metrics.count("invalid_output", "parse")
         return {
             "intent": "cancel_request",
             "date": today_iso,
@@ -179,7 +185,7 @@ def generate_confirmation_message(parsed: Dict[str, Any], today_iso: str, origin
     }.get(intent, "取消/不明")
 
     model = genai.GenerativeModel(
-        "gemini-2.5-flash",
+        GEMINI_MODEL,
         generation_config={
             "response_mime_type": "text/plain",
             "temperature": 0.2,
@@ -201,10 +207,13 @@ def generate_confirmation_message(parsed: Dict[str, Any], today_iso: str, origin
     )
 
     try:
-        resp = model.generate_content(prompt)
+        with metrics.track("confirm", GEMINI_MODEL) as call:
+            resp = model.generate_content(prompt)
+            call.usage_from(resp)
         text = (resp.text or "").strip()
         # basic guard if model returns empty
         if not text:
+            metrics.count("invalid_output", "confirm")
             raise ValueError("empty confirmation")
         logger.info("Generated confirmation message: %s", text)
         return text
@@ -225,6 +234,14 @@ async def healthz() -> Dict[str, Any]:
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def llm_metrics(format: str = "json"):
+    """Gemini call metrics; ?format=prometheus for the text exposition format."""
+    if format == "prometheus":
+        return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+    return metrics.snapshot()
+
+
 @app.post("/callback")
 async def callback(request: Request) -> JSONResponse:
     signature = request.headers.get("X-Line-Signature")
@@ -0,0 +1,145 @@
+"""Gemini call metrics (latency, tokens, outcome classes).
+
+Same shape as the backend's llm_metrics so both services can be scraped the same way:
+calls per (op, model, outcome), latency histograms per (op, model), token totals and
+named event counters (e.g. invalid_output). Each call also logs one JSON "llm_call" line.
+"""
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger("linebot_service")
+
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 60.0)
+
+
+def classify_error(e: BaseException) -> str:
+    name = type(e).__name__
+    if isinstance(e, TimeoutError) or name in ("DeadlineExceeded", "ReadTimeout", "ConnectTimeout"):
+        return "timeout"
+    if name in ("ResourceExhausted", "TooManyRequests"):
+        return "rate_limit"
+    if name in ("ServiceUnavailable", "ConnectError"):
+        return "connection"
+    if name.endswith("Error") and name not in ("ValueError", "TypeError", "KeyError", "AttributeError"):
+        return "api_error"
+    return "error"
+
+
+class _Histogram:
+    __slots__ = ("counts", "total", "n")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def observe(self, v: float) -> None:
+        i = 0
+        while i < len(BUCKETS) and v > BUCKETS[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += v
+        self.n += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        cum, buckets = 0, {}
+        for le, c in zip([*map(str, BUCKETS), "+Inf"], self.counts):
+            cum += c
+            buckets[le] = cum
+        return {"count": self.n, "sum": round(self.total, 6), "buckets": buckets}
+
+
+_lock = threading.Lock()
+_calls: Dict[Tuple[str, str, str], int] = defaultdict(int)
+_latency: Dict[Tuple[str, str], _Histogram] = defaultdict(_Histogram)
+_tokens: Dict[Tuple[str, str, str], int] = defaultdict(int)
+_counters: Dict[Tuple[str, str], int] = defaultdict(int)
+
+
+class Call:
+    def __init__(self, op: str, model: str):
+        self.op = op
+        self.model = model
+        self.outcome = "ok"
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+        self._t0 = time.perf_counter()
+
+    def usage_from(self, resp: Any) -> None:
+        meta = getattr(resp, "usage_metadata", None)
+        if meta is not None:
+            self.prompt_tokens = getattr(meta, "prompt_token_count", None)
+            self.completion_tokens = getattr(meta, "candidates_token_count", None)
+
+    def __enter__(self) -> "Call":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc is not None:
+            self.outcome = classify_error(exc)
+        latency = time.perf_counter() - self._t0
+        with _lock:
+            _calls[(self.op, self.model, self.outcome)] += 1
+            _latency[(self.op, self.model)].observe(latency)
+            if self.prompt_tokens is not None:
+                _tokens[(self.op, self.model, "prompt")] += self.prompt_tokens
+            if self.completion_tokens is not None:
+                _tokens[(self.op, self.model, "completion")] += self.completion_tokens
+        record = {
+            "event": "llm_call",
+            "provider": "gemini",
+            "op": self.op,
+            "model": self.model,
+            "outcome": self.outcome,
+            "latency_ms": round(latency * 1000, 1),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+        if exc is not None:
+            record["error"] = f"{type(exc).__name__}: {exc}"[:300]
+        (logger.info if self.outcome == "ok" else logger.warning)(json.dumps(record, ensure_ascii=False))
+        return False
+
+
+def track(op: str, model: str) -> Call:
+    return Call(op, model)
+
+
+def count(name: str, op: str, n: int = 1) -> None:
+    with _lock:
+        _counters[(name, op)] += n
+
+
+def snapshot() -> Dict[str, Any]:
+    with _lock:
+        return {
+            "calls": [{"op": o, "model": m, "outcome": r, "count": c} for (o, m, r), c in sorted(_calls.items())],
+            "latency_seconds": [{"op": o, "model": m, **h.to_dict()} for (o, m), h in sorted(_latency.items())],
+            "tokens": [{"op": o, "model": m, "kind": k, "count": c} for (o, m, k), c in sorted(_tokens.items())],
+            "counters": [{"name": n, "op": o, "count": c} for (n, o), c in sorted(_counters.items())],
+        }
+
+
+def _labels(**kv: str) -> str:
+    return "{" + ",".join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in kv.items()) + "}"
+
+
+def render_prometheus() -> str:
+    snap = snapshot()
+    lines: List[str] = ["# TYPE llm_calls_total counter"]
+    lines += [f"llm_calls_total{_labels(op=c['op'], model=c['model'], outcome=c['outcome'])} {c['count']}" for c in snap["calls"]]
+    lines.append("# TYPE llm_latency_seconds histogram")
+    for h in snap["latency_seconds"]:
+        for le, c in h["buckets"].items():
+            lines.append(f"llm_latency_seconds_bucket{_labels(op=h['op'], model=h['model'], le=le)} {c}")
+        lines.append(f"llm_latency_seconds_sum{_labels(op=h['op'], model=h['model'])} {h['sum']}")
+        lines.append(f"llm_latency_seconds_count{_labels(op=h['op'], model=h['model'])} {h['count']}")
+    lines.append("# TYPE llm_tokens_total counter")
+    lines += [f"llm_tokens_total{_labels(op=t['op'], model=t['model'], kind=t['kind'])} {t['count']}" for t in snap["tokens"]]
+    lines.append("# TYPE llm_events_total counter")
+    lines += [f"llm_events_total{_labels(name=c['name'], op=c['op'])} {c['count']}" for c in snap["counters"]]
+    return "\n".join(lines) + "\n"